@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Agrégats du tableau de bord, tenus à jour par des triggers SQLite à chaque
+écriture dans users, worlds et flags (scanner, API, add_user/add_flag...) :
+
+    user_flag_counts   nombre de flags par utilisateur
+    flag_base_counts   nombre de captures par base de flag (flags "base:suffixe")
+    filiere_progress   utilisateurs et flags par filière ('' si inconnue)
+    db_totals          users, worlds, flags, flag_bases
+
+Les lectures (/api/stats, /api/users) ne dépendent plus du nombre de flags.
+Les tables et triggers sont créés par la migration 4 (migrations.py) ;
+depuis la migration 7, les triggers des flags et des mondes sont sur
+flag_rows et world_rows (voir surrogate_keys.py).
+
+    python aggregates.py             # compare les agrégats aux tables de base
+    python aggregates.py --rebuild   # les recalcule entièrement
+"""
+import argparse
+
+AGGREGATE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS user_flag_counts (
+        username TEXT PRIMARY KEY,
+        flags INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS flag_base_counts (
+        flag_base TEXT PRIMARY KEY,
+        captures INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS filiere_progress (
+        filiere TEXT PRIMARY KEY,
+        users INTEGER NOT NULL,
+        flags INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS db_totals (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )
+    """,
+]
+
+# Valeurs attendues, calculées depuis les tables de base (reconstruction et vérification)
+EXPECTED = {
+    "user_flag_counts": """
+        SELECT username, COUNT(*) FROM flags WHERE username IS NOT NULL GROUP BY username
+    """,
+    "flag_base_counts": """
+        SELECT flag_base, COUNT(*) FROM flags WHERE flag_suffix IS NOT NULL GROUP BY flag_base
+    """,
+    "filiere_progress": """
+        SELECT COALESCE(u.filiere, ''), COUNT(*), COALESCE(SUM(c.flags), 0)
+        FROM users u
+        LEFT JOIN (SELECT username, COUNT(*) AS flags FROM flags GROUP BY username) c
+            ON c.username = u.username
+        GROUP BY COALESCE(u.filiere, '')
+    """,
+    "db_totals": """
+        SELECT 'users', COUNT(*) FROM users
+        UNION ALL SELECT 'worlds', COUNT(*) FROM worlds
+        UNION ALL SELECT 'flags', COUNT(*) FROM flags
+        UNION ALL SELECT 'flag_bases', COUNT(DISTINCT flag_base) FROM flags WHERE flag_suffix IS NOT NULL
+    """,
+}
+
+
+# Colonnes d'un flag lues par les triggers : expression SQL par colonne ({row} : NEW ou OLD)
+FLAG_COLUMNS = {
+    "username": "{row}.username",
+    "flag_base": "{row}.flag_base",
+    "flag_suffix": "{row}.flag_suffix",
+}
+
+
+def _flag_delta(row, sign, columns=FLAG_COLUMNS):
+    """Corps de trigger : effet de l'ajout (+1) ou du retrait (-1) du flag 'row' (NEW/OLD)."""
+    n = f"{sign:+d}"
+    username, flag_base, flag_suffix = (
+        columns[name].format(row=row) for name in ("username", "flag_base", "flag_suffix")
+    )
+    return f"""
+        INSERT INTO user_flag_counts (username, flags) SELECT {username}, {n}
+            WHERE {username} IS NOT NULL
+            ON CONFLICT (username) DO UPDATE SET flags = flags {n};
+        DELETE FROM user_flag_counts WHERE username = {username} AND flags <= 0;
+        INSERT INTO flag_base_counts (flag_base, captures) SELECT {flag_base}, {n}
+            WHERE {flag_suffix} IS NOT NULL
+            ON CONFLICT (flag_base) DO UPDATE SET captures = captures {n};
+        UPDATE db_totals SET value = value {n}
+            WHERE name = 'flag_bases' AND {flag_suffix} IS NOT NULL
+              AND COALESCE((SELECT captures FROM flag_base_counts WHERE flag_base = {flag_base}), 0)
+                  = {1 if sign > 0 else 0};
+        DELETE FROM flag_base_counts WHERE flag_base = {flag_base} AND captures <= 0;
+        UPDATE db_totals SET value = value {n} WHERE name = 'flags';
+        UPDATE filiere_progress SET flags = flags {n}
+            WHERE filiere = (SELECT COALESCE(filiere, '') FROM users WHERE username = {username});
+    """
+
+
+def _user_delta(row, sign):
+    """Corps de trigger : effet de l'ajout (+1) ou du retrait (-1) de l'utilisateur 'row'."""
+    n = f"{sign:+d}"
+    own_flags = f"COALESCE((SELECT flags FROM user_flag_counts WHERE username = {row}.username), 0)"
+    return f"""
+        UPDATE db_totals SET value = value {n} WHERE name = 'users';
+        INSERT INTO filiere_progress (filiere, users, flags)
+            SELECT COALESCE({row}.filiere, ''), {n}, {n} * {own_flags} WHERE true
+            ON CONFLICT (filiere) DO UPDATE SET
+                users = users {n}, flags = flags + {n} * {own_flags};
+        DELETE FROM filiere_progress WHERE filiere = COALESCE({row}.filiere, '') AND users <= 0;
+    """
+
+
+def flag_triggers(table="flags", columns=FLAG_COLUMNS, watched="username, flag_base, flag_suffix"):
+    """Triggers d'agrégats de la table des flags 'table' (watched : colonnes suivies en UPDATE)."""
+    return [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_insert AFTER INSERT ON {table}
+        BEGIN {_flag_delta('NEW', 1, columns)} END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_delete AFTER DELETE ON {table}
+        BEGIN {_flag_delta('OLD', -1, columns)} END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_update AFTER UPDATE OF {watched} ON {table}
+        BEGIN {_flag_delta('OLD', -1, columns)} {_flag_delta('NEW', 1, columns)} END
+        """,
+    ]
+
+
+def world_triggers(table="worlds"):
+    """Triggers du compteur de mondes sur la table 'table'."""
+    return [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_insert AFTER INSERT ON {table}
+        BEGIN UPDATE db_totals SET value = value + 1 WHERE name = 'worlds'; END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_delete AFTER DELETE ON {table}
+        BEGIN UPDATE db_totals SET value = value - 1 WHERE name = 'worlds'; END
+        """,
+    ]
+
+
+AGGREGATE_TRIGGERS = [
+    *flag_triggers(),
+    f"CREATE TRIGGER IF NOT EXISTS trg_users_insert AFTER INSERT ON users BEGIN {_user_delta('NEW', 1)} END",
+    f"CREATE TRIGGER IF NOT EXISTS trg_users_delete AFTER DELETE ON users BEGIN {_user_delta('OLD', -1)} END",
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_users_update
+    AFTER UPDATE OF username, filiere ON users
+    BEGIN {_user_delta('OLD', -1)} {_user_delta('NEW', 1)} END
+    """,
+    *world_triggers(),
+]
+
+
+def rebuild_aggregates(conn):
+    """Recalcule tous les agrégats depuis les tables de base (sans commit)."""
+    for table, query in EXPECTED.items():
+        conn.execute(f"DELETE FROM {table}")
+        conn.execute(f"INSERT INTO {table} {query}")
+
+
+def check_aggregates(conn):
+    """
+    Compare chaque agrégat à sa valeur recalculée.
+    Retourne {table: nombre de lignes différentes}, vide si tout est cohérent.
+    """
+    mismatches = {}
+    for table, query in EXPECTED.items():
+        stored = {row[0]: row[1:] for row in conn.execute(f"SELECT * FROM {table}")}
+        expected = {row[0]: row[1:] for row in conn.execute(query)}
+        diff = sum(1 for key in stored.keys() | expected.keys() if stored.get(key) != expected.get(key))
+        if diff:
+            mismatches[table] = diff
+    return mismatches
+
+
+if __name__ == "__main__":
+    from update_db import connect_db, initialize_database
+
+    parser = argparse.ArgumentParser(description="Agrégats du tableau de bord")
+    parser.add_argument("--rebuild", action="store_true", help="recalcule entièrement les agrégats")
+    args = parser.parse_args()
+
+    initialize_database()
+    conn = connect_db()
+    mismatches = check_aggregates(conn)
+    print(f"Agrégats incohérents: {mismatches}" if mismatches else "Agrégats cohérents.")
+    if args.rebuild or mismatches:
+        if args.rebuild:
+            rebuild_aggregates(conn)
+            conn.commit()
+            print(f"Agrégats recalculés, vérification: {check_aggregates(conn) or 'OK'}")
+        else:
+            print("Relancer avec --rebuild pour les recalculer.")
+    conn.close()
+    raise SystemExit(1 if mismatches and not args.rebuild else 0)
@@ -4,10 +4,13 @@ import os
 import subprocess
 import sys
 import json
+import math
 from flask import Flask, jsonify, g, render_template, abort, request
 from flask_cors import CORS
 import datetime
-import tqdm
+import threading
+import time
+import requests
 
 
 # --- Import from kerberos.py ---
@@ -27,6 +30,51 @@ try:
     # Assumes depth_first_search_map.py is in the parent directory
     from depth_first_search_map import get_all_rooms as perform_dfs_search
 
+    # Journalisation partagée (file + thread d'écriture, avertissements limités)
+    from log_setup import get_logger
+
+    # Contrôle du scanner résident (scan_daemon.py)
+    from scan_daemon import WRITE_TIMEOUT, send_command as send_scanner_command
+
+    # Écritures : l'écrivain unique du scanner, ou localement s'il ne tourne pas
+    from db_writer import WRITE_OPERATIONS
+
+    # Copie de lecture publiée par l'écrivain (lecture sans verrou)
+    from snapshots import current_snapshot, publish_snapshot
+
+    # Recherche plein texte (FTS5) tenue à jour à l'ingestion
+    from search_index import SEARCH_KINDS, SEARCH_LIMIT, SEARCH_MAX_LIMIT, search
+
+    # Migrations du schéma
+    from migrations import migrate
+
+    # Connexions réutilisées et requêtes partagées avec use_db.py
+    from db_access import (
+        ConnectionPool,
+        open_connection,
+        list_users_json,
+        get_user,
+        db_totals,
+    )
+
+    # Comparaisons d'utilisateurs sur l'index bitmap des bases de flags
+    from flag_bitmaps import RIVALS_K, RIVALS_MAX_K, load_flag_bitmaps, popcount
+
+    # Documents /api/user précalculés à l'ingestion
+    from user_documents import load_user_document
+
+    # Schéma et cache négatif partagés avec le scanner
+    from update_db import (
+        connect_db,
+        create_tables,
+        negative_cache_skip,
+        classify_error,
+        retry_worlds,
+        completeness,
+        position_at,
+        position_trail,
+    )
+
 except ImportError as e:
     print(f"ERREUR: Impossible d'importer depuis les modules parents: {e}")
     # Try to remove the path if it was added, even on error
@@ -40,6 +88,11 @@ except ImportError as e:
 # --- Configuration ---
 DATABASE = os.path.join(PARENT_DIR, "db", "game_data.db")  # Adjusted path
 UPDATE_SCRIPT_PATH = os.path.join(PARENT_DIR, "update_db.py")  # Adjusted path
+SNAPSHOT_DIR = os.path.join(PARENT_DIR, "db", "snapshots")
+ARCHIVE_DIR = os.path.join(PARENT_DIR, "db", "archive")  # partitions mensuelles de l'historique
+QUERY_CACHE_SIZE = 1024  # résultats de query_db gardés pour la génération courante
+USER_DOCUMENT_MAX_AGE = 0  # secondes de cache client de /api/user/<username> (0 : revalidation par ETag)
+POSITIONS_BATCH_SIZE = 200  # mondes relevés par /api/update-worlds avant chaque écriture
 
 # --- Database & Update Script Checks ---
 if not os.path.exists(DATABASE):
@@ -49,52 +102,155 @@ if not os.path.exists(DATABASE):
 if not os.path.exists(UPDATE_SCRIPT_PATH):
     print(f"AVERTISSEMENT: Script d'update non trouvé: {UPDATE_SCRIPT_PATH}")
 
+# Crée les tables ajoutées depuis la création de la DB (cache négatif, etc.)
+# et applique les migrations en attente (index, agrégats, etc.)
+_conn = open_connection(DATABASE)
+with _conn:
+    create_tables(_conn)
+    migrate(_conn)
+_conn.close()
+
 # --- Flask App Initialization ---
 app = Flask(__name__, static_folder="static", template_folder="templates")
 CORS(app)
+log = get_logger("api")
 
 
 # --- Database Connection Management (get_db, close_connection, query_db) ---
-# ... (code inchangé) ...
+# Connexions de lecture gardées d'une requête à l'autre, sur la copie courante
+_read_pool = {"path": None, "pool": None}
+_read_pool_lock = threading.Lock()
+
+
+def read_pool(path, immutable):
+    """Pool de lecture de 'path' ; celui de la copie précédente est fermé au changement."""
+    with _read_pool_lock:
+        if _read_pool["path"] != path:
+            if _read_pool["pool"] is not None:
+                _read_pool["pool"].close()  # connexions empruntées fermées à leur retour
+            _read_pool["path"] = path
+            _read_pool["pool"] = ConnectionPool(
+                path, readonly=True, immutable=immutable, row_factory=sqlite3.Row
+            )
+        return _read_pool["pool"]
+
+
 def get_db():
+    """
+    Connexion en lecture seule : les écritures passent par write_db.
+    Si une copie de lecture est publiée (snapshots.py), c'est elle qui est
+    ouverte, en immutable=1 ; g._generation note alors sa génération.
+    La connexion est empruntée au pool de lecture et rendue en fin de requête.
+    """
     db = getattr(g, "_database", None)
     if db is None:
         try:
+            generation, snapshot = current_snapshot(SNAPSHOT_DIR)
             # Use the absolute path to the database in the parent directory
-            db_path = os.path.abspath(DATABASE)
-            print(f"Connecting to DB: {db_path}")
-            db = g._database = sqlite3.connect(db_path, check_same_thread=False)
-            db.row_factory = sqlite3.Row
+            path = os.path.abspath(snapshot if snapshot is not None else DATABASE)
+            pool = read_pool(path, immutable=snapshot is not None)
+            db = g._database = pool.acquire()
+            g._pool = pool
+            g._generation = generation
         except sqlite3.Error as e:
-            print(f"Erreur connexion DB: {e}")
+            log.error("Erreur connexion DB: %s", e)
             abort(500, description="Erreur connexion DB")
     return db
 
 
+@app.after_request
+def add_snapshot_generation(response):
+    """Génération de la copie lue, utilisable comme clé de cache côté client."""
+    generation = getattr(g, "_generation", None)
+    if generation is not None:
+        response.headers["X-Snapshot-Generation"] = str(generation)
+    return response
+
+
 @app.teardown_appcontext
 def close_connection(exception):
     db = getattr(g, "_database", None)
     if db is not None:
-        db.close()
+        g._pool.release(db)
 
 
-def query_db(query, args=(), one=False):
-    """Helper pour exécuter des requêtes"""
+def write_db(operation, **payload):
+    """
+    Exécute une opération de WRITE_OPERATIONS (db_writer.py) par l'écrivain
+    unique du scanner résident. S'il ne tourne pas, l'opération est faite
+    ici, sur une connexion d'écriture ouverte pour l'occasion.
+    Retourne le résultat de l'opération.
+    """
     try:
-        cur = get_db().execute(query, args)
-        rv = cur.fetchall()
+        response = send_scanner_command(
+            "write", {"operation": operation, "payload": payload}, timeout=WRITE_TIMEOUT + 5
+        )
+    except OSError as e:
+        log.debug("Scanner injoignable (%s), écriture locale.", e)
+        conn = connect_db(os.path.abspath(DATABASE))
+        try:
+            result = WRITE_OPERATIONS[operation](conn, **payload)
+            conn.commit()
+            if current_snapshot(SNAPSHOT_DIR)[0] is not None:
+                publish_snapshot(conn, SNAPSHOT_DIR)  # les lectures suivantes voient l'écriture
+            return result
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    if not response.get("success"):
+        raise RuntimeError(f"Écriture refusée par le scanner: {response.get('error')}")
+    return response["result"]
+
+
+# Une copie de lecture ne change jamais : ses résultats restent valides jusqu'à la suivante
+_query_cache = {"generation": None, "results": {}}
+
+
+def cached_read(key, compute):
+    """
+    compute(db), mis en cache sous 'key' pour la génération de copie lue
+    (sans cache quand l'API lit directement la DB).
+    """
+    global _query_cache
+    db = get_db()
+    generation = g._generation
+    if generation is None:
+        return compute(db)
+    cache = _query_cache
+    if cache["generation"] != generation or len(cache["results"]) >= QUERY_CACHE_SIZE:
+        cache = _query_cache = {"generation": generation, "results": {}}
+    if key not in cache["results"]:
+        cache["results"][key] = compute(db)
+    return cache["results"][key]
+
+
+def query_db(query, args=(), one=False):
+    """Helper pour exécuter des requêtes (résultats mis en cache par génération de copie)"""
+
+    def run(db):
+        rv = db.execute(query, args).fetchall()
         return (dict(rv[0]) if rv else None) if one else [dict(row) for row in rv]
+
+    try:
+        return cached_read((query, tuple(args), one), run)
     except sqlite3.Error as e:
-        print(f"Erreur SQLite: {e}\nQuery: {query}\nArgs: {args}")
+        log.warning("Erreur SQLite: %s\nQuery: %s\nArgs: %s", e, query, args)
         # Return None or raise an exception depending on desired handling
         # Returning None might hide errors, raising could be better
         # For now, let's return None to match existing behavior but log clearly
         return None
     except Exception as e:  # Catch other potential errors during DB interaction
-        print(f"Erreur inattendue pendant query_db: {e}")
+        log.warning("Erreur inattendue pendant query_db: %s", e)
         return None
 
 
+def json_response(body):
+    """Réponse JSON à partir d'un texte déjà encodé (construit par SQLite, voir db_access.*_json)."""
+    return app.response_class(body, mimetype=app.json.mimetype)
+
+
 @app.route("/api/world/<world_id>/live_location", methods=["GET"])
 def get_live_location(world_id):
     """
@@ -172,33 +328,15 @@ def get_live_location(world_id):
 def get_stats():
     """Récupère des statistiques globales."""
     try:
-        user_count_res = query_db(
-            "SELECT COUNT(DISTINCT username) as count FROM users", one=True
-        )
-        user_count = user_count_res["count"] if user_count_res else 0
-
-        world_count_res = query_db(
-            "SELECT COUNT(DISTINCT world_ID) as count FROM worlds", one=True
-        )
-        world_count = world_count_res["count"] if world_count_res else 0
-
-        # Recalculate flag bases correctly
-        flags_raw = query_db("SELECT DISTINCT flag FROM flags")
-        if flags_raw is None:  # query_db might return None on error
-            print("Warning: Failed to fetch flags for stats.")
-            flags_raw = []
-
-        flag_bases = set()
-        for row in flags_raw:
-            flag_value = row.get("flag")
-            if flag_value and ":" in flag_value:
-                base = flag_value.split(":", 1)[0]
-                flag_bases.add(base)
-            # Optionally handle flags without ":" if needed
-            # elif flag_value:
-            #    flag_bases.add(flag_value) # Treat flags without ':' as their own base?
-
-        flag_count = len(flag_bases)
+        # Compteurs tenus à jour par triggers (aggregates.py) : une lecture, quel que soit le volume
+        try:
+            totals = cached_read("db_totals", db_totals)
+        except sqlite3.Error as e:
+            log.warning("Erreur SQLite (totaux des statistiques): %s", e)
+            totals = {}
+        user_count = totals.get("users", 0)
+        world_count = totals.get("worlds", 0)
+        flag_count = totals.get("flag_bases", 0)
 
         return jsonify(
             {
@@ -216,83 +354,125 @@ def get_stats():
         return jsonify({"error": "Impossible de récupérer les statistiques"}), 500
 
 
+@app.route("/api/stats/progress")
+def get_progress_stats():
+    """Progression par filière et nombre de captures par base de flag (agrégats)."""
+    filieres = query_db(
+        "SELECT filiere, users, flags FROM filiere_progress ORDER BY flags DESC"
+    )
+    bases = query_db(
+        "SELECT flag_base, captures FROM flag_base_counts ORDER BY captures DESC, flag_base"
+    )
+    if filieres is None or bases is None:
+        return jsonify({"error": "Impossible de récupérer la progression"}), 500
+    return jsonify({"filieres": filieres, "flag_bases": bases})
+
+
 @app.route("/api/users")
 def get_users():
     """Liste tous les utilisateurs avec quelques infos et compte de flags."""
-    query = """
-        SELECT
-            u.username,
-            u.first_name,
-            u.last_name,
-            u.filiere,
-            u.blocked,
-            COALESCE(fc.flag_count, 0) as flag_count
-        FROM users u
-        LEFT JOIN (
-            SELECT username, COUNT(DISTINCT flag) as flag_count -- Use DISTINCT flag
-            FROM flags
-            GROUP BY username
-        ) fc ON u.username = fc.username
-        ORDER BY u.username COLLATE NOCASE ASC
-    """
-    users = query_db(query)
-    if users is None:  # Check if query_db returned None due to error
+    try:
+        # JSON construit par SQLite : pas de dict Python par utilisateur
+        users = cached_read("list_users_json", list_users_json)
+    except sqlite3.Error as e:
+        log.warning("Erreur SQLite (liste des utilisateurs): %s", e)
         return (
             jsonify({"error": "Erreur lors de la récupération des utilisateurs"}),
             500,
         )
-    return jsonify(users)
+    return json_response(users)
+
+
+@app.route("/api/search")
+def search_entries():
+    """
+    Recherche par préfixe parmi les utilisateurs, salles et bases de flags.
+    Paramètres : q, limit (défaut SEARCH_LIMIT), kind (ex. "user" ou "user,room").
+    """
+    text = request.args.get("q", "")
+    try:
+        limit = int(request.args.get("limit", SEARCH_LIMIT))
+    except ValueError:
+        return jsonify({"error": "Paramètre 'limit' invalide"}), 400
+    if not 1 <= limit <= SEARCH_MAX_LIMIT:
+        return jsonify({"error": f"'limit' doit être entre 1 et {SEARCH_MAX_LIMIT}"}), 400
+    kinds = [kind for kind in request.args.get("kind", "").split(",") if kind]
+    if any(kind not in SEARCH_KINDS for kind in kinds):
+        return jsonify({"error": f"'kind' doit être parmi {', '.join(SEARCH_KINDS)}"}), 400
+    try:
+        results = search(get_db(), text, limit, kinds or None)
+    except sqlite3.Error as e:
+        log.warning("Erreur SQLite (recherche '%s'): %s", text, e)
+        return jsonify({"error": "Erreur lors de la recherche"}), 500
+    return jsonify({"query": text, "results": results})
 
 
 @app.route("/api/user/<username>")
 def get_user_detail(username):
-    """Récupère les détails complets d'un utilisateur."""
-    # Fetch user details or create placeholder if user exists only in flags/worlds
-    user_info = query_db("SELECT * FROM users WHERE username = ?", [username], one=True)
-
-    if user_info is None:
-        # Check if the user exists in other tables before declaring not found
-        exists_in_flags = query_db(
-            "SELECT 1 FROM flags WHERE username = ? LIMIT 1", [username], one=True
-        )
-        exists_in_worlds = query_db(
-            "SELECT 1 FROM worlds WHERE username = ? LIMIT 1", [username], one=True
-        )
+    """
+    Récupère les détails complets d'un utilisateur : document précalculé
+    (user_documents.py), lu par une recherche par clé primaire. Sa
+    version sert d'ETag : un client à jour reçoit 304 sans corps.
+    """
+    try:
+        document, version = cached_read(("user_document", username), lambda db: load_user_document(db, username))
+    except sqlite3.Error as e:
+        log.warning("Erreur SQLite (utilisateur '%s'): %s", username, e)
+        return jsonify({"error": "Erreur lors de la récupération de l'utilisateur"}), 500
+    if document is None:
+        return jsonify({"error": f"Utilisateur '{username}' non trouvé"}), 404
 
-        if not exists_in_flags and not exists_in_worlds:
-            # User truly not found anywhere
-            return jsonify({"error": f"Utilisateur '{username}' non trouvé"}), 404
-        else:
-            # User exists but not in 'users' table, provide minimal info
-            user_info = {
-                "username": username,
-                "first_name": None,  # Explicitly None instead of "N/A"
-                "last_name": None,
-                "email": None,
-                "profile": None,
-                "filiere": None,
-                "blocked": None,  # Status unknown
-                "created_at": None,  # Creation date unknown
-            }
-            print(f"User '{username}' found in flags/worlds but not in users table.")
+    response = json_response(document)
+    if version is not None:  # document à jour (sinon calculé à la volée, pas d'ETag)
+        response.set_etag(str(version))
+        response.cache_control.public = True
+        response.cache_control.max_age = USER_DOCUMENT_MAX_AGE
+        response = response.make_conditional(request)
+    return response
 
-    # Fetch flags (handle potential None from query_db)
-    flags = query_db(
-        "SELECT flag, date FROM flags WHERE username = ? ORDER BY date DESC", [username]
-    )
-    if flags is None:
-        print(f"Warning: Failed to fetch flags for user '{username}'.")
-        flags = []  # Return empty list on error
-
-    # Fetch last position (handle potential None from query_db)
-    position = query_db(
-        "SELECT world_ID, location, room, created_at FROM worlds WHERE username = ? ORDER BY created_at DESC LIMIT 1",
-        [username],
-        one=True,
-    )
-    # No need to check if position is None here, frontend handles it
 
-    return jsonify({"details": user_info, "flags": flags, "last_position": position})
+def epoch_arg(name, default):
+    """
+    Paramètre de requête 'name' en secondes epoch ('default' s'il est absent).
+    None s'il est invalide : illisible, infini ou NaN (que float() accepte),
+    ou hors des dates représentables.
+    """
+    try:
+        value = float(request.args.get(name, default))
+        if not math.isfinite(value):
+            return None
+        datetime.datetime.fromtimestamp(value, datetime.timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        return None
+    return value
+
+
+@app.route("/api/user/<username>/position")
+def get_user_position_at(username):
+    """Salle où se trouvait l'utilisateur à l'instant 'at' (secondes epoch, défaut maintenant)."""
+    when = epoch_arg("at", time.time())
+    if when is None:
+        return jsonify({"error": "Paramètre 'at' invalide (secondes epoch)"}), 400
+    position = position_at(get_db(), username, when, ARCHIVE_DIR)
+    if position is None:
+        return jsonify({"error": f"Aucune position connue pour '{username}' à cette date"}), 404
+    return jsonify(position)
+
+
+@app.route("/api/user/<username>/trail")
+def get_user_trail(username):
+    """Parcours de l'utilisateur entre 'since' et 'until' (secondes epoch, défaut : 24 dernières heures)."""
+    until = epoch_arg("until", time.time())
+    since = epoch_arg("since", until - 24 * 3600) if until is not None else None
+    if since is None or until is None:
+        return jsonify({"error": "Paramètres 'since'/'until' invalides (secondes epoch)"}), 400
+    if since > until:
+        return jsonify({"error": "'since' doit précéder 'until'"}), 400
+    try:
+        trail = position_trail(get_db(), username, since, until, ARCHIVE_DIR)
+    except ValueError as e:  # fenêtre couvrant trop de partitions mensuelles
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"username": username, "since": since, "until": until, "trail": trail})
 
 
 @app.route("/api/compare")
@@ -310,24 +490,11 @@ def compare_users():
             400,
         )
 
-    # Helper function to get flag bases for a user
-    def get_flag_bases(username):
-        flags_raw = query_db("SELECT flag FROM flags WHERE username = ?", [username])
-        if flags_raw is None:  # Handle DB error
-            return None
-        bases = set()
-        for row in flags_raw:
-            flag_value = row.get("flag")
-            if flag_value and ":" in flag_value:
-                bases.add(flag_value.split(":", 1)[0])
-            # elif flag_value: # Decide if non-base flags should be included/handled
-            #     bases.add(flag_value)
-        return bases
-
-    flags1_bases = get_flag_bases(user1)
-    flags2_bases = get_flag_bases(user2)
-
-    if flags1_bases is None or flags2_bases is None:
+    # Index bitmap de tous les utilisateurs, chargé une fois par génération de copie
+    try:
+        index = cached_read("flag_bitmaps", load_flag_bitmaps)
+    except sqlite3.Error as e:
+        log.warning("Erreur SQLite (comparaison %s/%s): %s", user1, user2, e)
         return (
             jsonify(
                 {
@@ -337,30 +504,80 @@ def compare_users():
             500,
         )
 
-    # Perform set operations
-    ahead = sorted(list(flags1_bases - flags2_bases))
-    behind = sorted(list(flags2_bases - flags1_bases))
-    common = sorted(list(flags1_bases & flags2_bases))
+    diff = index.compare(user1, user2)
 
     return jsonify(
         {
             "user1": user1,
             "user2": user2,
-            "ahead_count": len(ahead),
-            "behind_count": len(behind),
-            "common_count": len(common),
-            "ahead": ahead,
-            "behind": behind,
-            "common": common,
+            "ahead_count": popcount(diff["ahead"]),
+            "behind_count": popcount(diff["behind"]),
+            "common_count": popcount(diff["common"]),
+            "ahead": index.bases(diff["ahead"]),
+            "behind": index.bases(diff["behind"]),
+            "common": index.bases(diff["common"]),
         }
     )
 
 
+def _rivals_k():
+    """Paramètre 'k' de /api/rivals, ou None s'il est invalide."""
+    try:
+        k = int(request.args.get("k", RIVALS_K))
+    except ValueError:
+        return None
+    return k if 1 <= k <= RIVALS_MAX_K else None
+
+
+@app.route("/api/rivals/<username>")
+def get_rivals(username):
+    """Les k utilisateurs à la progression la plus proche (Jaccard sur les bases de flags)."""
+    k = _rivals_k()
+    if k is None:
+        return jsonify({"error": f"'k' doit être un entier entre 1 et {RIVALS_MAX_K}"}), 400
+    try:
+        index = cached_read("flag_bitmaps", load_flag_bitmaps)
+        if username not in index.bitmaps and get_user(get_db(), username) is None:
+            return jsonify({"error": f"Utilisateur '{username}' non trouvé"}), 404
+        rivals = cached_read(("rivals", username, k), lambda db: index.rivals(username, k))
+    except sqlite3.Error as e:
+        log.warning("Erreur SQLite (rivaux de '%s'): %s", username, e)
+        return jsonify({"error": "Erreur lors du calcul des rivaux"}), 500
+    return jsonify({"username": username, "k": k, "rivals": rivals})
+
+
+@app.route("/api/rivals")
+def get_all_rivals():
+    """Vue de la promotion : les k plus proches rivaux de chaque utilisateur."""
+    k = _rivals_k()
+    if k is None:
+        return jsonify({"error": f"'k' doit être un entier entre 1 et {RIVALS_MAX_K}"}), 400
+    try:
+        index = cached_read("flag_bitmaps", load_flag_bitmaps)
+        rivals = cached_read(("all_rivals", k), lambda db: index.all_rivals(k))
+    except sqlite3.Error as e:
+        log.warning("Erreur SQLite (rivaux): %s", e)
+        return jsonify({"error": "Erreur lors du calcul des rivaux"}), 500
+    return jsonify({"k": k, "rivals": rivals})
+
+
 # --- DB Update Route (/api/update-db) ---
 # ... (code inchangé) ...
 @app.route("/api/update-db", methods=["POST"])
 def trigger_db_update():
-    """Exécute le script update_db.py."""
+    """
+    Demande un passage complet au scanner résident (commande "rescan") ;
+    s'il ne tourne pas, exécute le script update_db.py.
+    """
+    try:
+        response = send_scanner_command("rescan")
+        if response.get("success"):
+            message = f"Passage complet demandé au scanner résident: {response['worlds']} mondes replanifiés."
+            log.info(message)
+            return jsonify({"success": True, "message": message})
+    except OSError:
+        log.debug("Scanner injoignable, exécution du script d'update.")
+
     update_script_abs_path = os.path.abspath(UPDATE_SCRIPT_PATH)
     if not os.path.exists(update_script_abs_path):
         print(
@@ -389,12 +606,9 @@ def trigger_db_update():
             cwd=PARENT_DIR,  # Run script from the parent directory if it expects relative paths
             env=os.environ.copy(),  # Pass environment variables (like potential DB credentials if used differently)
         )
-        print(f"Script terminé avec le code: {process.returncode}")
-        print("--- Script STDOUT ---")
-        print(process.stdout)
-        print("--- Script STDERR ---")
-        print(process.stderr)
-        print("---------------------")
+        log.info("Script terminé avec le code: %s", process.returncode)
+        log.debug("--- Script STDOUT ---\n%s", process.stdout)
+        log.debug("--- Script STDERR ---\n%s", process.stderr)
 
         if process.returncode == 0:
             # Extract last few lines of output for summary
@@ -450,83 +664,67 @@ def trigger_worlds_update():
     Scanne rapidement les mondes pour mettre à jour uniquement
     la table 'worlds' (position des joueurs).
     """
-    print("Début de la mise à jour rapide des positions (worlds)...")
+    log.info("Début de la mise à jour rapide des positions (worlds)...")
     processed_worlds = 0
     updated_entries = 0
     added_entries = 0
     skipped_worlds = 0
+    cached_worlds = 0
     error_count = 0
+    failures = {}  # world_id -> "empty" | "error", pour le cache négatif
+    recovered = []
+    retry = []  # mondes en erreur transitoire, repris en fin de passage
+    positions = []  # [world_id, user, location, room] des mondes habités, pas encore écrits
 
     try:
         client = KerberosClient()
         world_list = client.list_worlds()
-        print(f"Scan de {len(world_list)} mondes...")
+        log.info("Scan de %d mondes...", len(world_list))
 
         db = get_db()  # Récupère la connexion DB pour ce contexte de requête
-        cursor = db.cursor()
 
-        # Utilise tqdm pour une barre de progression côté serveur (optionnel)
-        for world_info in tqdm.tqdm(world_list, desc="Scanning Worlds", unit=" world"):
+        # Les mondes vides ou en erreur récemment ne sont pas re-sondés avant leur échéance
+        cached = negative_cache_skip(db)
+        cached_worlds = sum(1 for w in world_list if w[0] in cached)
+        world_list = [w for w in world_list if w[0] not in cached]
+
+        def fetch_position(client, world_id):
+            """Appels API pour un monde : (user, location, room), user None si vide."""
+            user = client.user_from_world(world_id)
+            if not user:
+                return None, None, None
+            location = client.location(world_id)
+            room = client.room_name(world_id, location) if location else None
+            return user, location, room
+
+        def collect_position(world_id, user, location, room):
+            nonlocal processed_worlds, skipped_worlds
+            if not user:
+                skipped_worlds += 1
+                failures[world_id] = "empty"
+            else:
+                positions.append([world_id, user, location, room])
+                processed_worlds += 1
+                recovered.append(world_id)
+            if len(positions) + len(failures) >= POSITIONS_BATCH_SIZE:
+                flush_positions()
+
+        def flush_positions():
+            """Écrit les positions et échecs relevés depuis la dernière écriture (voir apply_positions)."""
+            nonlocal added_entries, updated_entries
+            if not (positions or failures or recovered):
+                return
+            counts = write_db("positions", positions=positions, failures=failures, recovered=recovered)
+            added_entries += counts["added"]
+            updated_entries += counts["updated"]
+            positions.clear()
+            failures.clear()
+            recovered.clear()
+
+        for world_info in world_list:
             world_id = world_info[0]  # world_list contient des tuples/listes [id, ...]
-            user = None  # Réinitialiser pour chaque monde
             try:
-                user = client.user_from_world(world_id)
-                if not user:
-                    # print(f"  -> Aucun utilisateur pour {world_id}, skip.")
-                    skipped_worlds += 1
-                    continue
-
-                location = client.location(world_id)
-                room = client.room_name(world_id, location) if location else None
-
-                # Logique d'insertion/mise à jour similaire à add_world de update_db.py
-                # mais directement ici avec le curseur actuel.
-                cursor.execute(
-                    "SELECT location, room FROM worlds WHERE username = ? AND world_ID = ?",
-                    (user, world_id),
-                )
-                existing_entry = cursor.fetchone()
-
-                current_time_iso = datetime.datetime.now().isoformat()
-
-                if existing_entry:
-                    # Convert row to dict if row_factory was used, otherwise access by index
-                    current_location = (
-                        existing_entry["location"]
-                        if isinstance(existing_entry, sqlite3.Row)
-                        else existing_entry[0]
-                    )
-                    current_room = (
-                        existing_entry["room"]
-                        if isinstance(existing_entry, sqlite3.Row)
-                        else existing_entry[1]
-                    )
-
-                    if location != current_location or room != current_room:
-                        cursor.execute(
-                            """
-                            UPDATE worlds
-                            SET location = ?, room = ?, created_at = ?
-                            WHERE username = ? AND world_ID = ?
-                            """,
-                            (location, room, current_time_iso, user, world_id),
-                        )
-                        updated_entries += 1
-                    # else: # Entry exists and is identical, do nothing
-                    # pass
-                else:
-                    # Insert new entry
-                    cursor.execute(
-                        """
-                        INSERT INTO worlds (username, world_ID, location, room, created_at)
-                        VALUES (?, ?, ?, ?, ?)
-                        """,
-                        (user, world_id, location, room, current_time_iso),
-                    )
-                    added_entries += 1
-
-                db.commit()  # Commit après chaque ajout/màj réussie ou à la fin
-                processed_worlds += 1
+                collect_position(world_id, *fetch_position(client, world_id))
 
             except (
                 ValueError,
@@ -535,52 +733,105 @@ def trigger_worlds_update():
                 RuntimeError,
                 TypeError,
                 KeyError,
+                requests.RequestException,
             ) as api_err:
-                print(
-                    f"Erreur API Kerberos pour monde {world_id} (User: {user}): {type(api_err).__name__} - {api_err}"
+                log.warning(
+                    "Erreur API Kerberos pour monde %s: %s - %s", world_id, type(api_err).__name__, api_err
                 )
-                error_count += 1
-                db.rollback()  # Annule la transaction pour ce monde si erreur API/DB
+                if classify_error(api_err) == "transient":
+                    retry.append(world_id)  # repris en fin de passage
+                else:
+                    error_count += 1
+                    failures[world_id] = "error"
                 continue  # Passe au monde suivant
-            except sqlite3.Error as db_err:
-                print(f"Erreur DB pour monde {world_id} (User: {user}): {db_err}")
+
+        # File de reprise : appels API en parallèle limité
+        for world_id, position, error in retry_worlds(retry, fetch_position, KerberosClient):
+            if error is not None:
+                log.warning(
+                    "Échec définitif pour monde %s: %s - %s", world_id, type(error).__name__, error
+                )
                 error_count += 1
-                db.rollback()  # Annule la transaction pour ce monde
-                continue  # Passe au monde suivant
+                failures[world_id] = "error"
+            else:
+                collect_position(world_id, *position)
 
-        # Fin de la boucle
-        # Commit final (au cas où le dernier commit dans la boucle n'a pas été fait)
-        db.commit()
+        # Dernier lot, par l'écrivain du scanner comme les précédents
+        flush_positions()
 
         summary = (
             f"MAJ Positions terminée.\n"
             f"Mondes traités: {processed_worlds}\n"
             f"Mondes sans user/skippés: {skipped_worlds}\n"
+            f"Mondes ignorés (cache négatif): {cached_worlds}\n"
             f"Entrées MàJ: {updated_entries}\n"
             f"Entrées Ajoutées: {added_entries}\n"
-            f"Erreurs rencontrées: {error_count}"
+            f"Mondes repris: {len(retry)}\n"
+            f"Erreurs rencontrées: {error_count}\n"
+            f"Complétude: {completeness(processed_worlds + skipped_worlds, len(world_list))}%"
         )
-        print(summary)
+        log.info(summary)
         return jsonify({"success": True, "message": summary})
 
     except Exception as e:
         # Erreur générale (ex: connexion Kerberos initiale, liste des mondes impossible...)
         error_msg = f"Erreur générale lors de la mise à jour des positions: {type(e).__name__} - {e}"
-        print(error_msg)
-        import traceback
-
-        traceback.print_exc()
-        # Assurer un rollback en cas d'erreur générale avant la boucle ou pendant l'init
-        try:
-            get_db().rollback()
-        except Exception as rollback_err:
-            print(f"Erreur lors du rollback général: {rollback_err}")
-
+        log.exception(error_msg)
         return jsonify({"success": False, "error": error_msg}), 500
     # finally: # La connexion DB est gérée par le contexte Flask (@teardown_appcontext)
     #     pass
 
 
+# --- Contrôle du scanner résident (scan_daemon.py) ---
+# Commandes transmises par /api/scanner/control -> paramètres acceptés
+CONTROL_COMMANDS = {
+    "pause": (),
+    "resume": (),
+    "set_rate": ("rate",),
+    "boost": ("world_id",),
+    "rescan": (),
+    "stop": (),
+}
+
+@app.route("/api/scanner/status", methods=["GET"])
+def get_scanner_status():
+    """Retourne l'état du scanner résident s'il tourne."""
+    try:
+        return jsonify(send_scanner_command("status"))
+    except OSError as e:
+        return (
+            jsonify({"success": False, "error": f"Scanner injoignable: {e}"}),
+            503,
+        )
+
+
+@app.route("/api/scanner/control", methods=["POST"])
+def control_scanner():
+    """
+    Transmet une commande au scanner résident.
+    Attend { "command": "pause" | "resume" | "set_rate" | "boost" | "rescan" | "stop", ... }.
+    Seuls les paramètres de CONTROL_COMMANDS sont transmis. Les écritures
+    ("write") ne le sont pas : elles passent par write_db.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "error": "Corps JSON invalide: objet attendu."}), 400
+    command = data.get("command")
+    if not command:
+        return jsonify({"success": False, "error": "Le champ 'command' est requis."}), 400
+    if command not in CONTROL_COMMANDS:
+        return jsonify({"success": False, "error": f"Commande inconnue: {command}"}), 400
+    params = {name: data[name] for name in CONTROL_COMMANDS[command] if name in data}
+    try:
+        response = send_scanner_command(command, params)
+    except OSError as e:
+        return (
+            jsonify({"success": False, "error": f"Scanner injoignable: {e}"}),
+            503,
+        )
+    return jsonify(response), (200 if response.get("success") else 400)
+
+
 # --- SANDBOX Definitions ---
 
 
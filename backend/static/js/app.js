@@ -690,12 +690,7 @@ document.addEventListener(
       }
 
 
-      function renderCompareForm(users) {
-        if (!users) {
-          users = [];
-        }
-        const availableUsers =
-            [...users].sort((a, b) => a.username.localeCompare(b.username));
+      function renderCompareForm() {
         content.innerHTML = `
             <h1 class="text-3xl font-bold mb-6 text-gray-800 dark:text-white">Comparer les Flags (Bases)</h1>
             <div class="bg-white dark:bg-light-navy p-6 rounded-lg shadow mb-6">
@@ -719,26 +714,45 @@ document.addEventListener(
         `;
 
         // Function to setup searchable dropdown
+        // Les suggestions viennent de /api/search (index FTS5) : une petite
+        // requête par frappe au lieu de la liste complète des utilisateurs.
         function setupSearchableDropdown(inputId, dropdownId, valueId) {
           const inputElement = document.getElementById(inputId);
           const dropdownElement = document.getElementById(dropdownId);
           const valueElement = document.getElementById(valueId);
           let blurTimeout;
+          let searchTimeout;
+          let searchSeq = 0;  // Ignore les réponses arrivées après une frappe plus récente
 
-          const renderOptions = (filterTerm = '') => {
-            const lowerFilterTerm = filterTerm.toLowerCase();
-            const filteredUsers = availableUsers.filter(
-                user => user.username.toLowerCase().includes(lowerFilterTerm));
-            if (filteredUsers.length === 0 && filterTerm) {
+          const renderOptions = async (filterTerm = '') => {
+            const term = filterTerm.trim();
+            if (!term) {
+              dropdownElement.innerHTML =
+                  `<div class="p-2 text-sm text-gray-500 dark:text-slate italic">Tapez un nom, prénom ou filière...</div>`;
+              dropdownElement.classList.remove('hidden');
+              return;
+            }
+            const seq = ++searchSeq;
+            let users;
+            try {
+              const data = await fetchData(`/search?q=${
+                  encodeURIComponent(term)}&kind=user&limit=20`);
+              users = data.results;
+            } catch (error) {
+              users = [];
+            }
+            if (seq !== searchSeq) return;
+            if (users.length === 0) {
               dropdownElement.innerHTML =
                   `<div class="p-2 text-sm text-gray-500 dark:text-slate italic">Aucun utilisateur trouvé</div>`;
             } else {
-              dropdownElement.innerHTML = filteredUsers
+              dropdownElement.innerHTML = users
                                               .map(
                                                   user => `
                            <div class="dropdown-item p-2 text-sm cursor-pointer hover:bg-gray-100 dark:hover:bg-navy" data-value="${
-                                                      user.username}">
-                               ${user.username}
+                                                      user.key}">
+                               ${user.label}
+                               ${user.detail ? `<span class="text-xs text-gray-500 dark:text-slate ml-1">${user.detail}</span>` : ''}
                            </div>`).join('');
             }
             dropdownElement.classList.remove('hidden');
@@ -746,7 +760,8 @@ document.addEventListener(
 
           inputElement.addEventListener('input', () => {
             valueElement.value = '';  // Clear hidden value on input change
-            renderOptions(inputElement.value);
+            clearTimeout(searchTimeout);
+            searchTimeout = setTimeout(() => renderOptions(inputElement.value), 150);
           });
           inputElement.addEventListener('focus', () => {
             clearTimeout(blurTimeout);
@@ -1730,8 +1745,7 @@ document.addEventListener(
             renderUserDetail(
                 data);  // renderUserDetail appelle attachLiveLocationListener
           } else if (hash === '#compare') {
-            const usersData = await fetchData('/users');  // API path correction
-            renderCompareForm(usersData);
+            renderCompareForm();  // Suggestions chargées à la frappe (/search)
           } else if (hash === '#sandbox') {
             const commandsWithParams =
                 await fetchData('/sandbox/commands');  // API path correction
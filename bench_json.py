@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Mesure du JSON construit par SQLite (db_access.list_users_json,
+user_flags_json) face au chemin Python d'avant : sqlite3.Row -> dict ->
+json.dumps, comme query_db puis jsonify dans backend/api.py.
+
+Chaque taille est mesurée sur une DB temporaire remplie de 'rows'
+utilisateurs (/api/users) et d'un utilisateur ayant 'rows' flags
+(liste des flags de /api/user/<username>).
+
+    python bench_json.py                      # 10 000 et 100 000 lignes
+    python bench_json.py --rows 5000 --repeat 10
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from db_access import list_users_json, open_connection, user_flags_json
+
+# --- Configuration ---
+ROW_COUNTS = [10_000, 100_000]
+REPEAT = 5  # mesures par chemin, la médiane est affichée
+# --- Fin Configuration ---
+
+
+def _fill(conn, rows):
+    conn.executemany(
+        """
+        INSERT INTO users (username, first_name, last_name, email, profile, filiere, blocked, created_at)
+        VALUES (?, ?, ?, ?, 1, ?, 0, '2025-03-01T10:00:00')
+        """,
+        [(f"user{i:06d}", f"Prénom{i}", f"Nom{i}", f"user{i}@example.org", ["SFPN", "STL"][i % 2]) for i in range(rows)],
+    )
+    conn.executemany(
+        "INSERT INTO flags (username, flag, date, flag_base, flag_suffix) VALUES ('bench', ?, ?, ?, ?)",
+        [(f"FLAG{i % 50}:{i:08x}", f"2025-03-{1 + i % 28:02d}T10:00:00", f"FLAG{i % 50}", f"{i:08x}") for i in range(rows)],
+    )
+    conn.commit()
+
+
+def _python_users(conn):
+    conn.row_factory = sqlite3.Row
+    try:
+        users = [
+            dict(row)
+            for row in conn.execute(
+                """
+                SELECT u.username, u.first_name, u.last_name, u.filiere, u.blocked,
+                       COALESCE(fc.flags, 0) AS flag_count
+                FROM users u
+                LEFT JOIN user_flag_counts fc ON u.username = fc.username
+                ORDER BY u.username COLLATE NOCASE ASC
+                """
+            )
+        ]
+    finally:
+        conn.row_factory = None
+    return json.dumps(users, sort_keys=True, separators=(",", ":"))
+
+
+def _python_flags(conn):
+    conn.row_factory = sqlite3.Row
+    try:
+        flags = [
+            dict(row)
+            for row in conn.execute("SELECT flag, date FROM flags WHERE username = ? ORDER BY date DESC", ("bench",))
+        ]
+    finally:
+        conn.row_factory = None
+    return json.dumps(flags, sort_keys=True, separators=(",", ":"))
+
+
+def _median(function, conn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(conn)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def run_benchmark(rows, repeat=REPEAT):
+    """{liste: (secondes Python, secondes SQL)} pour 'rows' lignes, médianes de 'repeat' mesures."""
+    from update_db import create_tables
+    from migrations import migrate
+
+    with tempfile.TemporaryDirectory() as directory:
+        conn = open_connection(os.path.join(directory, "bench.db"))
+        try:
+            create_tables(conn)
+            migrate(conn)
+            _fill(conn, rows)
+            results = {}
+            for name, python_path, sql_path in (
+                ("users", _python_users, list_users_json),
+                ("flags", _python_flags, lambda c: user_flags_json(c, "bench")),
+            ):
+                # Même document des deux côtés (au format près : SQLite n'échappe pas l'UTF-8)
+                assert json.loads(python_path(conn)) == json.loads(sql_path(conn))
+                results[name] = (_median(python_path, conn, repeat), _median(sql_path, conn, repeat))
+            return results
+        finally:
+            conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="JSON construit par SQLite face au chemin Python")
+    parser.add_argument("--rows", type=int, nargs="+", default=ROW_COUNTS, help="nombres de lignes mesurés")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="mesures par chemin")
+    args = parser.parse_args()
+
+    print(f"{'lignes':>8} {'liste':6} {'Python':>10} {'SQLite':>10} {'gain':>6}")
+    for rows in args.rows:
+        for name, (python_time, sql_time) in run_benchmark(rows, args.repeat).items():
+            print(
+                f"{rows:>8} {name:6} {python_time * 1000:>8.1f}ms {sql_time * 1000:>8.1f}ms"
+                f" {python_time / sql_time:>5.1f}x"
+            )
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+Accès partagé à la DB pour update_db.py, use_db.py et backend/api.py.
+
+Connexions : open_connection applique les réglages communs (pragmas de
+migrations.configure_connection, cache de CACHED_STATEMENTS requêtes
+préparées par connexion). ConnectionPool garde les connexions ouvertes
+d'un appel à l'autre : plus de connect/close (ni de cache de pages froid)
+à chaque fonction. get_pool retourne le pool partagé d'un fichier.
+
+Lignes : les requêtes partagées retournent des NamedTuple typés
+(User, UserSummary, FlagEntry, Position) ; dict_row et named_row
+servent de row_factory pour les autres. Les variantes *_json
+retournent directement le texte JSON construit par SQLite
+(json_group_array/json_object) : aucun objet Python par ligne.
+
+    from db_access import get_pool, list_users
+    with get_pool(readonly=True).connection() as conn:
+        for user in list_users(conn):
+            print(user.username, user.flag_count)
+"""
+import collections
+import contextlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+from typing import NamedTuple, Optional
+
+from migrations import configure_connection
+
+# --- Configuration ---
+DB_DIR = "db"
+DATABASE_FILE = os.path.join(DB_DIR, "game_data.db")  # Chemin vers le fichier de DB unique
+CACHED_STATEMENTS = 512  # requêtes préparées gardées par connexion (128 par défaut)
+POOL_SIZE = 4  # connexions gardées au repos par pool
+# --- Fin Configuration ---
+
+
+# --- Lignes typées ---
+class User(NamedTuple):
+    username: str
+    first_name: Optional[str]
+    last_name: Optional[str]
+    email: Optional[str]
+    profile: Optional[int]
+    filiere: Optional[str]
+    blocked: Optional[int]
+    created_at: Optional[str]
+
+
+class UserSummary(NamedTuple):
+    username: str
+    first_name: Optional[str]
+    last_name: Optional[str]
+    filiere: Optional[str]
+    blocked: Optional[int]
+    flag_count: int
+
+
+class FlagEntry(NamedTuple):
+    flag: str
+    date: Optional[str]
+    date_epoch: Optional[int]
+
+
+class Position(NamedTuple):
+    username: str
+    world_ID: str
+    location: Optional[str]
+    room: Optional[str]
+    created_at: Optional[str]
+
+
+def typed_row(row_type):
+    """row_factory qui construit un 'row_type' (NamedTuple) à partir de chaque ligne."""
+    return lambda cursor, row: row_type(*row)
+
+
+def dict_row(cursor, row):
+    """row_factory : {colonne: valeur}."""
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+_named_types = {}
+
+
+def named_row(cursor, row):
+    """row_factory : namedtuple dont les champs sont les colonnes de la requête."""
+    fields = tuple(column[0] for column in cursor.description)
+    row_type = _named_types.get(fields)
+    if row_type is None:
+        row_type = _named_types[fields] = collections.namedtuple("Row", fields, rename=True)
+    return row_type(*row)
+
+
+# --- Connexions ---
+def open_connection(path=DATABASE_FILE, readonly=False, immutable=False, timeout=30, row_factory=None):
+    """
+    Ouvre une connexion avec les réglages communs. readonly : mode=ro ;
+    immutable : fichier garanti inchangé (copie de lecture, voir snapshots.py).
+    check_same_thread=False : une connexion de pool passe d'un thread à l'autre,
+    jamais à deux threads en même temps.
+    """
+    if readonly or immutable:
+        target = f"file:{os.path.abspath(path)}?mode=ro{'&immutable=1' if immutable else ''}"
+    else:
+        target = path
+    conn = sqlite3.connect(
+        target,
+        timeout=timeout,
+        uri=readonly or immutable,
+        check_same_thread=False,
+        cached_statements=CACHED_STATEMENTS,
+    )
+    if row_factory is not None:
+        conn.row_factory = row_factory
+    return configure_connection(conn)
+
+
+class ConnectionPool:
+    """
+    Connexions réutilisées : acquire en prend une au repos (ou en ouvre
+    une), release la rend, fermée au-delà de 'size' connexions au repos.
+    """
+
+    def __init__(self, path=DATABASE_FILE, size=POOL_SIZE, readonly=False, immutable=False, row_factory=None):
+        self.path = path
+        self.size = size
+        self.readonly = readonly
+        self.immutable = immutable
+        self.row_factory = row_factory
+        self.lock = threading.Lock()
+        self.idle = queue.LifoQueue()  # la dernière rendue a le cache le plus chaud
+        self.closed = False
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return open_connection(self.path, self.readonly, self.immutable, row_factory=self.row_factory)
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()  # pas d'état laissé au prochain emprunteur
+        with self.lock:
+            if not self.closed and self.idle.qsize() < self.size:
+                self.idle.put(conn)
+                return
+        conn.close()
+
+    @contextlib.contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Ferme les connexions au repos ; celles empruntées le seront à leur retour."""
+        with self.lock:
+            self.closed = True
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path=DATABASE_FILE, readonly=False):
+    """Pool partagé du fichier 'path' (un par fichier et par mode)."""
+    key = (os.path.abspath(path), readonly)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(path, readonly=readonly)
+        return pool
+
+
+# --- Requêtes partagées ---
+def list_users(conn):
+    """Tous les utilisateurs avec leur nombre de flags (agrégat user_flag_counts), par nom."""
+    cursor = conn.cursor()
+    cursor.row_factory = typed_row(UserSummary)
+    return cursor.execute(
+        """
+        SELECT u.username, u.first_name, u.last_name, u.filiere, u.blocked,
+               COALESCE(fc.flags, 0)
+        FROM users u
+        LEFT JOIN user_flag_counts fc ON u.username = fc.username
+        ORDER BY u.username COLLATE NOCASE ASC
+        """
+    ).fetchall()
+
+
+def get_user(conn, username):
+    """Fiche de l'utilisateur, ou None."""
+    cursor = conn.cursor()
+    cursor.row_factory = typed_row(User)
+    return cursor.execute(
+        """
+        SELECT username, first_name, last_name, email, profile, filiere, blocked, created_at
+        FROM users WHERE username = ?
+        """,
+        (username,),
+    ).fetchone()
+
+
+def user_flags(conn, username):
+    """Flags de l'utilisateur, sans ordre imposé (celui de use_db.user_flags d'origine)."""
+    cursor = conn.cursor()
+    cursor.row_factory = typed_row(FlagEntry)
+    return cursor.execute(
+        "SELECT flag, date, date_epoch FROM flags WHERE username = ?",
+        (username,),
+    ).fetchall()
+
+
+def list_users_json(conn):
+    """
+    list_users en texte JSON : [{"blocked", "filiere", "first_name",
+    "flag_count", "last_name", "username"}], clés triées comme jsonify.
+    """
+    return conn.execute(
+        """
+        SELECT json_group_array(json_object(
+            'blocked', blocked, 'filiere', filiere, 'first_name', first_name,
+            'flag_count', flag_count, 'last_name', last_name, 'username', username
+        ))
+        FROM (
+            SELECT u.username, u.first_name, u.last_name, u.filiere, u.blocked,
+                   COALESCE(fc.flags, 0) AS flag_count
+            FROM users u
+            LEFT JOIN user_flag_counts fc ON u.username = fc.username
+            ORDER BY u.username COLLATE NOCASE ASC
+        )
+        """
+    ).fetchone()[0]
+
+
+def user_flags_json(conn, username):
+    """user_flags en texte JSON : [{"date", "flag"}], les plus récents d'abord."""
+    return conn.execute(
+        """
+        SELECT json_group_array(json_object('date', date, 'flag', flag))
+        FROM (SELECT flag, date FROM flags WHERE username = ? ORDER BY date DESC)
+        """,
+        (username,),
+    ).fetchone()[0]
+
+
+def last_position(conn, username):
+    """Dernière position connue de l'utilisateur (table worlds), ou None."""
+    cursor = conn.cursor()
+    cursor.row_factory = typed_row(Position)
+    return cursor.execute(
+        """
+        SELECT username, world_ID, location, room, created_at FROM worlds
+        WHERE username = ? ORDER BY created_at DESC, world_ID DESC LIMIT 1
+        """,
+        (username,),
+    ).fetchone()
+
+
+def db_totals(conn):
+    """Compteurs globaux tenus par les agrégats : {"users", "worlds", "flags", "flag_bases"}."""
+    return dict(conn.execute("SELECT name, value FROM db_totals").fetchall())
+
+
+def compare_flag_bases(conn, user1, user2, with_suffix_only=True):
+    """
+    Bases de flags des deux utilisateurs : [(flag_base, a user1, a user2)].
+    with_suffix_only=False compte aussi les flags sans ':' (base = flag entier).
+    """
+    suffix = "AND flag_suffix IS NOT NULL" if with_suffix_only else ""
+    return [
+        (base, bool(has1), bool(has2))
+        for base, has1, has2 in conn.execute(
+            f"""
+            SELECT flag_base, MAX(owner = 1), MAX(owner = 2) FROM (
+                -- un utilisateur par branche : chacune est une recherche dans idx_flag_rows_user_base
+                SELECT flag_base, 1 AS owner FROM flags WHERE username = ? {suffix}
+                UNION ALL
+                SELECT flag_base, 2 FROM flags WHERE username = ? {suffix}
+            )
+            GROUP BY flag_base
+            ORDER BY flag_base
+            """,
+            (user1, user2),
+        )
+    ]
+
+
+def compare_flag_bases_with_all(conn, username, with_suffix_only=True):
+    """
+    Différences de bases de flags entre 'username' et chacun des autres
+    utilisateurs, en une requête : {autre: (ahead, behind)}, ahead : bases
+    que seul 'username' a, behind : celles que seul l'autre a. Les
+    utilisateurs sans différence sont absents.
+    """
+    suffix = "AND flag_suffix IS NOT NULL" if with_suffix_only else ""
+    diffs = {}
+    for other, base, ahead in conn.execute(
+        f"""
+        WITH mine AS (
+            SELECT DISTINCT flag_base FROM flags
+            WHERE username = :user AND flag_base IS NOT NULL {suffix}
+        )
+        -- bases de l'autre que 'username' n'a pas
+        SELECT DISTINCT f.username, f.flag_base, 0
+        FROM flags f JOIN users u ON u.username = f.username
+        WHERE f.username != :user AND f.flag_base NOT IN mine {suffix}
+        UNION ALL
+        -- bases de 'username' que l'autre n'a pas (recherche dans idx_flag_rows_user_base)
+        SELECT u.username, m.flag_base, 1
+        FROM users u, mine m
+        WHERE u.username != :user
+          AND NOT EXISTS (
+              SELECT 1 FROM flags f
+              WHERE f.username = u.username AND f.flag_base = m.flag_base {suffix}
+          )
+        ORDER BY 1, 2
+        """,
+        {"user": username},
+    ):
+        ahead_bases, behind_bases = diffs.setdefault(other, ([], []))
+        (ahead_bases if ahead else behind_bases).append(base)
+    return diffs
+
+
+def last_positions(conn, usernames=None):
+    """
+    Dernière position connue de chaque utilisateur (ou de ceux de
+    'usernames'), en une requête : {username: Position}.
+    """
+    cursor = conn.cursor()
+    cursor.row_factory = typed_row(Position)
+    # Même ordre que last_position. Partition sur la clé entière : world_rows est
+    # lu dans l'ordre de idx_world_rows_user_created, sans tri complet (voir surrogate_keys.py)
+    rows = cursor.execute(
+        """
+        SELECT u.username, k.world_ID, l.location, r.name, p.created_at FROM (
+            SELECT w.user_id, w.world_key, w.location_key, w.room_key, w.created_at,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY w.user_id ORDER BY w.created_at DESC, k.world_ID DESC
+                   ) AS rank
+            FROM world_rows w JOIN world_keys k ON k.id = w.world_key
+            WHERE w.user_id IS NOT NULL
+              AND (:names IS NULL OR w.user_id IN (
+                  SELECT id FROM user_keys WHERE username IN (SELECT value FROM json_each(:names))
+              ))
+        ) p
+        JOIN user_keys u ON u.id = p.user_id
+        JOIN world_keys k ON k.id = p.world_key
+        LEFT JOIN location_keys l ON l.id = p.location_key
+        LEFT JOIN room_keys r ON r.id = p.room_key
+        WHERE p.rank = 1
+        """,
+        {"names": json.dumps(list(usernames)) if usernames is not None else None},
+    )
+    return {position.username: position for position in rows}
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Écrivain unique de la DB.
+
+Un seul thread détient la connexion d'écriture. Les autres threads lui
+soumettent des opérations (fonctions appelées avec la connexion, sans
+commit) par une file ; il les regroupe en une transaction par lot de
+batch_size opérations ou batch_seconds secondes. Chaque opération tourne
+dans un SAVEPOINT : une erreur n'annule qu'elle, pas le lot.
+
+Le scanner résident (scan_daemon.py) héberge l'écrivain ; l'API lui
+envoie ses écritures avec la commande "write" (voir WRITE_OPERATIONS)
+au lieu d'ouvrir sa propre connexion d'écriture.
+
+Avec snapshot_dir, l'écrivain publie aussi la copie de lecture de l'API
+(snapshots.py) au plus toutes les snapshot_interval secondes après des
+écritures, ou dès le lot d'une opération soumise par submit_published.
+Un lot qui n'a modifié aucune ligne (conn.total_changes inchangé) ne
+demande pas de nouvelle copie.
+
+submit_alone exécute une opération hors lot et hors transaction, pour
+celles qui gèrent leurs propres transactions (ATTACH des partitions,
+vacuum incrémental : voir partitions.py).
+
+    writer = DatabaseWriter()
+    writer.start()
+    future = writer.submit(save_world_batch, results, commit=False)
+    changes = future.result()
+"""
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from log_setup import get_logger
+from snapshots import SNAPSHOT_INTERVAL, publish_snapshot
+from update_db import DATABASE_FILE, apply_positions, connect_db
+
+# --- Configuration ---
+WRITER_BATCH_SIZE = 100  # opérations par transaction
+WRITER_BATCH_SECONDS = 0.5  # attente max d'autres opérations avant de valider un lot
+WRITER_QUEUE_SIZE = 1000  # opérations en attente (au-delà, submit bloque)
+# --- Fin Configuration ---
+
+log = get_logger("db_writer")
+
+# Opérations acceptées par la commande "write" du scanner : nom -> fonction(conn, **payload)
+WRITE_OPERATIONS = {
+    "positions": apply_positions,
+}
+
+
+class DatabaseWriter(threading.Thread):
+    def __init__(
+        self,
+        path=DATABASE_FILE,
+        batch_size=WRITER_BATCH_SIZE,
+        batch_seconds=WRITER_BATCH_SECONDS,
+        queue_size=WRITER_QUEUE_SIZE,
+        snapshot_dir=None,
+        snapshot_interval=SNAPSHOT_INTERVAL,
+    ):
+        super().__init__(name="db-writer", daemon=True)
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        self.operations = queue.Queue(maxsize=queue_size)
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_interval = snapshot_interval
+        self.last_snapshot = time.monotonic()
+        self.unpublished = False  # écritures validées absentes de la copie de lecture
+        self.published_changes = 0  # conn.total_changes à la dernière publication
+        self.stats = {"operations": 0, "transactions": 0, "errors": 0, "snapshots": 0, "generation": None}
+
+    def submit(self, fn, *args, **kwargs):
+        """Met en file fn(conn, *args, **kwargs) ; retourne un Future de son résultat."""
+        return self._enqueue(fn, args, kwargs, "batch")
+
+    def submit_published(self, fn, *args, **kwargs):
+        """Comme submit, mais le Future n'est résolu qu'une fois la copie de lecture publiée."""
+        return self._enqueue(fn, args, kwargs, "published")
+
+    def submit_alone(self, fn, *args, **kwargs):
+        """Comme submit, mais fn s'exécute seule, hors transaction, et valide elle-même."""
+        return self._enqueue(fn, args, kwargs, "alone")
+
+    def _enqueue(self, fn, args, kwargs, mode):
+        future = Future()
+        self.operations.put((future, fn, args, kwargs, mode))
+        return future
+
+    def stop(self):
+        """Écrit les opérations déjà en file puis arrête le thread."""
+        self.operations.put(None)
+        self.join()
+
+    def run(self):
+        conn = connect_db(self.path)
+        try:
+            stopping = False
+            while not stopping:
+                try:
+                    item = self.operations.get(timeout=self._snapshot_wait())
+                except queue.Empty:
+                    self._publish(conn)  # plus d'écriture depuis un moment : copie à jour
+                    continue
+                if item is None:
+                    break
+                if item[4] == "alone":
+                    self._run_alone(conn, item)
+                    continue
+                batch, alone = [item], None
+                deadline = time.monotonic() + self.batch_seconds
+                while len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self.operations.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stopping = True
+                        break
+                    if item[4] == "alone":
+                        alone = item  # après le lot en cours, dans l'ordre de soumission
+                        break
+                    batch.append(item)
+                self._write(conn, batch)
+                if alone is not None:
+                    self._run_alone(conn, alone)
+            if self.unpublished:
+                self._publish(conn)
+        finally:
+            conn.close()
+
+    def _snapshot_wait(self):
+        """Attente max d'une opération avant de publier les écritures en suspens (None : aucune)."""
+        if not self.snapshot_dir or not self.unpublished:
+            return None
+        return max(self.last_snapshot + self.snapshot_interval - time.monotonic(), 0)
+
+    def _publish(self, conn):
+        if not self.snapshot_dir:
+            return
+        try:
+            self.stats["generation"] = publish_snapshot(conn, self.snapshot_dir)
+            self.stats["snapshots"] += 1
+        except (sqlite3.Error, OSError) as e:
+            log.warning("Copie de lecture non publiée: %s", e)
+        self.last_snapshot = time.monotonic()
+        self.published_changes = conn.total_changes
+        self.unpublished = False
+
+    def _note_changes(self, conn):
+        """Une copie est à publier si des lignes ont changé depuis la dernière."""
+        if conn.total_changes != self.published_changes:
+            self.unpublished = True
+
+    def _run_alone(self, conn, item):
+        future, fn, args, kwargs, _ = item
+        if not future.set_running_or_notify_cancel():
+            return
+        self.stats["operations"] += 1
+        try:
+            future.set_result(fn(conn, *args, **kwargs))
+            self._note_changes(conn)
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            self.stats["errors"] += 1
+            future.set_exception(e)
+
+    def _write(self, conn, batch):
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for future, fn, args, kwargs, _ in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT operation")
+                try:
+                    outcomes.append((future, fn(conn, *args, **kwargs), None))
+                    conn.execute("RELEASE operation")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO operation")
+                    conn.execute("RELEASE operation")
+                    outcomes.append((future, None, e))
+            conn.commit()
+        except sqlite3.Error as e:
+            log.warning("Erreur SQLite, lot de %d opérations annulé: %s", len(batch), e)
+            conn.rollback()
+            # Toutes les opérations du lot échouent, y compris celles pas encore
+            # commencées (BEGIN IMMEDIATE refusé : DB verrouillée par un autre processus)
+            outcomes = [(future, None, e) for future, _, _, _, _ in batch if not future.done()]
+        else:
+            self._note_changes(conn)
+            if self.unpublished and (
+                any(mode == "published" for *_, mode in batch) or self._snapshot_wait() == 0
+            ):
+                self._publish(conn)
+
+        self.stats["transactions"] += 1
+        for future, value, error in outcomes:
+            self.stats["operations"] += 1
+            if error is None:
+                future.set_result(value)
+            else:
+                self.stats["errors"] += 1
+                future.set_exception(error)
@@ -8,7 +8,9 @@ from kerberos import (
 from maps import (
     NAME_GRAPH,
 )  # Importe votre graphe statique (si vous l'utilisez toujours comme base/fallback)
-import traceback  # Importé pour la gestion d'erreurs
+from log_setup import get_logger
+
+log = get_logger("depth_first_search_map")
 
 # ==============================================================================
 # PHASE 1 : Construction du Graphe des Noms (Modifiée)
@@ -37,7 +39,7 @@ def _build_name_graph_recursive(
             current_name = client.room_name(world_id, current_id)
             id_to_name_cache_build[current_id] = current_name
         except Exception as e:
-            print(f"BUILD_GRAPH: Error getting name for {current_id}: {e}")
+            log.warning("BUILD_GRAPH: Error getting name for %s: %s", current_id, e)
             return  # Ne pas continuer si on ne peut pas obtenir le nom
     else:
         current_name = id_to_name_cache_build[current_id]
@@ -45,7 +47,7 @@ def _build_name_graph_recursive(
     # Initialiser l'entrée dans le graphe si elle n'existe pas
     if current_name not in name_graph:
         name_graph[current_name] = {}
-        print(f"NEW ROOM DISCOVERED : {current_name} (ID: {current_id})")
+        log.debug("NEW ROOM DISCOVERED : %s (ID: %s)", current_name, current_id)
 
     # --- NOUVELLE LOGIQUE : Utiliser room.directions ---
     valid_directions = []
@@ -60,12 +62,15 @@ def _build_name_graph_recursive(
         if isinstance(directions_result, list):
             valid_directions = directions_result
         else:
-            print(
-                f"BUILD_GRAPH: Warning - room.directions for {current_id} did not return a list. Got: {type(directions_result)} - Value: {directions_result}"
+            log.warning(
+                "BUILD_GRAPH: room.directions for %s did not return a list. Got: %s - Value: %s",
+                current_id,
+                type(directions_result),
+                directions_result,
             )
 
     except Exception as e:
-        print(f"BUILD_GRAPH: Error calling room.directions for {current_id}: {e}")
+        log.warning("BUILD_GRAPH: Error calling room.directions for %s: %s", current_id, e)
         # Peut-être un monde inactif ou une erreur API. On continue sans explorer depuis ici.
 
     # --- FIN NOUVELLE LOGIQUE ---
@@ -98,8 +103,12 @@ def _build_name_graph_recursive(
                         id_to_name_cache_build[neighbor_id] = neighbor_name
 
                     except Exception as e:
-                        print(
-                            f"BUILD_GRAPH: Error getting name for neighbor {neighbor_id} (from {current_id} via {direction}): {e}"
+                        log.warning(
+                            "BUILD_GRAPH: Error getting name for neighbor %s (from %s via %s): %s",
+                            neighbor_id,
+                            current_id,
+                            direction,
+                            e,
                         )
                         continue  # Ne pas ajouter ce voisin si son nom est inconnu
                 else:
@@ -128,8 +137,11 @@ def _build_name_graph_recursive(
 
         except Exception as e:
             # Gère les erreurs spécifiques à l'appel room.neighbor pour cette direction
-            print(
-                f"BUILD_GRAPH: Error getting neighbor {direction} from {current_id} (after directions check): {e}"
+            log.warning(
+                "BUILD_GRAPH: Error getting neighbor %s from %s (after directions check): %s",
+                direction,
+                current_id,
+                e,
             )
             # On continue avec la prochaine direction valide
 
@@ -139,7 +151,7 @@ def build_name_graph(client: KerberosClient, world_id: str) -> dict:
     Construit un graphe des connexions entre salles basé sur leurs noms,
     en utilisant room.directions pour optimiser.
     """
-    print(f"\n--- Building Optimized Name Graph using World: {world_id} ---")
+    log.info("--- Building Optimized Name Graph using World: %s ---", world_id)
     start_time = time.time()
     name_graph = {}
     visited_ids_build = set()
@@ -156,10 +168,10 @@ def build_name_graph(client: KerberosClient, world_id: str) -> dict:
         api_calls_build["location"] += 1
         start_location_id = client.location(world_id=world_id)
         if not start_location_id:
-            print("BUILD_GRAPH: Error: Could not get starting location.")
+            log.error("BUILD_GRAPH: Could not get starting location.")
             return {}
 
-        print(f"BUILD_GRAPH: Starting from location ID: {start_location_id}")
+        log.info("BUILD_GRAPH: Starting from location ID: %s", start_location_id)
         # Lancer la récursion avec le compteur d'appels
         _build_name_graph_recursive(
             client,
@@ -172,14 +184,13 @@ def build_name_graph(client: KerberosClient, world_id: str) -> dict:
         )
 
     except Exception as e:
-        print(f"BUILD_GRAPH: An error occurred during graph building: {e}")
-        traceback.print_exc()
+        log.exception("BUILD_GRAPH: An error occurred during graph building: %s", e)
 
     end_time = time.time()
-    print(f"--- Optimized Name Graph Building Complete ({len(name_graph)} nodes) ---")
+    log.info("--- Optimized Name Graph Building Complete (%d nodes) ---", len(name_graph))
     # Afficher le compte des appels API de la phase de construction
-    print(f"API Calls (Build Phase): {api_calls_build}")
-    print(f"Time taken (Build Phase): {end_time - start_time:.2f} seconds")
+    log.info("API Calls (Build Phase): %s", api_calls_build)
+    log.info("Time taken (Build Phase): %.2f seconds", end_time - start_time)
     return name_graph
 
 
@@ -203,12 +214,10 @@ def get_all_rooms(
     Trouve toutes les salles accessibles en utilisant le graphe de noms précalculé
     pour minimiser les appels API. (Fonction globalement inchangée)
     """
-    print(
-        f"\n--- Optimized Discovery for World: {world_id} using precomputed graph ---"
-    )
+    log.info("--- Optimized Discovery for World: %s using precomputed graph ---", world_id)
     start_time = time.time()
     if not name_graph:
-        print("OPTIMIZED: Error - Name graph is empty or not provided. Cannot proceed.")
+        log.error("OPTIMIZED: Name graph is empty or not provided. Cannot proceed.")
         return []
 
     result_rooms = []
@@ -222,20 +231,22 @@ def get_all_rooms(
         api_calls_discovery["location"] += 1
         start_id = client.location(world_id=world_id)
         if not start_id:
-            print("OPTIMIZED: Error: Could not get starting location.")
+            log.error("OPTIMIZED: Could not get starting location.")
             return []
 
         api_calls_discovery["room_name"] += 1
         start_name = client.room_name(world_id, start_id)
 
         if start_name not in name_graph:
-            print(
-                f"OPTIMIZED: Warning - Start room name '{start_name}' (ID: {start_id}) not found in the precomputed graph. Adding only this room."
+            log.warning(
+                "OPTIMIZED: Start room name '%s' (ID: %s) not found in the precomputed graph. Adding only this room.",
+                start_name,
+                start_id,
             )
             result_rooms.append((start_id, start_name))
             # Ne pas ajouter à la file si le nom n'est pas dans le graphe
         else:
-            print(f"OPTIMIZED: Starting from '{start_name}' (ID: {start_id})")
+            log.debug("OPTIMIZED: Starting from '%s' (ID: %s)", start_name, start_id)
             name_to_id_map[start_name] = start_id
             visited_names.add(start_name)
             result_rooms.append((start_id, start_name))
@@ -245,8 +256,8 @@ def get_all_rooms(
             current_name = queue.pop(0)
             # Vérifier si current_name existe dans name_to_id_map (sécurité)
             if current_name not in name_to_id_map:
-                print(
-                    f"OPTIMIZED: Error - Name '{current_name}' in queue but not in name_to_id_map. Skipping."
+                log.warning(
+                    "OPTIMIZED: Name '%s' in queue but not in name_to_id_map. Skipping.", current_name
                 )
                 continue
             current_id = name_to_id_map[current_name]
@@ -260,8 +271,10 @@ def get_all_rooms(
 
                 # Vérifier si le nom du voisin existe comme clé dans le graphe (cohérence)
                 if neighbor_name not in name_graph:
-                    print(
-                        f"OPTIMIZED: Warning - Neighbor name '{neighbor_name}' (linked from '{current_name}') not found as a node in the graph. Skipping."
+                    log.warning(
+                        "OPTIMIZED: Neighbor name '%s' (linked from '%s') not found as a node in the graph. Skipping.",
+                        neighbor_name,
+                        current_name,
                     )
                     continue
 
@@ -299,29 +312,36 @@ def get_all_rooms(
                         # Le graphe indiquait un voisin, mais l'API dit non.
                         # Cela peut arriver si le monde exploré est différent de celui utilisé pour construire le graphe,
                         # ou si le monde a changé.
-                        print(
-                            f"OPTIMIZED: Warning - Graph expected neighbor '{neighbor_name}' ({direction} from '{current_name}'), but API returned no neighbor in world {world_id}."
+                        log.warning(
+                            "OPTIMIZED: Graph expected neighbor '%s' (%s from '%s'), but API returned no neighbor in world %s.",
+                            neighbor_name,
+                            direction,
+                            current_name,
+                            world_id,
                         )
 
                 except Exception as e:
                     # Gère les erreurs lors de l'appel à room_neighbor pendant la découverte
-                    print(
-                        f"OPTIMIZED: Error getting neighbor {direction} from {current_id} (expected name '{neighbor_name}'): {e}"
+                    log.warning(
+                        "OPTIMIZED: Error getting neighbor %s from %s (expected name '%s'): %s",
+                        direction,
+                        current_id,
+                        neighbor_name,
+                        e,
                     )
                     # Ne pas ajouter ce voisin et continuer
 
     except Exception as e:
-        print(f"OPTIMIZED: An error occurred during optimized discovery: {e}")
-        traceback.print_exc()
+        log.exception("OPTIMIZED: An error occurred during optimized discovery: %s", e)
 
     end_time = time.time()
     # Utiliser len(visited_names) peut être plus précis pour le nombre de salles uniques découvertes
-    print(
-        f"--- Optimized Discovery Complete ({len(visited_names)} unique rooms visited) ---"
+    log.info(
+        "--- Optimized Discovery Complete (%d unique rooms visited) ---", len(visited_names)
     )
-    print(f"Total room entries in result list: {len(result_rooms)}")
-    print(f"API Calls (Discovery Phase): {api_calls_discovery}")
-    print(f"Time taken (Discovery Phase): {end_time - start_time:.2f} seconds")
+    log.debug("Total room entries in result list: %d", len(result_rooms))
+    log.debug("API Calls (Discovery Phase): %s", api_calls_discovery)
+    log.info("Time taken (Discovery Phase): %.2f seconds", end_time - start_time)
     return result_rooms
 
 
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+Index bitmap des bases de flags par utilisateur.
+
+Chaque base de flag reçoit une position de bit (flag_base_bits, jamais
+réattribuée) ; la progression d'un utilisateur est un grand entier dont
+les bits sont les bases qu'il possède, stocké en BLOB dans
+user_flag_bitmaps :
+
+    bases      toutes ses bases (flags sans ':' compris, voir use_db.flags_diff)
+    suffixed   bases de ses flags "base:suffixe" (voir /api/compare)
+
+Comparer deux utilisateurs devient quelques opérations sur des entiers :
+ahead = a & ~b, behind = b & ~a, common = a & b, et leurs tailles un
+popcount (gmpy2, ou int.bit_count sans gmpy2). Les bitmaps sont les
+lignes de la matrice utilisateurs × bases : les similarités (Jaccard,
+Hamming) et les plus proches rivaux (rivals, /api/rivals) s'en déduisent
+de la même façon, un popcount par paire.
+
+Mise à jour incrémentale : des triggers sur flags (flag_rows depuis la
+migration 7) attribuent un bit aux nouvelles bases et notent
+l'utilisateur dans flag_bitmaps_dirty ;
+refresh_flag_bitmaps recalcule les seuls utilisateurs notés (appelée à
+l'ingestion, dans la transaction d'écriture). Les lectures recalculent
+à la volée ceux qui seraient encore notés. Les tables et triggers sont
+créés par la migration 6 (migrations.py).
+
+    python flag_bitmaps.py user1 user2   # compare deux utilisateurs
+    python flag_bitmaps.py user1         # ses plus proches rivaux
+    python flag_bitmaps.py --rebuild     # recalcule tout l'index
+"""
+import argparse
+import heapq
+import json
+
+from aggregates import FLAG_COLUMNS
+
+try:
+    import gmpy2
+
+    bitmap = gmpy2.mpz
+    popcount = gmpy2.popcount
+except ImportError:  # gmpy2 absent : entiers Python, mêmes résultats
+    bitmap = int
+
+    def popcount(value):
+        return int(value).bit_count()
+
+
+# --- Configuration ---
+RIVALS_K = 5  # rivaux retournés par défaut
+RIVALS_MAX_K = 50
+# --- Fin Configuration ---
+
+BITMAP_TABLES = [
+    "CREATE TABLE IF NOT EXISTS flag_base_bits (bit INTEGER PRIMARY KEY, flag_base TEXT UNIQUE NOT NULL)",
+    """
+    CREATE TABLE IF NOT EXISTS user_flag_bitmaps (
+        username TEXT PRIMARY KEY,
+        bases BLOB NOT NULL,
+        suffixed BLOB NOT NULL
+    )
+    """,
+    "CREATE TABLE IF NOT EXISTS flag_bitmaps_dirty (username TEXT PRIMARY KEY)",
+]
+
+
+def _mark(row, columns):
+    """Corps de trigger : bit de la base du flag 'row' (NEW/OLD) et utilisateur à recalculer."""
+    username, flag_base = (columns[name].format(row=row) for name in ("username", "flag_base"))
+    return f"""
+        INSERT OR IGNORE INTO flag_base_bits (flag_base)
+            SELECT {flag_base} WHERE {flag_base} IS NOT NULL;
+        INSERT OR IGNORE INTO flag_bitmaps_dirty (username)
+            SELECT {username} WHERE {username} IS NOT NULL;
+    """
+
+
+def bitmap_triggers(table="flags", columns=FLAG_COLUMNS, watched="username, flag_base, flag_suffix"):
+    """Triggers de l'index sur la table des flags 'table' (mêmes paramètres que aggregates.flag_triggers)."""
+    return [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_bitmaps_{table}_insert AFTER INSERT ON {table}
+        BEGIN {_mark('NEW', columns)} END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_bitmaps_{table}_delete AFTER DELETE ON {table}
+        BEGIN {_mark('OLD', columns)} END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_bitmaps_{table}_update AFTER UPDATE OF {watched} ON {table}
+        BEGIN {_mark('OLD', columns)} {_mark('NEW', columns)} END
+        """,
+    ]
+
+
+BITMAP_TRIGGERS = bitmap_triggers()
+
+
+def similarity(a, b):
+    """(Jaccard, Hamming) de deux bitmaps ; Jaccard vaut 0 si les deux sont vides."""
+    union = popcount(a | b)
+    return (popcount(a & b) / union if union else 0.0), popcount(a ^ b)
+
+
+def to_blob(value):
+    value = int(value)
+    return value.to_bytes((value.bit_length() + 7) // 8, "little")
+
+
+def from_blob(blob):
+    return bitmap(int.from_bytes(blob or b"", "little"))
+
+
+def _compute_bitmaps(conn, where, params=()):
+    """{username: (bases, suffixed)} recalculés depuis flags pour les lignes 'where'."""
+    computed = {}
+    for username, bit, suffixed in conn.execute(
+        f"""
+        SELECT f.username, b.bit, MAX(f.flag_suffix IS NOT NULL)
+        FROM flags f JOIN flag_base_bits b ON b.flag_base = f.flag_base
+        WHERE f.username IS NOT NULL AND {where}
+        GROUP BY f.username, b.bit
+        """,
+        params,
+    ):
+        bases, with_suffix = computed.get(username, (0, 0))
+        computed[username] = (bases | 1 << bit, with_suffix | suffixed << bit)
+    return {username: (bitmap(bases), bitmap(with_suffix)) for username, (bases, with_suffix) in computed.items()}
+
+
+_DIRTY = "f.username IN (SELECT username FROM flag_bitmaps_dirty)"
+
+
+def refresh_flag_bitmaps(conn):
+    """
+    Recalcule les bitmaps des utilisateurs notés par les triggers (sans
+    commit, dans la transaction de l'appelant). Retourne le nombre de
+    requêtes exécutées (une seule si personne n'est noté).
+    """
+    if conn.execute("SELECT 1 FROM flag_bitmaps_dirty LIMIT 1").fetchone() is None:
+        return 1
+    computed = _compute_bitmaps(conn, _DIRTY)
+    conn.execute("DELETE FROM user_flag_bitmaps WHERE username IN (SELECT username FROM flag_bitmaps_dirty)")
+    statements = 4
+    if computed:
+        conn.executemany(
+            "INSERT INTO user_flag_bitmaps (username, bases, suffixed) VALUES (?, ?, ?)",
+            [(username, to_blob(bases), to_blob(suffixed)) for username, (bases, suffixed) in computed.items()],
+        )
+        statements += 1
+    conn.execute("DELETE FROM flag_bitmaps_dirty")
+    return statements
+
+
+def rebuild_flag_bitmaps(conn):
+    """Attribue un bit à chaque base connue et recalcule tous les bitmaps (sans commit)."""
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO flag_base_bits (flag_base)
+        SELECT DISTINCT flag_base FROM flags WHERE flag_base IS NOT NULL ORDER BY flag_base
+        """
+    )
+    conn.execute("DELETE FROM user_flag_bitmaps")
+    conn.execute("INSERT OR IGNORE INTO flag_bitmaps_dirty SELECT DISTINCT username FROM flags WHERE username IS NOT NULL")
+    refresh_flag_bitmaps(conn)
+
+
+class FlagBitmapIndex:
+    """
+    Bitmaps chargés en mémoire : names {bit: flag_base},
+    bitmaps {username: (bases, suffixed)}.
+    """
+
+    def __init__(self, names, bitmaps):
+        self.names = names
+        self.bitmaps = bitmaps
+
+    def bitmap(self, username, with_suffix_only=True):
+        bases, suffixed = self.bitmaps.get(username, (bitmap(0), bitmap(0)))
+        return suffixed if with_suffix_only else bases
+
+    def bases(self, value):
+        """Bases de flags des bits de 'value', triées comme ORDER BY flag_base."""
+        value, names = int(value), []
+        while value:
+            lowest = value & -value  # bit à 1 le plus faible
+            names.append(self.names[lowest.bit_length() - 1])
+            value ^= lowest
+        return sorted(names)
+
+    def compare(self, user1, user2, with_suffix_only=True):
+        """Bitmaps {"ahead", "behind", "common"} de user1 par rapport à user2."""
+        a = self.bitmap(user1, with_suffix_only)
+        b = self.bitmap(user2, with_suffix_only)
+        return {"ahead": a & ~b, "behind": b & ~a, "common": a & b}
+
+    def rivals(self, username, k=RIVALS_K, with_suffix_only=True):
+        """
+        Les k utilisateurs dont la progression est la plus proche de celle de
+        'username' : Jaccard décroissant, puis Hamming croissant, puis nom.
+        Un popcount par utilisateur, seuls les k meilleurs sont gardés.
+        Retourne [{"username", "jaccard", "hamming", "ahead", "behind", "common"}].
+        """
+        a = self.bitmap(username, with_suffix_only)
+
+        def scores():
+            for other in self.bitmaps:
+                if other != username:
+                    jaccard, hamming = similarity(a, self.bitmap(other, with_suffix_only))
+                    yield -jaccard, hamming, other
+
+        rivals = []
+        for jaccard, hamming, other in heapq.nsmallest(k, scores()):
+            b = self.bitmap(other, with_suffix_only)
+            rivals.append(
+                {
+                    "username": other,
+                    "jaccard": round(-jaccard, 4),
+                    "hamming": hamming,
+                    "ahead": popcount(a & ~b),  # bases que seul 'username' a
+                    "behind": popcount(b & ~a),
+                    "common": popcount(a & b),
+                }
+            )
+        return rivals
+
+    def all_rivals(self, k=RIVALS_K, with_suffix_only=True):
+        """{username: rivals(username, k)} pour tous les utilisateurs ayant des flags."""
+        return {username: self.rivals(username, k, with_suffix_only) for username in sorted(self.bitmaps)}
+
+
+def load_flag_bitmaps(conn, usernames=None):
+    """
+    FlagBitmapIndex de tous les utilisateurs (ou de ceux de 'usernames').
+    Ceux encore notés pour recalcul sont recalculés à la volée : l'index
+    lu est toujours celui des flags de la DB.
+    """
+    names = dict(conn.execute("SELECT bit, flag_base FROM flag_base_bits"))
+    params = {"names": json.dumps(list(usernames)) if usernames is not None else None}
+    selected = "(:names IS NULL OR {column} IN (SELECT value FROM json_each(:names)))"
+    bitmaps = {
+        username: (from_blob(bases), from_blob(suffixed))
+        for username, bases, suffixed in conn.execute(
+            f"""
+            SELECT username, bases, suffixed FROM user_flag_bitmaps
+            WHERE {selected.format(column="username")}
+              AND username NOT IN (SELECT username FROM flag_bitmaps_dirty)
+            """,
+            params,
+        )
+    }
+    bitmaps.update(_compute_bitmaps(conn, f"{_DIRTY} AND {selected.format(column='f.username')}", params))
+    return FlagBitmapIndex(names, bitmaps)
+
+
+if __name__ == "__main__":
+    from update_db import connect_db, initialize_database
+
+    parser = argparse.ArgumentParser(description="Index bitmap des bases de flags")
+    parser.add_argument("users", nargs="*", help="deux utilisateurs à comparer, ou un seul pour ses rivaux")
+    parser.add_argument("--rebuild", action="store_true", help="recalcule entièrement l'index")
+    args = parser.parse_args()
+
+    initialize_database()
+    conn = connect_db()
+    if args.rebuild:
+        rebuild_flag_bitmaps(conn)
+        conn.commit()
+        print(f"Index recalculé: {conn.execute('SELECT COUNT(*) FROM user_flag_bitmaps').fetchone()[0]} utilisateurs.")
+    if len(args.users) == 2:
+        index = load_flag_bitmaps(conn, args.users)
+        for name, value in index.compare(*args.users).items():
+            print(f"{name:6} {popcount(value):4}  {', '.join(index.bases(value))}")
+    elif len(args.users) == 1:
+        for rival in load_flag_bitmaps(conn).rivals(args.users[0]):
+            print(
+                f"{rival['username']:20} jaccard {rival['jaccard']:.2f}  hamming {rival['hamming']:3}"
+                f"  +{rival['ahead']} -{rival['behind']}"
+            )
+    conn.close()
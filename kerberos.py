@@ -183,13 +183,21 @@ NON_KERBERIZED_METHODS = [
 
 class KerberosClient:
     def __init__(
-        self, username=DEFAULT_USERNAME, password=DEFAULT_PWD, api_url=API_URL
+        self,
+        username=DEFAULT_USERNAME,
+        password=DEFAULT_PWD,
+        api_url=API_URL,
+        rate_limiter=None,
     ):
         self.username = username
         self.password = password
         self.api_url = api_url
         self.session_ticket = None
         self.session_key = None
+        # Optional object with an acquire() method, called before each API call
+        self.rate_limiter = rate_limiter
+        # Keep-alive HTTP session, reused across calls
+        self.http = requests.Session()
         self.authenticate()  # Authenticate on initialization
 
     def _send_request(
@@ -224,7 +232,7 @@ class KerberosClient:
                 "encrypted_args": encrypted_args,
             }
 
-        response = requests.post(
+        response = self.http.post(
             self.api_url, headers=HEADERS, data=json.dumps(payload)
         )
         response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
@@ -269,6 +277,9 @@ class KerberosClient:
         """
         is_kerberized = method_name in KERBERIZED_METHODS
 
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
         params = kwargs  # Use keyword arguments
 
         if args:
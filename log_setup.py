@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Journalisation partagée (scan, API, exploration des salles).
+
+L'appelant ne fait qu'ajouter l'enregistrement à une file (QueueHandler) :
+l'écriture sur stderr se fait dans le thread du QueueListener, une boucle
+chaude n'attend donc jamais la console. Un même avertissement répété (même
+message, arguments différents) n'est écrit qu'une fois par fenêtre de
+RATE_LIMIT_SECONDS, suivi du nombre de messages supprimés.
+
+    from log_setup import get_logger
+    log = get_logger(__name__)
+    log.debug("%d salles découvertes", count)
+
+Niveau réglable par la variable d'environnement LOG_LEVEL (défaut INFO).
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+# --- Configuration ---
+LOGGER_NAME = "kerberos_data"  # logger parent de tous les modules du projet
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+RATE_LIMIT_SECONDS = 10.0  # fenêtre par message répété (WARNING et au-dessus)
+# --- Fin Configuration ---
+
+_lock = threading.Lock()
+_listener = None
+_rate_filter = None
+_pid = None
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Laisse passer un message répété (clé : logger + gabarit du message) au
+    plus une fois par 'period' secondes, à partir du niveau 'min_level'.
+    """
+
+    def __init__(self, period=RATE_LIMIT_SECONDS, min_level=logging.WARNING):
+        super().__init__()
+        self.period = period
+        self.min_level = min_level
+        self.lock = threading.Lock()
+        self.seen = {}  # (logger, gabarit) -> [dernier passage, messages supprimés]
+
+    def filter(self, record):
+        if record.levelno < self.min_level:
+            return True
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self.lock:
+            entry = self.seen.get(key)
+            if entry is not None and now - entry[0] < self.period:
+                entry[1] += 1
+                return False
+            suppressed = entry[1] if entry is not None else 0
+            self.seen[key] = [now, 0]
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} messages similaires supprimés)"
+        return True
+
+    def pending(self):
+        """[(logger, gabarit, nombre)] des messages supprimés pas encore signalés."""
+        with self.lock:
+            return [(name, msg, entry[1]) for (name, msg), entry in self.seen.items() if entry[1]]
+
+
+def setup_logging(level=None, force=False):
+    """
+    Installe la file et son thread d'écriture (une fois par processus).
+    Appelée automatiquement par get_logger, et de nouveau dans un processus
+    fils après fork (le thread du parent n'y existe pas).
+    """
+    global _listener, _rate_filter, _pid
+    with _lock:
+        if _listener is not None and _pid == os.getpid() and not force:
+            return
+        logger = logging.getLogger(LOGGER_NAME)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        if _listener is not None and _pid == os.getpid():
+            _listener.stop()
+
+        records = queue.SimpleQueue()
+        handler = logging.handlers.QueueHandler(records)
+        _rate_filter = RateLimitFilter()
+        handler.addFilter(_rate_filter)
+        logger.addHandler(handler)
+        logger.setLevel(level or LOG_LEVEL)
+        logger.propagate = False
+
+        stream = logging.StreamHandler(sys.stderr)
+        stream.setFormatter(logging.Formatter(LOG_FORMAT))
+        _listener = logging.handlers.QueueListener(records, stream)
+        _listener.start()
+        _pid = os.getpid()
+
+
+def shutdown_logging():
+    """
+    Vide la file, arrête le thread d'écriture puis signale les messages
+    encore supprimés. À appeler explicitement avant un os._exit (processus
+    fils de multiprocessing) : atexit n'y est pas exécuté.
+    """
+    global _listener
+    with _lock:
+        listener, _listener = _listener, None
+        if listener is None or _pid != os.getpid():
+            return
+        listener.stop()
+        # Directement aux handlers de sortie : repassés par RateLimitFilter, les
+        # bilans (même gabarit) seraient supprimés sauf le premier de chaque logger
+        for name, msg, count in _rate_filter.pending():
+            logger = logging.getLogger(name)
+            if not logger.isEnabledFor(logging.WARNING):
+                continue
+            record = logger.makeRecord(
+                name, logging.WARNING, __file__, 0, "%d messages similaires supprimés: %s", (count, msg), None
+            )
+            for handler in listener.handlers:
+                handler.handle(record)
+
+
+def get_logger(name):
+    """Logger du module 'name', rattaché au logger du projet."""
+    setup_logging()
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+def _after_fork():
+    global _lock
+    _lock = threading.Lock()  # un autre thread du parent pouvait le détenir au moment du fork
+    setup_logging(force=True)
+
+
+atexit.register(shutdown_logging)
+os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""
+Migrations versionnées du schéma de la DB.
+
+create_tables (update_db.py) crée les tables de base ; chaque migration
+de MIGRATIONS s'applique ensuite une seule fois, dans sa propre
+transaction, et sa version est notée dans la table schema_version.
+Une étape est une requête SQL ou une fonction appelée avec la connexion.
+
+    python migrations.py            # applique les migrations en attente
+    python migrations.py --check    # vérifie que les requêtes clés utilisent leurs index
+    python migrations.py --wal      # passe la DB en WAL (une seule machine)
+    python migrations.py --no-wal   # revient au journal classique
+
+Le mode WAL est optionnel (WAL_MODE) : il permet de lire pendant une
+écriture, mais sa mémoire partagée ne fonctionne pas sur un disque
+réseau. Une DB partagée entre machines (scan_workers.py --join) doit
+rester en journal classique.
+"""
+import argparse
+import datetime
+import sqlite3
+import time
+
+from aggregates import AGGREGATE_TABLES, AGGREGATE_TRIGGERS, rebuild_aggregates
+from search_index import SEARCH_TABLES, SEARCH_TRIGGERS, rebuild_search_index
+from flag_bitmaps import BITMAP_TABLES, BITMAP_TRIGGERS, rebuild_flag_bitmaps
+from surrogate_keys import convert_to_surrogate_keys
+from user_documents import DOCUMENT_TABLES, DOCUMENT_TRIGGERS, rebuild_user_documents
+
+# --- Configuration ---
+MMAP_SIZE = 256 * 1024 * 1024  # octets lus par mmap plutôt que par read()
+CACHE_SIZE_KB = 64 * 1024  # cache de pages par connexion
+BUSY_TIMEOUT_MS = 30 * 1000  # attente d'un verrou avant "database is locked"
+WAL_MODE = False  # migrate passe la DB en WAL (incompatible avec scan_workers.py --join)
+# --- Fin Configuration ---
+
+
+def flag_columns_sql(flag, date):
+    """
+    Expressions SQL de flag_base, flag_suffix et date_epoch à partir des
+    expressions 'flag' et 'date' : mêmes règles à l'ingestion et pour la
+    migration des lignes existantes. Un flag sans ':' a pour base le flag
+    entier et un suffixe NULL ; une date illisible donne un epoch NULL.
+    """
+    return (
+        f"CASE WHEN instr({flag}, ':') > 0 THEN substr({flag}, 1, instr({flag}, ':') - 1) ELSE {flag} END",
+        f"CASE WHEN instr({flag}, ':') > 0 THEN substr({flag}, instr({flag}, ':') + 1) END",
+        f"CAST(strftime('%s', {date}) AS INTEGER)",
+    )
+
+
+def _backfill_flag_columns(conn):
+    base, suffix, epoch = flag_columns_sql("flag", "date")
+    conn.execute(f"UPDATE flags SET flag_base = {base}, flag_suffix = {suffix}, date_epoch = {epoch}")
+
+
+def _seed_positions(conn):
+    """Point de départ de l'historique : la position actuelle de chaque monde."""
+    for world_id, room, created_at in conn.execute(
+        "SELECT world_ID, room, created_at FROM worlds WHERE room IS NOT NULL"
+    ).fetchall():
+        try:
+            entered_at = int(datetime.datetime.fromisoformat(created_at).timestamp())
+        except (TypeError, ValueError):
+            entered_at = int(time.time())
+        conn.execute("INSERT OR IGNORE INTO world_keys (world_ID) VALUES (?)", (world_id,))
+        conn.execute("INSERT OR IGNORE INTO room_keys (name) VALUES (?)", (room,))
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO positions (world_key, room_key, entered_at)
+            SELECT w.id, r.id, ? FROM world_keys w, room_keys r
+            WHERE w.world_ID = ? AND r.name = ?
+            """,
+            (entered_at, world_id, room),
+        )
+
+
+MIGRATIONS = [
+    (
+        1,
+        "index de lecture (flags/worlds par utilisateur, cache négatif, archive)",
+        [
+            # Flags d'un utilisateur triés par date, sans lire la table
+            "CREATE INDEX IF NOT EXISTS idx_flags_username_date ON flags (username, date, flag)",
+            # Dernière position d'un utilisateur (where_is, /api/user/<username>)
+            """
+            CREATE INDEX IF NOT EXISTS idx_worlds_username_created
+            ON worlds (username, created_at, world_ID, location, room)
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_probe_cache_next ON world_probe_cache (next_probe)",
+            "CREATE INDEX IF NOT EXISTS idx_world_observations_seen ON world_observations (seen_at)",
+        ],
+    ),
+    (
+        2,
+        "historique des positions (transitions, occupation horaire)",
+        [
+            # Dictionnaires : les positions référencent des entiers, pas des chaînes de 32 caractères
+            "CREATE TABLE IF NOT EXISTS world_keys (id INTEGER PRIMARY KEY, world_ID TEXT UNIQUE)",
+            "CREATE TABLE IF NOT EXISTS room_keys (id INTEGER PRIMARY KEY, name TEXT UNIQUE)",
+            # Une ligne par changement de salle d'un monde (pas une par sondage)
+            """
+            CREATE TABLE IF NOT EXISTS positions (
+                world_key INTEGER,
+                room_key INTEGER,
+                entered_at INTEGER,
+                PRIMARY KEY (world_key, entered_at)
+            ) WITHOUT ROWID
+            """,
+            # Au-delà de la rétention : secondes passées par salle et par heure
+            """
+            CREATE TABLE IF NOT EXISTS position_hourly (
+                world_key INTEGER,
+                hour INTEGER,
+                room_key INTEGER,
+                seconds INTEGER,
+                PRIMARY KEY (world_key, hour, room_key)
+            ) WITHOUT ROWID
+            """,
+            _seed_positions,
+        ],
+    ),
+    (
+        3,
+        "flags normalisés (base, suffixe, date epoch) et leurs index",
+        [
+            "ALTER TABLE flags ADD COLUMN flag_base TEXT",
+            "ALTER TABLE flags ADD COLUMN flag_suffix TEXT",
+            "ALTER TABLE flags ADD COLUMN date_epoch INTEGER",
+            _backfill_flag_columns,
+            # Bases distinctes (/api/stats) : seuls les flags de la forme base:suffixe comptent
+            "CREATE INDEX IF NOT EXISTS idx_flags_base ON flags (flag_base) WHERE flag_suffix IS NOT NULL",
+            # Bases d'un utilisateur (/api/compare, flags_diff)
+            "CREATE INDEX IF NOT EXISTS idx_flags_username_base ON flags (username, flag_base, flag_suffix)",
+            "CREATE INDEX IF NOT EXISTS idx_flags_date_epoch ON flags (date_epoch)",
+        ],
+    ),
+    (
+        4,
+        "agrégats du tableau de bord maintenus par triggers (voir aggregates.py)",
+        [
+            *AGGREGATE_TABLES,
+            *AGGREGATE_TRIGGERS,
+            rebuild_aggregates,
+            # /api/stats lit db_totals : l'index des bases distinctes ne sert plus
+            "DROP INDEX IF EXISTS idx_flags_base",
+        ],
+    ),
+    (
+        5,
+        "index de recherche FTS5 (utilisateurs, salles, bases de flags ; voir search_index.py)",
+        [
+            *SEARCH_TABLES,
+            *SEARCH_TRIGGERS,
+            rebuild_search_index,
+        ],
+    ),
+    (
+        6,
+        "index bitmap des bases de flags par utilisateur (voir flag_bitmaps.py)",
+        [
+            *BITMAP_TABLES,
+            *BITMAP_TRIGGERS,
+            rebuild_flag_bitmaps,
+        ],
+    ),
+    (
+        7,
+        "clés entières de flags et worlds, vues de compatibilité (voir surrogate_keys.py)",
+        [convert_to_surrogate_keys],
+    ),
+    (
+        8,
+        "documents /api/user précalculés (voir user_documents.py)",
+        [
+            *DOCUMENT_TABLES,
+            *DOCUMENT_TRIGGERS,
+            rebuild_user_documents,
+        ],
+    ),
+]
+
+
+# (description, requête, paramètres, fragment attendu dans EXPLAIN QUERY PLAN)
+QUERY_PLAN_CHECKS = [
+    (
+        "flags d'un utilisateur par date",
+        "SELECT flag, date FROM flags WHERE username = ? ORDER BY date DESC",
+        ("x",),
+        "idx_flag_rows_user_date",
+    ),
+    (
+        "dernière position d'un utilisateur",
+        """
+        SELECT world_ID, location, room, created_at FROM worlds
+        WHERE username = ? ORDER BY created_at DESC, world_ID DESC LIMIT 1
+        """,
+        ("x",),
+        "idx_world_rows_user_created",
+    ),
+    (
+        "dernière position de chaque utilisateur",
+        """
+        SELECT user_id, world_key FROM (
+            SELECT w.user_id, w.world_key, ROW_NUMBER() OVER (
+                PARTITION BY w.user_id ORDER BY w.created_at DESC, k.world_ID DESC
+            ) AS rank FROM world_rows w JOIN world_keys k ON k.id = w.world_key
+            WHERE w.user_id IS NOT NULL
+        ) WHERE rank = 1
+        """,
+        (),
+        "idx_world_rows_user_created",
+    ),
+    (
+        "bases de flags d'un utilisateur",
+        "SELECT DISTINCT flag_base FROM flags WHERE username = ? AND flag_suffix IS NOT NULL",
+        ("x",),
+        "idx_flag_rows_user_base",
+    ),
+    (
+        "flags d'une liste (ingestion)",
+        "SELECT flag FROM flag_rows WHERE flag IN (SELECT value FROM json_each(?))",
+        ("[]",),
+        "sqlite_autoindex_flag_rows_1",
+    ),
+    (
+        "document /api/user d'un utilisateur",
+        "SELECT document, version FROM user_documents WHERE username = ?",
+        ("x",),
+        "sqlite_autoindex_user_documents_1",
+    ),
+    (
+        "recherche plein texte",
+        "SELECT kind, key FROM search_index WHERE search_index MATCH ? ORDER BY rank LIMIT 10",
+        ('"x"*',),
+        "VIRTUAL TABLE INDEX",
+    ),
+    (
+        "mondes du cache négatif",
+        "SELECT world_ID, next_probe FROM world_probe_cache WHERE next_probe > ?",
+        (0,),
+        "idx_probe_cache_next",
+    ),
+]
+
+
+def configure_connection(conn):
+    """
+    Réglages par connexion (non persistants) : à appeler après chaque
+    sqlite3.connect. Le mode WAL, lui, est enregistré dans le fichier.
+    """
+    if is_wal(conn):
+        conn.execute("PRAGMA synchronous=NORMAL")  # sûr en WAL, un fsync par checkpoint
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
+
+
+def is_wal(conn):
+    return conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def set_journal_mode(conn, wal):
+    """
+    Passe la DB en WAL ou en journal classique (DELETE), hors transaction.
+    Le mode est enregistré dans le fichier. Retourne le mode obtenu.
+    """
+    return conn.execute(f"PRAGMA journal_mode={'WAL' if wal else 'DELETE'}").fetchone()[0]
+
+
+def current_version(conn):
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn, wal=WAL_MODE):
+    """
+    Applique les migrations en attente, passe la DB en WAL si 'wal' (une
+    DB déjà en WAL y reste, voir set_journal_mode) et met à jour les
+    statistiques du planificateur (ANALYZE) si le schéma a changé.
+    Le passage en auto_vacuum incrémental, qui réécrit toute la DB, est
+    laissé à la maintenance (partitions.run_maintenance).
+    Plusieurs processus peuvent l'appeler en même temps : BEGIN IMMEDIATE
+    sérialise, et la version est relue une fois le verrou obtenu.
+    Retourne la liste des versions appliquées.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at REAL
+        )
+        """
+    )
+    conn.commit()
+
+    applied = []
+    for version, name, steps in MIGRATIONS:
+        if version <= current_version(conn):
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= current_version(conn):
+                conn.rollback()  # appliquée entre-temps par un autre processus
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, time.time()),
+            )
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        applied.append(version)
+
+    # Hors transaction : journal_mode ne peut pas changer au milieu d'une transaction
+    if wal and not is_wal(conn):
+        set_journal_mode(conn, wal=True)
+    if applied:
+        conn.execute("ANALYZE")
+        conn.commit()
+    return applied
+
+
+def check_query_plans(conn):
+    """
+    Vérifie avec EXPLAIN QUERY PLAN que chaque requête de QUERY_PLAN_CHECKS
+    utilise l'index attendu (aucun parcours complet de table).
+    Retourne la liste des échecs (vide si tout va bien).
+    """
+    failures = []
+    for label, query, params, expected in QUERY_PLAN_CHECKS:
+        plan = " | ".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params))
+        if expected not in plan:
+            failures.append({"query": label, "expected": expected, "plan": plan})
+    return failures
+
+
+if __name__ == "__main__":
+    from db_access import open_connection
+    from update_db import initialize_database
+
+    parser = argparse.ArgumentParser(description="Migrations du schéma de la DB")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="vérifie que les requêtes clés utilisent leurs index (code de sortie 1 sinon)",
+    )
+    journal = parser.add_mutually_exclusive_group()
+    journal.add_argument("--wal", action="store_true", help="passe la DB en WAL (une seule machine)")
+    journal.add_argument("--no-wal", action="store_true", help="revient au journal classique (DB partagée)")
+    args = parser.parse_args()
+
+    initialize_database()  # crée les tables et applique les migrations
+    conn = open_connection()
+    print(f"Schéma en version {current_version(conn)}.")
+    if args.wal or args.no_wal:
+        print(f"Journal: {set_journal_mode(conn, wal=args.wal)}.")
+    if args.check:
+        failures = check_query_plans(conn)
+        for failure in failures:
+            print(f"Index non utilisé pour '{failure['query']}' ({failure['expected']}): {failure['plan']}")
+        print("Plans de requête OK." if not failures else f"{len(failures)} requête(s) sans index.")
+        conn.close()
+        raise SystemExit(1 if failures else 0)
+    conn.close()
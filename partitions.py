@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+Partitions mensuelles de l'historique et maintenance de la DB principale.
+
+Les tables d'historique (world_observations, raw_payloads, position_hourly)
+grossissent sans fin. archive_old_history déplace leurs lignes plus
+anciennes que ARCHIVE_AFTER_DAYS dans une DB par mois
+(db/archive/history_AAAA_MM.db). Une partition est autonome : elle
+contient aussi les réponses brutes de ses observations.
+
+La DB principale reste petite. run_maintenance rend au système les
+pages libérées par petits pas et met à jour les statistiques (ANALYZE),
+sans VACUUM bloquant. Le scanner résident la lance pendant ses temps
+morts. Les petits pas demandent auto_vacuum=INCREMENTAL : le passage
+dans ce mode réécrit toute la DB (VACUUM) et ne se fait qu'à la demande
+(--vacuum), jamais au démarrage de l'API ou du scanner.
+
+Les lectures qui remontent dans le temps utilisent attached_history :
+les partitions de l'intervalle sont attachées et les vues temporaires
+all_<table> unissent la table principale et ces partitions.
+
+users, worlds et flags restent dans la DB principale : c'est l'état
+courant, lu par chaque page et suivi par les agrégats.
+
+    python partitions.py            # archive l'historique ancien et fait la maintenance
+    python partitions.py --vacuum   # idem, après passage unique en auto_vacuum incrémental
+    python partitions.py --list     # partitions existantes
+"""
+import argparse
+import contextlib
+import datetime
+import os
+import re
+import sqlite3
+import time
+
+# --- Configuration ---
+ARCHIVE_DIR = os.path.join("db", "archive")
+ARCHIVE_AFTER_DAYS = 90  # au-delà, l'historique quitte la DB principale (> POSITION_RETENTION_DAYS)
+MAX_ATTACHED = 8  # partitions attachées à la fois (SQLite en accepte 10 par défaut)
+VACUUM_STEP_PAGES = 1000  # pages rendues par pas de vacuum incrémental (un verrou court par pas)
+# --- Fin Configuration ---
+
+# table -> (colonnes, date de la ligne en secondes epoch, schéma dans une partition)
+PARTITIONED = {
+    "world_observations": (
+        "id, world_ID, username, location, room, payload_hash, seen_at",
+        "seen_at",
+        """
+        CREATE TABLE IF NOT EXISTS {schema}.world_observations (
+            id INTEGER PRIMARY KEY,
+            world_ID TEXT,
+            username TEXT,
+            location TEXT,
+            room TEXT,
+            payload_hash TEXT,
+            seen_at REAL
+        )
+        """,
+    ),
+    "raw_payloads": (
+        "hash, kind, data, raw_size, first_seen, last_seen",
+        "last_seen",
+        """
+        CREATE TABLE IF NOT EXISTS {schema}.raw_payloads (
+            hash TEXT PRIMARY KEY,
+            kind TEXT,
+            data BLOB,
+            raw_size INTEGER,
+            first_seen REAL,
+            last_seen REAL
+        )
+        """,
+    ),
+    "position_hourly": (
+        "world_key, hour, room_key, seconds",
+        "hour * 3600",
+        """
+        CREATE TABLE IF NOT EXISTS {schema}.position_hourly (
+            world_key INTEGER,
+            hour INTEGER,
+            room_key INTEGER,
+            seconds INTEGER,
+            PRIMARY KEY (world_key, hour, room_key)
+        ) WITHOUT ROWID
+        """,
+    ),
+}
+PARTITION_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_world_observations_seen ON world_observations (seen_at)",
+]
+_PARTITION_FILE = re.compile(r"^history_(\d{4})_(\d{2})\.db$")
+
+
+def _month(epoch):
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc).strftime("%Y_%m")
+
+
+def list_partitions(archive_dir=ARCHIVE_DIR):
+    """[(mois "AAAA_MM", chemin)] des partitions existantes, de la plus ancienne à la plus récente."""
+    if not os.path.isdir(archive_dir):
+        return []
+    return sorted(
+        (f"{match.group(1)}_{match.group(2)}", os.path.join(archive_dir, entry))
+        for entry in os.listdir(archive_dir)
+        if (match := _PARTITION_FILE.match(entry))
+    )
+
+
+def _attach_partition(conn, month, archive_dir):
+    schema = f"history_{month}"
+    conn.execute("ATTACH DATABASE ? AS " + schema, (os.path.join(archive_dir, f"{schema}.db"),))
+    for _, _, ddl in PARTITIONED.values():
+        conn.execute(ddl.format(schema=schema))
+    for ddl in PARTITION_INDEXES:
+        conn.execute(ddl.format(schema=schema))
+    return schema
+
+
+def archive_old_history(conn, older_than_days=ARCHIVE_AFTER_DAYS, archive_dir=ARCHIVE_DIR, now=None):
+    """
+    Déplace l'historique plus ancien que 'older_than_days' vers les
+    partitions mensuelles, un mois par transaction. À appeler hors
+    transaction (ATTACH). Copie puis suppression, en INSERT OR IGNORE :
+    une interruption laisse au pire une ligne dans les deux DB, et la
+    relance termine le déplacement sans rien perdre.
+    Retourne {table: lignes déplacées}.
+    """
+    cutoff = (now or time.time()) - older_than_days * 86400
+    os.makedirs(archive_dir, exist_ok=True)
+    moved = {table: 0 for table in PARTITIONED}
+    month_sql = "strftime('%Y_%m', {expr}, 'unixepoch')"
+
+    # Observations d'abord, avec leurs réponses brutes : chaque partition se suffit
+    # à elle-même. Puis les réponses brutes restantes et l'occupation horaire.
+    for table in ("world_observations", "raw_payloads", "position_hourly"):
+        columns, expr, _ = PARTITIONED[table]
+        months = [
+            row[0]
+            for row in conn.execute(
+                f"SELECT DISTINCT {month_sql.format(expr=expr)} FROM main.{table} WHERE {expr} < ?",
+                (cutoff,),
+            )
+        ]
+        for month in months:
+            schema = _attach_partition(conn, month, archive_dir)
+            condition = f"{expr} < :cutoff AND {month_sql.format(expr=expr)} = :month"
+            params = {"cutoff": cutoff, "month": month}
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                if table == "world_observations":
+                    conn.execute(
+                        f"""
+                        INSERT OR IGNORE INTO {schema}.raw_payloads ({PARTITIONED['raw_payloads'][0]})
+                        SELECT {PARTITIONED['raw_payloads'][0]} FROM main.raw_payloads
+                        WHERE hash IN (SELECT payload_hash FROM main.world_observations WHERE {condition})
+                        """,
+                        params,
+                    )
+                conn.execute(
+                    f"INSERT OR IGNORE INTO {schema}.{table} ({columns}) "
+                    f"SELECT {columns} FROM main.{table} WHERE {condition}",
+                    params,
+                )
+                moved[table] += conn.execute(f"DELETE FROM main.{table} WHERE {condition}", params).rowcount
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+            finally:
+                conn.execute(f"DETACH DATABASE {schema}")
+    return moved
+
+
+def _detach_all(conn):
+    for _, name, _ in conn.execute("PRAGMA database_list").fetchall():
+        if name.startswith("history_"):
+            conn.execute(f"DETACH DATABASE {name}")
+    for table in PARTITIONED:
+        conn.execute(f"DROP VIEW IF EXISTS temp.all_{table}")
+
+
+@contextlib.contextmanager
+def attached_history(conn, start=None, end=None, archive_dir=ARCHIVE_DIR):
+    """
+    Attache les partitions des mois entre 'start' et 'end' (secondes epoch,
+    None : sans limite) et crée les vues temporaires all_<table>, union de
+    la table principale et de ces partitions. À utiliser hors transaction.
+    ValueError si l'intervalle couvre plus de MAX_ATTACHED partitions.
+    """
+    first = _month(start) if start is not None else ""
+    last = _month(end) if end is not None else "9999_99"
+    months = [month for month, _ in list_partitions(archive_dir) if first <= month <= last]
+    if len(months) > MAX_ATTACHED:
+        raise ValueError(
+            f"Intervalle trop long: {len(months)} partitions mensuelles (maximum {MAX_ATTACHED})"
+        )
+    _detach_all(conn)
+    try:
+        schemas = []
+        for month in months:
+            schema = f"history_{month}"
+            conn.execute("ATTACH DATABASE ? AS " + schema, (os.path.join(archive_dir, f"{schema}.db"),))
+            schemas.append(schema)
+        for table, (columns, _, _) in PARTITIONED.items():
+            union = " UNION ALL ".join(
+                f"SELECT {columns} FROM {schema}.{table}" for schema in ["main", *schemas]
+            )
+            conn.execute(f"CREATE TEMP VIEW all_{table} AS {union}")
+        yield schemas
+    finally:
+        _detach_all(conn)
+
+
+def iter_archived_observations(archive_dir=ARCHIVE_DIR):
+    """
+    Observations archivées, de la plus ancienne à la plus récente :
+    (world_ID, username, location, room, seen_at, payload_hash, data).
+    data vaut None si la réponse brute est encore dans la DB principale.
+    Chaque partition est lue par sa propre connexion (pas de limite d'ATTACH).
+    """
+    for _, path in list_partitions(archive_dir):
+        partition = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+        try:
+            yield from partition.execute(
+                """
+                SELECT o.world_ID, o.username, o.location, o.room, o.seen_at, o.payload_hash, p.data
+                FROM world_observations o
+                LEFT JOIN raw_payloads p ON p.hash = o.payload_hash
+                ORDER BY o.seen_at, o.id
+                """
+            )
+        finally:
+            partition.close()
+
+
+def enable_incremental_vacuum(conn):
+    """
+    Passe la DB en auto_vacuum=INCREMENTAL, hors transaction. La première
+    fois, le VACUUM réécrit toute la DB avec les pages de pointeurs
+    nécessaires (long, bloque toute écriture). Retourne True s'il a eu lieu.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return False
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+    return True
+
+
+def run_maintenance(
+    conn, older_than_days=ARCHIVE_AFTER_DAYS, archive_dir=ARCHIVE_DIR, step_pages=VACUUM_STEP_PAGES, vacuum=False
+):
+    """
+    Maintenance de la DB principale, hors transaction : archive l'historique
+    ancien, met à jour les statistiques du planificateur, puis rend les
+    pages libres par pas de 'step_pages' (un court verrou d'écriture par pas).
+    vacuum=True passe d'abord la DB en auto_vacuum incrémental si elle ne
+    l'est pas (voir enable_incremental_vacuum) ; sinon une DB dans un autre
+    mode garde ses pages libres.
+    Retourne {"archived": {table: lignes}, "vacuumed", "freed_pages", "analyzed_in"}.
+    """
+    vacuumed = enable_incremental_vacuum(conn) if vacuum else False
+    archived = archive_old_history(conn, older_than_days, archive_dir)
+    start = time.perf_counter()
+    conn.execute("ANALYZE")
+    conn.commit()
+    analyzed_in = round(time.perf_counter() - start, 3)
+
+    freed = 0
+    while True:
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if free == 0 or conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            break
+        conn.execute(f"PRAGMA incremental_vacuum({step_pages})").fetchall()
+        conn.commit()
+        freed += free - conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return {"archived": archived, "vacuumed": vacuumed, "freed_pages": freed, "analyzed_in": analyzed_in}
+
+
+if __name__ == "__main__":
+    from update_db import connect_db, initialize_database
+
+    parser = argparse.ArgumentParser(description="Partitions mensuelles de l'historique")
+    parser.add_argument("--list", action="store_true", help="liste les partitions")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="âge minimum archivé (jours)")
+    parser.add_argument(
+        "--vacuum",
+        action="store_true",
+        help="passe d'abord la DB en auto_vacuum incrémental (VACUUM complet, une seule fois)",
+    )
+    args = parser.parse_args()
+
+    if args.list:
+        for month, path in list_partitions():
+            print(f"{month}  {os.path.getsize(path) // 1024} Ko  {path}")
+    else:
+        initialize_database()
+        conn = connect_db()
+        print(f"Maintenance: {run_maintenance(conn, args.days, vacuum=args.vacuum)}")
+        conn.close()
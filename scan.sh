@@ -1,8 +1,11 @@
 #!/bin/bash
 
+# Scanner résident : client Kerberos et connexion DB gardés ouverts,
+# rafraîchissement par monde planifié par priorité (voir scan_daemon.py).
+# Débit réglable via SCAN_RATE (appels/s) ou --rate.
 while true; do
-  echo "Updating database $(date)"
-  python3 update_db.py
-  echo "Database updated"
+  echo "Démarrage du scanner $(date)"
+  python3 scan_daemon.py "$@"
+  echo "Scanner arrêté, redémarrage dans 60s"
   sleep 60
 done
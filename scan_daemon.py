@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+"""
+Scanner résident qui remplace la boucle de scan.sh.
+
+Le processus garde un client Kerberos ouvert et héberge l'écrivain unique
+de la DB (db_writer.py) : ses propres écritures comme celles de l'API
+passent par la file de l'écrivain, les lectures par une connexion à part.
+Il publie aussi la copie de lecture de l'API
+(snapshots.py). Il planifie le rafraîchissement de chaque monde dans une file de priorité :
+un monde qui vient de bouger ou de gagner un flag est réinterrogé vite,
+un monde inactif de plus en plus rarement.
+
+Contrôle via un socket local (JSON, une commande par ligne) :
+    {"command": "status"}
+    {"command": "pause"} / {"command": "resume"}
+    {"command": "set_rate", "rate": 5}
+    {"command": "boost", "world_id": "..."}
+    {"command": "rescan"}
+    {"command": "write", "operation": "positions", "payload": {...}}
+    {"command": "stop"}
+"""
+import argparse
+import heapq
+import json
+import os
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from db_writer import WRITE_OPERATIONS, DatabaseWriter
+from kerberos import KerberosClient, OpensslError
+from log_setup import get_logger
+from partitions import run_maintenance
+from snapshots import SNAPSHOT_DIR
+from update_db import (
+    archive_payload,
+    classify_error,
+    compact_positions,
+    connect_db,
+    initialize_database,
+    load_world_hashes,
+    negative_cache_skip,
+    record_probe_failures,
+    save_world_batch,
+    scan_world,
+    strip_unchanged,
+)
+
+# --- Configuration ---
+CONTROL_HOST = "127.0.0.1"
+CONTROL_PORT = int(os.getenv("SCAN_DAEMON_PORT", "5003"))
+DEFAULT_RATE = float(os.getenv("SCAN_RATE", "4"))  # appels API par seconde
+MIN_INTERVAL = 30  # secondes, monde actif (déplacement ou nouveau flag)
+MAX_INTERVAL = 30 * 60  # secondes, monde inactif ou sans protagoniste
+LIST_REFRESH_INTERVAL = 120  # secondes entre deux appels à world.list
+REAUTH_AFTER_ERRORS = 5  # erreurs consécutives avant de se ré-authentifier
+COMPACT_INTERVAL = 24 * 3600  # secondes entre deux résumés de l'historique des positions
+MAINTENANCE_INTERVAL = 6 * 3600  # secondes entre deux maintenances (archives, ANALYZE, vacuum)
+MAINTENANCE_IDLE_SECONDS = 10  # lancée quand aucun monde n'est dû avant ce délai...
+# ... ou, sans temps mort, après deux intervalles
+WRITE_TIMEOUT = 60  # secondes d'attente d'une écriture demandée par la commande "write"
+# --- Fin Configuration ---
+
+log = get_logger("scan_daemon")
+
+
+class RateLimiter:
+    """Seau à jetons : limite le nombre d'appels API par seconde."""
+
+    def __init__(self, rate):
+        self.lock = threading.Lock()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = max(float(rate), 0.01)
+            self.tokens = 1.0
+            self.last = time.monotonic()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class WorldScheduler:
+    """
+    File de priorité (heap) des mondes à rafraîchir, triée par échéance.
+    L'intervalle d'un monde retombe à MIN_INTERVAL dès qu'il change et
+    double à chaque passage sans changement, jusqu'à MAX_INTERVAL.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.heap = []  # (échéance, seq, world_id)
+        self.intervals = {}  # world_id -> intervalle courant
+        self.due = {}  # world_id -> échéance valide (les autres entrées du heap sont périmées)
+        self.seq = 0
+
+    def __len__(self):
+        return len(self.due)
+
+    def _push(self, world_id, due):
+        self.seq += 1
+        self.due[world_id] = due
+        heapq.heappush(self.heap, (due, self.seq, world_id))
+
+    def sync(self, world_ids, not_before=None):
+        """
+        Ajoute les nouveaux mondes (à scanner tout de suite, ou à partir de
+        not_before[world_id] s'ils sont dans le cache négatif) et oublie les disparus.
+        """
+        now = time.time()
+        not_before = not_before or {}
+        with self.lock:
+            world_ids = set(world_ids)
+            for world_id in world_ids - self.due.keys():
+                self.intervals[world_id] = MIN_INTERVAL
+                self._push(world_id, max(now, not_before.get(world_id, now)))
+            for world_id in self.due.keys() - world_ids:
+                del self.due[world_id]
+                self.intervals.pop(world_id, None)
+
+    def pop_due(self):
+        """Retourne le prochain monde échu, ou (None, délai avant le suivant)."""
+        with self.lock:
+            while self.heap:
+                due, _, world_id = self.heap[0]
+                if self.due.get(world_id) != due:
+                    heapq.heappop(self.heap)  # entrée périmée
+                    continue
+                delay = due - time.time()
+                if delay > 0:
+                    return None, delay
+                heapq.heappop(self.heap)
+                return world_id, 0
+            return None, 1.0
+
+    def reschedule(self, world_id, active=False, empty=False):
+        with self.lock:
+            if world_id not in self.due:
+                return
+            if empty:
+                interval = MAX_INTERVAL
+            elif active:
+                interval = MIN_INTERVAL
+            else:
+                interval = min(self.intervals.get(world_id, MIN_INTERVAL) * 2, MAX_INTERVAL)
+            self.intervals[world_id] = interval
+            self._push(world_id, time.time() + interval)
+
+    def boost(self, world_id):
+        """Force le scan d'un monde au prochain tour."""
+        with self.lock:
+            self.intervals[world_id] = MIN_INTERVAL
+            self._push(world_id, time.time())
+
+    def boost_all(self):
+        """Force le scan de tous les mondes connus ; retourne leur nombre."""
+        with self.lock:
+            for world_id in list(self.due):
+                self.intervals[world_id] = MIN_INTERVAL
+                self._push(world_id, time.time())
+            return len(self.due)
+
+
+class ScanDaemon:
+    def __init__(self, rate=DEFAULT_RATE, protected=False):
+        self.limiter = RateLimiter(rate)
+        self.scheduler = WorldScheduler()
+        self.protected = protected
+        self.client = None
+        self.conn = None  # lectures seulement
+        self.writer = DatabaseWriter(snapshot_dir=SNAPSHOT_DIR)
+        self.hashes = {}  # world_id -> empreintes du dernier contenu écrit
+        self.paused = threading.Event()
+        self.stopping = threading.Event()
+        self.last_list_refresh = 0
+        self.last_compaction = 0
+        self.last_maintenance = 0
+        self.consecutive_errors = 0
+        self.stats = {
+            "started_at": time.time(),
+            "scanned": 0,
+            "moved": 0,
+            "new_flags": 0,
+            "empty": 0,
+            "unchanged": 0,
+            "errors": 0,
+            "last_world": None,
+            "last_scan_at": None,
+        }
+
+    # --- Cycle de vie ---
+    def start(self):
+        initialize_database()
+        self.conn = connect_db()
+        self.writer.start()
+        self.hashes = load_world_hashes(self.conn)
+        self.client = KerberosClient(rate_limiter=self.limiter)
+        log.info("Scanner démarré (%s appels/s).", self.limiter.rate)
+        while not self.stopping.is_set():
+            if self.paused.is_set():
+                self.stopping.wait(1)
+                continue
+            self.refresh_world_list()
+            self.compact_history()
+            world_id, delay = self.scheduler.pop_due()
+            self.maintain(idle_for=delay)
+            if world_id is None:
+                self.stopping.wait(min(delay, 1.0))
+                continue
+            self.refresh_world(world_id)
+        self.writer.stop()
+        self.conn.close()
+        log.info("Scanner arrêté.")
+
+    def stop(self):
+        self.stopping.set()
+
+    # --- Travail ---
+    def refresh_world_list(self, force=False):
+        if not force and time.time() - self.last_list_refresh < LIST_REFRESH_INTERVAL:
+            return
+        try:
+            world_list = self.client.list_worlds()
+            self.writer.submit(archive_payload, "world_list", world_list, commit=False)
+            self.scheduler.sync((w[0] for w in world_list), negative_cache_skip(self.conn))
+            self.last_list_refresh = time.time()
+        except Exception as e:
+            log.warning("Erreur lors de world.list: %s: %s", e.__class__.__name__, e)
+            self.record_error()
+
+    def compact_history(self):
+        if time.time() - self.last_compaction < COMPACT_INTERVAL:
+            return
+        self.last_compaction = time.time()
+        self.writer.submit(compact_positions, commit=False).add_done_callback(self._compacted)
+
+    def _compacted(self, future):
+        if future.exception() is not None:
+            log.warning("Erreur SQLite (historique des positions): %s", future.exception())
+        else:
+            log.info("Historique des positions résumé: %s", future.result())
+
+    def maintain(self, idle_for=0):
+        """Maintenance de la DB par l'écrivain, de préférence pendant un temps mort."""
+        elapsed = time.time() - self.last_maintenance
+        if elapsed < MAINTENANCE_INTERVAL:
+            return
+        if idle_for < MAINTENANCE_IDLE_SECONDS and elapsed < 2 * MAINTENANCE_INTERVAL:
+            return
+        self.last_maintenance = time.time()
+        self.writer.submit_alone(run_maintenance).add_done_callback(self._maintained)
+
+    def _maintained(self, future):
+        if future.exception() is not None:
+            log.warning("Erreur pendant la maintenance de la DB: %s", future.exception())
+        else:
+            log.info("Maintenance de la DB: %s", future.result())
+
+    def refresh_world(self, world_id):
+        try:
+            result = scan_world(self.client, world_id, self.protected)
+            changed = strip_unchanged(result, self.hashes) if result is not None else None
+            if result is None:
+                self.stats["empty"] += 1
+                self.writer.submit(record_probe_failures, {world_id: "empty"}, commit=False)
+                self.scheduler.reschedule(world_id, empty=True)
+            elif changed is None:
+                # Même contenu et même position : aucune écriture
+                self.stats["unchanged"] += 1
+                self.scheduler.reschedule(world_id)
+            else:
+                # Replanifié une fois écrit, selon ce qui a changé
+                self.hashes[world_id] = result["hashes"]
+                self.writer.submit(save_world_batch, [changed], commit=False).add_done_callback(
+                    lambda future: self._saved(world_id, future)
+                )
+            self.consecutive_errors = 0
+        except Exception as e:
+            log.warning("Erreur processing world %s: %s: %s", world_id, e.__class__.__name__, e)
+            if classify_error(e) == "permanent":
+                # Une erreur transitoire (réseau, ticket expiré) ne dit rien du monde
+                self.writer.submit(record_probe_failures, {world_id: "error"}, commit=False)
+            self.scheduler.reschedule(world_id)
+            self.record_error()
+        self.stats["scanned"] += 1
+        self.stats["last_world"] = world_id
+        self.stats["last_scan_at"] = time.time()
+
+    def _saved(self, world_id, future):
+        """Rappel de l'écrivain après l'écriture d'un monde."""
+        if future.exception() is not None:
+            log.warning("Erreur SQLite (monde %s): %s", world_id, future.exception())
+            self.hashes.pop(world_id, None)  # réécrit entièrement au prochain scan
+            self.stats["errors"] += 1
+            self.scheduler.reschedule(world_id)
+            return
+        changes = future.result()
+        self.stats["moved"] += changes["moved"]
+        self.stats["new_flags"] += changes["new_flags"]
+        self.scheduler.reschedule(world_id, active=changes["moved"] > 0 or changes["new_flags"] > 0)
+
+    def record_error(self):
+        self.stats["errors"] += 1
+        self.consecutive_errors += 1
+        if self.consecutive_errors >= REAUTH_AFTER_ERRORS:
+            # Le TGT a pu expirer : on se ré-authentifie sans relancer le processus
+            try:
+                self.client.authenticate()
+                log.info("Client Kerberos ré-authentifié.")
+            except (ValueError, OpensslError, OSError) as e:
+                log.warning("Ré-authentification impossible: %s", e)
+            self.consecutive_errors = 0
+
+    # --- Contrôle ---
+    def status(self):
+        return {
+            **self.stats,
+            "paused": self.paused.is_set(),
+            "rate": self.limiter.rate,
+            "worlds": len(self.scheduler),
+            "writer": dict(self.writer.stats, queued=self.writer.operations.qsize()),
+        }
+
+    def write(self, operation, payload):
+        """Exécute une opération de WRITE_OPERATIONS par l'écrivain et retourne son résultat."""
+        if operation not in WRITE_OPERATIONS:
+            return {"success": False, "error": f"Opération d'écriture inconnue: {operation}"}
+        if not isinstance(payload, dict):
+            return {"success": False, "error": "Paramètre 'payload' invalide."}
+        try:
+            # L'API relit la copie de lecture : elle doit contenir cette écriture
+            future = self.writer.submit_published(WRITE_OPERATIONS[operation], **payload)
+            return {"success": True, "result": future.result(timeout=WRITE_TIMEOUT)}
+        except FutureTimeoutError:
+            return {"success": False, "error": f"Écriture non terminée après {WRITE_TIMEOUT}s."}
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            return {"success": False, "error": f"{e.__class__.__name__}: {e}"}
+
+    def handle_command(self, message):
+        command = message.get("command")
+        if command == "status":
+            return {"success": True, "status": self.status()}
+        if command == "pause":
+            self.paused.set()
+        elif command == "resume":
+            self.paused.clear()
+        elif command == "set_rate":
+            try:
+                self.limiter.set_rate(float(message["rate"]))
+            except (KeyError, TypeError, ValueError):
+                return {"success": False, "error": "Paramètre 'rate' invalide."}
+        elif command == "boost":
+            if not message.get("world_id"):
+                return {"success": False, "error": "Paramètre 'world_id' requis."}
+            self.scheduler.boost(message["world_id"])
+        elif command == "rescan":
+            return {"success": True, "worlds": self.scheduler.boost_all(), "status": self.status()}
+        elif command == "write":
+            return self.write(message.get("operation"), message.get("payload", {}))
+        elif command == "stop":
+            self.stop()
+        else:
+            return {"success": False, "error": f"Commande inconnue: {command}"}
+        return {"success": True, "status": self.status()}
+
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError:  # JSON ou UTF-8 invalide
+                request = None
+            if isinstance(request, dict):
+                response = self.server.scanner.handle_command(request)
+            else:
+                response = {"success": False, "error": "Requête invalide: objet JSON attendu."}
+            self.wfile.write((json.dumps(response) + "\n").encode())
+
+
+class ControlServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, scanner, host=CONTROL_HOST, port=CONTROL_PORT):
+        super().__init__((host, port), _ControlHandler)
+        self.scanner = scanner
+
+
+def send_command(command, params=None, host=CONTROL_HOST, port=CONTROL_PORT, timeout=5):
+    """
+    Envoie une commande au scanner et retourne sa réponse (dict).
+    params: paramètres de la commande ({"rate": ...}), séparés des
+    réglages de connexion pour qu'un appelant ne puisse pas les fournir.
+    """
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        sock.sendall((json.dumps({**(params or {}), "command": command}) + "\n").encode())
+        with sock.makefile("r") as reader:
+            return json.loads(reader.readline())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scanner résident Kerberos")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="appels API par seconde")
+    parser.add_argument("--port", type=int, default=CONTROL_PORT, help="port de contrôle local")
+    parser.add_argument("--protected", action="store_true", help="ne pas stocker les emails")
+    args = parser.parse_args()
+
+    daemon = ScanDaemon(rate=args.rate, protected=args.protected)
+    server = ControlServer(daemon, port=args.port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Contrôle disponible sur {CONTROL_HOST}:{args.port}")
+    try:
+        daemon.start()
+    except KeyboardInterrupt:
+        daemon.stop()
+    finally:
+        server.shutdown()
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Profilage d'un passage de scan : temps par étape et par monde, mondes les
+plus lents, erreurs par classe d'exception et pic mémoire (tracemalloc).
+
+Utilisation :
+    profiler = ScanProfiler()
+    scan_to_database(client, profile=profiler)
+    print(profiler.summary())
+    profiler.save("scan_profile.json")
+"""
+import contextlib
+import json
+import threading
+import time
+import tracemalloc
+
+STAGES = ["user_from_world", "location", "room_name", "data_collection", "db_write"]
+
+
+def stage(profiler, world_id, name):
+    """Chronomètre une étape si un profiler est fourni, sinon ne fait rien."""
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.stage(world_id, name)
+
+
+class ScanProfiler:
+    def __init__(self, slowest=10, trace_memory=True):
+        self.slowest = slowest
+        self.trace_memory = trace_memory
+        self.lock = threading.Lock()
+        self.worlds = {}  # world_id -> {étape: secondes}
+        self.errors = {}  # nom de classe -> nombre
+        self.started_at = None
+        self.finished_at = None
+        self.peak_memory = 0
+        self.top_allocations = []
+
+    # --- Collecte ---
+    def start(self):
+        self.started_at = time.perf_counter()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stop(self):
+        self.finished_at = time.perf_counter()
+        if self.trace_memory and tracemalloc.is_tracing():
+            self.sample_memory()
+            snapshot = tracemalloc.take_snapshot()
+            self.top_allocations = [
+                {"location": str(stat.traceback), "size_kb": round(stat.size / 1024, 1)}
+                for stat in snapshot.statistics("lineno")[:5]
+            ]
+            tracemalloc.stop()
+
+    @contextlib.contextmanager
+    def stage(self, world_id, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(world_id, name, time.perf_counter() - start)
+
+    def add_time(self, world_id, name, seconds):
+        with self.lock:
+            stages = self.worlds.setdefault(world_id, {})
+            stages[name] = stages.get(name, 0.0) + seconds
+
+    def add_error(self, exc):
+        with self.lock:
+            name = exc.__class__.__name__
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def sample_memory(self):
+        if tracemalloc.is_tracing():
+            self.peak_memory = max(self.peak_memory, tracemalloc.get_traced_memory()[1])
+
+    # --- Restitution ---
+    def report(self):
+        with self.lock:
+            totals = {name: 0.0 for name in STAGES}
+            for stages in self.worlds.values():
+                for name, seconds in stages.items():
+                    totals[name] = totals.get(name, 0.0) + seconds
+            per_world = sorted(
+                (
+                    {"world_ID": world_id, "total": sum(stages.values()), "stages": stages}
+                    for world_id, stages in self.worlds.items()
+                ),
+                key=lambda w: w["total"],
+                reverse=True,
+            )
+            wall = (self.finished_at or time.perf_counter()) - (self.started_at or 0)
+            return {
+                "wall_time": wall,
+                "worlds": len(self.worlds),
+                "stage_totals": totals,
+                "stage_means": {
+                    name: (total / len(self.worlds) if self.worlds else 0.0)
+                    for name, total in totals.items()
+                },
+                "slowest_worlds": per_world[: self.slowest],
+                "errors": dict(self.errors),
+                "peak_memory_kb": round(self.peak_memory / 1024, 1),
+                "top_allocations": self.top_allocations,
+                "per_world": {w["world_ID"]: w["stages"] for w in per_world},
+            }
+
+    def summary(self):
+        report = self.report()
+        lines = [
+            f"Profil du scan: {report['worlds']} mondes en {report['wall_time']:.1f}s, "
+            f"pic mémoire {report['peak_memory_kb']:.0f} Ko"
+        ]
+        for name, total in report["stage_totals"].items():
+            lines.append(
+                f"  {name:<16} total {total:8.2f}s  moyenne {report['stage_means'][name] * 1000:7.1f}ms"
+            )
+        if report["slowest_worlds"]:
+            slowest = report["slowest_worlds"][0]
+            lines.append(f"  Monde le plus lent: {slowest['world_ID']} ({slowest['total']:.2f}s)")
+        if report["errors"]:
+            lines.append(
+                "  Erreurs: "
+                + ", ".join(f"{name}={count}" for name, count in report["errors"].items())
+            )
+        return "\n".join(lines)
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""
+Scan réparti sur plusieurs processus (ou plusieurs machines partageant le
+fichier SQLite), sans service de file externe.
+
+Le coordinateur remplit la table scan_jobs avec les mondes du passage.
+Chaque worker réserve un petit lot de mondes (bail de LEASE_SECONDS),
+les scanne avec son propre client Kerberos, puis écrit les résultats et
+les checkpoints du lot dans une même transaction. Un monde est terminé
+dès qu'il a un checkpoint ; un bail expiré (worker tué, machine perdue)
+rend le monde de nouveau disponible. Les statistiques de chaque worker
+sont stockées dans scan_workers et additionnées par le coordinateur.
+
+    python scan_workers.py --workers 4 --credentials comptes.json
+    python scan_workers.py --join            # worker supplémentaire (autre machine)
+
+Un worker d'une autre machine n'est accepté que si la DB est en journal
+classique : la mémoire partagée du WAL ne fonctionne pas sur un disque
+réseau (voir migrations.WAL_MODE, python migrations.py --no-wal).
+
+Fichier de comptes : [{"username": "...", "password": "..."}, ...]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import time
+
+from kerberos import KerberosClient
+from log_setup import get_logger, shutdown_logging
+from migrations import is_wal
+from update_db import (
+    CHECKPOINT_FRESHNESS,
+    archive_payload,
+    classify_error,
+    connect_db,
+    finish_scan_run,
+    initialize_database,
+    load_world_hashes,
+    negative_cache_skip,
+    save_world_batch,
+    scan_world,
+    start_scan_run,
+    strip_unchanged,
+)
+from snapshots import publish_snapshot
+
+# --- Configuration ---
+LEASE_SECONDS = 120  # durée d'un bail avant qu'un autre worker puisse reprendre le monde
+CLAIM_SIZE = 10  # mondes réservés à la fois par un worker
+MAX_ATTEMPTS = 3  # au-delà, le monde est abandonné pour ce passage
+IDLE_POLL_SECONDS = 5  # attente quand tous les mondes restants sont réservés par d'autres
+# --- Fin Configuration ---
+
+log = get_logger("scan_workers")
+
+STAT_FIELDS = [
+    "scanned",
+    "empty",
+    "unchanged",
+    "errors",
+    "new_users",
+    "moved",
+    "new_flags",
+    "statements",
+]
+
+
+def load_credentials(path):
+    """Charge la liste des comptes [{"username", "password"}, ...]."""
+    with open(path) as f:
+        credentials = json.load(f)
+    if not isinstance(credentials, list) or not credentials:
+        raise ValueError(f"Fichier de comptes invalide: {path}")
+    return credentials
+
+
+def enqueue_worlds(conn, run_id, world_ids):
+    """Ajoute les mondes du passage à la file de travail."""
+    conn.execute("DELETE FROM scan_jobs WHERE run_id != ?", (run_id,))
+    conn.execute("DELETE FROM scan_workers WHERE run_id != ?", (run_id,))
+    conn.executemany(
+        "INSERT OR IGNORE INTO scan_jobs (run_id, world_ID) VALUES (?, ?)",
+        [(run_id, world_id) for world_id in world_ids],
+    )
+    conn.commit()
+
+
+def claim_worlds(conn, run_id, worker, size=CLAIM_SIZE):
+    """
+    Réserve jusqu'à 'size' mondes non terminés dont le bail est libre ou
+    expiré. BEGIN IMMEDIATE garantit qu'un seul worker réserve à la fois.
+    """
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        world_ids = [
+            row[0]
+            for row in conn.execute(
+                """
+                SELECT j.world_ID FROM scan_jobs j
+                WHERE j.run_id = ? AND j.lease_until < ? AND j.attempts < ?
+                  AND NOT EXISTS (
+                      SELECT 1 FROM scan_checkpoints c
+                      WHERE c.run_id = j.run_id AND c.world_ID = j.world_ID
+                  )
+                LIMIT ?
+                """,
+                (run_id, now, MAX_ATTEMPTS, size),
+            )
+        ]
+        conn.executemany(
+            """
+            UPDATE scan_jobs SET worker = ?, lease_until = ?, attempts = attempts + 1
+            WHERE run_id = ? AND world_ID = ?
+            """,
+            [(worker, now + LEASE_SECONDS, run_id, world_id) for world_id in world_ids],
+        )
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return world_ids
+
+
+def leases_pending(conn, run_id):
+    """Nombre de mondes non terminés encore réservés par un worker actif."""
+    return conn.execute(
+        """
+        SELECT COUNT(*) FROM scan_jobs j
+        WHERE j.run_id = ? AND j.lease_until >= ? AND j.attempts <= ?
+          AND NOT EXISTS (
+              SELECT 1 FROM scan_checkpoints c
+              WHERE c.run_id = j.run_id AND c.world_ID = j.world_ID
+          )
+        """,
+        (run_id, time.time(), MAX_ATTEMPTS),
+    ).fetchone()[0]
+
+
+def release_worlds(conn, run_id, world_ids):
+    """Libère le bail des mondes en erreur pour qu'ils soient retentés."""
+    conn.executemany(
+        "UPDATE scan_jobs SET lease_until = 0 WHERE run_id = ? AND world_ID = ?",
+        [(run_id, world_id) for world_id in world_ids],
+    )
+    conn.commit()
+
+
+def record_worker_stats(conn, run_id, worker, username, stats):
+    conn.execute(
+        f"""
+        INSERT OR REPLACE INTO scan_workers (run_id, worker, username, {", ".join(STAT_FIELDS)}, heartbeat)
+        VALUES (?, ?, ?, {", ".join("?" for _ in STAT_FIELDS)}, ?)
+        """,
+        (run_id, worker, username, *(stats[k] for k in STAT_FIELDS), time.time()),
+    )
+    conn.commit()
+
+
+def run_worker(run_id, credentials=None, protected=False):
+    """Boucle d'un worker : réserve, scanne, écrit, jusqu'à épuisement de la file."""
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    client = KerberosClient(**credentials) if credentials else KerberosClient()
+    conn = connect_db()
+    stats = {k: 0 for k in STAT_FIELDS}
+    known_hashes = load_world_hashes(conn)
+    log.info("Worker %s (%s) démarré sur le passage %s.", worker, client.username, run_id)
+    try:
+        while True:
+            world_ids = claim_worlds(conn, run_id, worker)
+            if not world_ids:
+                if leases_pending(conn, run_id) == 0:
+                    break
+                time.sleep(IDLE_POLL_SECONDS)  # un bail d'un autre worker peut expirer
+                continue
+
+            done, results, failed, failures = [], [], [], {}
+            for world_id in world_ids:
+                try:
+                    result = scan_world(client, world_id, protected)
+                except Exception as e:
+                    log.warning(
+                        "[%s] Erreur processing world %s: %s: %s", worker, world_id, e.__class__.__name__, e
+                    )
+                    stats["errors"] += 1
+                    failures[world_id] = "error"
+                    if classify_error(e) == "transient":
+                        failed.append(world_id)  # bail libéré, un autre essai suivra
+                    else:
+                        done.append(world_id)  # inutile de réessayer dans ce passage
+                    continue
+                done.append(world_id)
+                if result is None:
+                    stats["empty"] += 1
+                    failures[world_id] = "empty"
+                else:
+                    stats["scanned"] += 1
+                    result = strip_unchanged(result, known_hashes)
+                    if result is None:
+                        stats["unchanged"] += 1  # rien à écrire
+                    else:
+                        results.append(result)
+
+            changes = save_world_batch(
+                conn, results, checkpoint=(run_id, done), failures=failures
+            )
+            for key, value in changes.items():
+                stats[key] += value
+            if failed:
+                release_worlds(conn, run_id, failed)
+            record_worker_stats(conn, run_id, worker, client.username, stats)
+        record_worker_stats(conn, run_id, worker, client.username, stats)
+    finally:
+        conn.close()
+    log.info("Worker %s terminé: %s", worker, stats)
+    return stats
+
+
+def worker_process(run_id, credentials=None, protected=False):
+    """Cible des processus lancés par run_sharded_scan."""
+    try:
+        run_worker(run_id, credentials, protected)
+    finally:
+        # Le processus fils sort par os._exit : sans cela, ni atexit ni la
+        # file de journalisation ne sont vidés et ses derniers messages sont perdus
+        shutdown_logging()
+
+
+def merge_worker_stats(conn, run_id):
+    """Additionne les statistiques de tous les workers (toutes machines) du passage."""
+    row = conn.execute(
+        f"SELECT COUNT(*), {', '.join(f'COALESCE(SUM({k}), 0)' for k in STAT_FIELDS)} "
+        "FROM scan_workers WHERE run_id = ?",
+        (run_id,),
+    ).fetchone()
+    return {"workers": row[0], **dict(zip(STAT_FIELDS, row[1:]))}
+
+
+def current_run(conn):
+    """Dernier passage non terminé ayant des mondes en file, ou None."""
+    row = conn.execute(
+        """
+        SELECT r.id FROM scan_runs r
+        WHERE r.finished_at IS NULL
+          AND EXISTS (SELECT 1 FROM scan_jobs j WHERE j.run_id = r.id)
+        ORDER BY r.id DESC LIMIT 1
+        """
+    ).fetchone()
+    return row[0] if row else None
+
+
+def run_sharded_scan(
+    workers=4, credentials_file=None, protected=False, resume_window=CHECKPOINT_FRESHNESS
+):
+    """
+    Coordinateur : prépare la file du passage, lance 'workers' processus
+    et fusionne leurs statistiques. Un passage interrompu récent est repris.
+    """
+    initialize_database()
+    credentials = load_credentials(credentials_file) if credentials_file else [None]
+
+    conn = connect_db()
+    run_id, already_done = start_scan_run(conn, resume_window)
+    has_jobs = conn.execute(
+        "SELECT 1 FROM scan_jobs WHERE run_id = ? LIMIT 1", (run_id,)
+    ).fetchone()
+    if has_jobs:
+        print(f"Reprise du passage {run_id}: {len(already_done)} mondes déjà traités.")
+    else:
+        client = KerberosClient(**credentials[0]) if credentials[0] else KerberosClient()
+        cached = negative_cache_skip(conn)
+        world_list = client.list_worlds()
+        archive_payload(conn, "world_list", world_list)
+        world_ids = [w[0] for w in world_list if w[0] not in cached]
+        enqueue_worlds(conn, run_id, world_ids)
+        print(f"Passage {run_id}: {len(world_ids)} mondes en file pour {workers} workers.")
+    conn.close()
+
+    processes = [
+        multiprocessing.Process(
+            target=worker_process,
+            args=(run_id, credentials[i % len(credentials)], protected),
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    conn = connect_db()
+    stats = merge_worker_stats(conn, run_id)
+    stats["abandoned"] = conn.execute(
+        """
+        SELECT COUNT(*) FROM scan_jobs j
+        WHERE j.run_id = ? AND NOT EXISTS (
+            SELECT 1 FROM scan_checkpoints c
+            WHERE c.run_id = j.run_id AND c.world_ID = j.world_ID
+        )
+        """,
+        (run_id,),
+    ).fetchone()[0]
+    if all(process.exitcode == 0 for process in processes):
+        conn.execute("DELETE FROM scan_jobs WHERE run_id = ?", (run_id,))
+        finish_scan_run(conn, run_id)
+    stats["snapshot"] = publish_snapshot(conn)
+    conn.close()
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scan réparti sur plusieurs processus")
+    parser.add_argument("--workers", type=int, default=4, help="nombre de processus")
+    parser.add_argument("--credentials", help="fichier JSON de comptes, un par worker")
+    parser.add_argument("--protected", action="store_true", help="ne pas stocker les emails")
+    parser.add_argument(
+        "--join",
+        action="store_true",
+        help="rejoindre le passage en cours comme worker supplémentaire (autre machine)",
+    )
+    args = parser.parse_args()
+
+    if args.join:
+        initialize_database()
+        conn = connect_db()
+        run_id = current_run(conn)
+        wal = is_wal(conn)
+        conn.close()
+        if wal:
+            print("DB en WAL: impossible de la partager entre machines (python migrations.py --no-wal).")
+            raise SystemExit(1)
+        if run_id is None:
+            print("Aucun passage en cours à rejoindre.")
+        else:
+            credentials = load_credentials(args.credentials)[0] if args.credentials else None
+            run_worker(run_id, credentials, args.protected)
+    else:
+        stats = run_sharded_scan(args.workers, args.credentials, args.protected)
+        print(f"Passage terminé: {stats}")
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Index de recherche plein texte (FTS5) des utilisateurs, salles et bases
+de flags, tenu à jour par des triggers SQLite à chaque écriture dans
+users, room_keys (salles de l'historique des positions) et
+flag_base_counts (bases de flags, voir aggregates.py) :
+
+    kind   key             label           detail
+    user   username        username        prénom nom filière
+    room   nom de salle    nom de salle
+    flag   base de flag    base de flag
+
+/api/search (backend/api.py) interroge search() : recherche par préfixe,
+résultats classés par bm25. La table et les triggers sont créés par la
+migration 5 (migrations.py).
+
+    python search_index.py dupont      # recherche
+    python search_index.py --rebuild   # reconstruit l'index
+"""
+import argparse
+import json
+import re
+
+# --- Configuration ---
+SEARCH_LIMIT = 10  # résultats par défaut
+SEARCH_MAX_LIMIT = 50
+# --- Fin Configuration ---
+
+SEARCH_KINDS = ("user", "room", "flag")
+
+SEARCH_TABLES = [
+    # kind et key ne sont que restitués ; label et detail sont indexés
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        kind UNINDEXED,
+        key UNINDEXED,
+        label,
+        detail,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+]
+
+
+def _user_detail(row):
+    return (
+        f"trim(COALESCE({row}.first_name, '') || ' ' || COALESCE({row}.last_name, '')"
+        f" || ' ' || COALESCE({row}.filiere, ''))"
+    )
+
+
+# Contenu de l'index, recalculé depuis les tables sources (reconstruction)
+SOURCES = {
+    "user": f"SELECT username, username, {_user_detail('users')} FROM users WHERE username IS NOT NULL",
+    "room": "SELECT name, name, '' FROM room_keys WHERE name IS NOT NULL",
+    "flag": "SELECT flag_base, flag_base, '' FROM flag_base_counts",
+}
+
+
+def _insert(kind, key, detail="''"):
+    return f"""
+        INSERT INTO search_index (kind, key, label, detail)
+        SELECT '{kind}', {key}, {key}, {detail} WHERE {key} IS NOT NULL;
+    """
+
+
+def _delete(kind, key):
+    return f"DELETE FROM search_index WHERE kind = '{kind}' AND key = {key};"
+
+
+SEARCH_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_search_users_insert AFTER INSERT ON users
+    BEGIN {_insert('user', 'NEW.username', _user_detail('NEW'))} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_search_users_delete AFTER DELETE ON users
+    BEGIN {_delete('user', 'OLD.username')} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_search_users_update
+    AFTER UPDATE OF username, first_name, last_name, filiere ON users
+    BEGIN {_delete('user', 'OLD.username')} {_insert('user', 'NEW.username', _user_detail('NEW'))} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_search_rooms_insert AFTER INSERT ON room_keys
+    BEGIN {_insert('room', 'NEW.name')} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_search_flags_insert AFTER INSERT ON flag_base_counts
+    BEGIN {_insert('flag', 'NEW.flag_base')} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_search_flags_delete AFTER DELETE ON flag_base_counts
+    BEGIN {_delete('flag', 'OLD.flag_base')} END
+    """,
+]
+
+
+def rebuild_search_index(conn):
+    """Recalcule tout l'index depuis les tables sources (sans commit)."""
+    conn.execute("DELETE FROM search_index")
+    for kind, query in SOURCES.items():
+        conn.execute(f"INSERT INTO search_index (kind, key, label, detail) SELECT '{kind}', * FROM ({query})")
+    conn.execute("INSERT INTO search_index (search_index) VALUES ('optimize')")
+
+
+def search(conn, text, limit=SEARCH_LIMIT, kinds=None):
+    """
+    Entrées de l'index dont chaque mot de 'text' préfixe un mot du label ou
+    du détail, les plus pertinentes d'abord (le label compte davantage).
+    kinds: sous-ensemble de SEARCH_KINDS, tous par défaut.
+    Retourne [{"kind", "key", "label", "detail"}].
+    """
+    terms = re.findall(r"\w+", text)
+    if not terms:
+        return []
+    match = " ".join(f'"{term}"*' for term in terms)
+    rows = conn.execute(
+        """
+        SELECT kind, key, label, detail FROM search_index
+        WHERE search_index MATCH ?
+          AND kind IN (SELECT value FROM json_each(?))
+        ORDER BY bm25(search_index, 0, 0, 10.0, 1.0), label
+        LIMIT ?
+        """,
+        (match, json.dumps(list(kinds or SEARCH_KINDS)), min(limit, SEARCH_MAX_LIMIT)),
+    ).fetchall()
+    return [dict(zip(("kind", "key", "label", "detail"), row)) for row in rows]
+
+
+if __name__ == "__main__":
+    from update_db import connect_db, initialize_database
+
+    parser = argparse.ArgumentParser(description="Index de recherche (FTS5)")
+    parser.add_argument("text", nargs="?", help="texte à rechercher")
+    parser.add_argument("--rebuild", action="store_true", help="reconstruit entièrement l'index")
+    parser.add_argument("--limit", type=int, default=SEARCH_LIMIT)
+    args = parser.parse_args()
+
+    initialize_database()
+    conn = connect_db()
+    if args.rebuild:
+        rebuild_search_index(conn)
+        conn.commit()
+        print(f"Index reconstruit: {conn.execute('SELECT COUNT(*) FROM search_index').fetchone()[0]} entrées.")
+    if args.text:
+        for result in search(conn, args.text, args.limit):
+            print(f"{result['kind']:5} {result['label']}  {result['detail']}")
+    conn.close()
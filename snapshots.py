@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Copies de lecture de la DB pour l'API.
+
+Après ses écritures, l'écrivain publie une copie cohérente de la DB
+(une seule transaction de lecture) dans SNAPSHOT_DIR, puis remplace
+atomiquement le fichier pointeur CURRENT qui la désigne. L'API ouvre la
+copie courante en lecture seule avec immutable=1 : pas de verrou, pas de
+WAL, ses requêtes n'attendent jamais une écriture (et inversement).
+Chaque copie porte un numéro de génération croissant, utilisable comme
+clé de cache des requêtes.
+
+La copie laisse de côté les archives brutes (SNAPSHOT_EXCLUDED), que
+l'API ne lit jamais et qui font l'essentiel du volume : elle est
+reconstruite table par table plutôt que page par page. Les écrivains
+périodiques (db_writer.py, update_db.py) republient au plus toutes les
+SNAPSHOT_INTERVAL secondes, et seulement si des lignes ont changé depuis
+la copie précédente.
+
+    python snapshots.py              # publie une copie de la DB
+    python snapshots.py --disable    # l'API relit directement la DB
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+# --- Configuration ---
+SNAPSHOT_DIR = os.path.join("db", "snapshots")
+SNAPSHOT_KEEP = 3  # copies conservées (les lectures en cours peuvent finir sur les anciennes)
+SNAPSHOT_INTERVAL = 5  # secondes minimum entre deux publications périodiques
+SNAPSHOT_EXCLUDED = ("raw_payloads", "world_observations")  # archives brutes, jamais lues par l'API
+POINTER_FILE = "CURRENT"
+# --- Fin Configuration ---
+
+
+def publish_snapshot(conn, snapshot_dir=SNAPSHOT_DIR, keep=SNAPSHOT_KEEP):
+    """
+    Copie la DB de 'conn' (hors transaction) dans une nouvelle génération,
+    la désigne comme copie courante et supprime les plus anciennes.
+    Retourne le numéro de génération publié.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    generation = time.time_ns() // 1000  # microsecondes : croissant et unique
+    name = f"game_data.{generation}.db"
+    target_path = os.path.join(snapshot_dir, name)
+    partial_path = f"{target_path}.partial"
+
+    source_path = conn.execute("PRAGMA database_list").fetchone()[2]
+    target = sqlite3.connect(partial_path, isolation_level=None)
+    try:
+        # Copie autonome : journal classique, rien à relire dans un WAL
+        target.execute("PRAGMA journal_mode=DELETE")
+        if source_path:
+            _copy_read_tables(target, source_path)
+        else:
+            conn.backup(target)  # DB en mémoire : rien à attacher
+    finally:
+        target.close()
+    os.replace(partial_path, target_path)
+
+    pointer_path = os.path.join(snapshot_dir, POINTER_FILE)
+    with open(f"{pointer_path}.tmp", "w") as f:
+        json.dump({"generation": generation, "file": name, "published_at": time.time()}, f)
+    os.replace(f"{pointer_path}.tmp", pointer_path)
+
+    snapshots = sorted(
+        (entry for entry in os.listdir(snapshot_dir) if entry.startswith("game_data.") and entry.endswith(".db")),
+        key=lambda entry: int(entry.split(".")[1]),
+    )
+    for old in snapshots[:-keep]:
+        # Une connexion encore ouverte sur le fichier garde ses données jusqu'à sa fermeture
+        os.remove(os.path.join(snapshot_dir, old))
+    return generation
+
+
+def _copy_read_tables(target, source_path):
+    """
+    Recopie dans 'target' (vide) le schéma et les lignes de la DB
+    'source_path', sauf les tables SNAPSHOT_EXCLUDED et leurs index. Une
+    seule transaction de lecture : la copie reste cohérente même si un
+    écrivain reprend entre deux tables.
+    """
+    target.execute("ATTACH DATABASE ? AS source", (source_path,))
+    target.execute("BEGIN")
+    objects = target.execute(
+        "SELECT type, name, tbl_name, sql FROM source.sqlite_master "
+        "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' ORDER BY rowid"
+    ).fetchall()
+    kept = [entry for entry in objects if entry[2] not in SNAPSHOT_EXCLUDED]
+    for kind, name, _, sql in kept:
+        if kind == "table":
+            # Les tables internes d'une table FTS5 existent déjà : créées avec elle
+            exists = target.execute("SELECT 1 FROM main.sqlite_master WHERE name = ?", (name,)).fetchone()
+            if exists:
+                target.execute(f'DELETE FROM main."{name}"')
+            else:
+                target.execute(sql)
+            if not sql.startswith("CREATE VIRTUAL TABLE"):
+                target.execute(f'INSERT INTO main."{name}" SELECT * FROM source."{name}"')
+        elif kind == "view":
+            target.execute(sql)
+    # Index après les lignes (plus rapide) ; triggers inutiles sur une copie figée
+    for kind, _, _, sql in kept:
+        if kind == "index":
+            target.execute(sql)
+    if target.execute("SELECT 1 FROM source.sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+        target.execute("ANALYZE sqlite_schema")  # crée sqlite_stat1 sans rien mesurer
+        target.execute("DELETE FROM main.sqlite_stat1")
+        target.execute(
+            "INSERT INTO main.sqlite_stat1 SELECT * FROM source.sqlite_stat1 WHERE tbl NOT IN (%s)"
+            % ", ".join("?" * len(SNAPSHOT_EXCLUDED)),
+            SNAPSHOT_EXCLUDED,
+        )
+    target.execute("COMMIT")
+    target.execute("DETACH DATABASE source")
+
+
+def current_snapshot(snapshot_dir=SNAPSHOT_DIR):
+    """(génération, chemin) de la copie courante, ou (None, None) si aucune n'est publiée."""
+    try:
+        with open(os.path.join(snapshot_dir, POINTER_FILE)) as f:
+            pointer = json.load(f)
+    except (OSError, ValueError):
+        return None, None
+    path = os.path.join(snapshot_dir, pointer["file"])
+    if not os.path.exists(path):
+        return None, None
+    return pointer["generation"], path
+
+
+def disable_snapshots(snapshot_dir=SNAPSHOT_DIR):
+    """Retire le pointeur : les lecteurs reviennent à la DB elle-même."""
+    try:
+        os.remove(os.path.join(snapshot_dir, POINTER_FILE))
+    except FileNotFoundError:
+        pass
+
+
+if __name__ == "__main__":
+    from update_db import connect_db, initialize_database
+
+    parser = argparse.ArgumentParser(description="Copies de lecture de la DB")
+    parser.add_argument("--disable", action="store_true", help="retire la copie courante")
+    args = parser.parse_args()
+
+    if args.disable:
+        disable_snapshots()
+        print("Copies de lecture désactivées.")
+    else:
+        initialize_database()
+        conn = connect_db()
+        print(f"Copie de lecture publiée: génération {publish_snapshot(conn)}.")
+        conn.close()
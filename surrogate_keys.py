@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Clés entières des tables flags et worlds.
+
+Chaque ligne (et chaque index) de flags et worlds répétait des chaînes
+longues : nom d'utilisateur, world_ID (32 caractères hexadécimaux),
+identifiant et nom de salle, base de flag. Depuis la migration 7, ces
+valeurs sont stockées une seule fois dans des tables dictionnaire et les
+tables de données n'en gardent que l'entier :
+
+    user_keys        id -> username
+    world_keys       id -> world_ID     (partagée avec l'historique des positions)
+    location_keys    id -> location     (identifiant de salle)
+    room_keys        id -> name         (nom de salle, partagée avec l'historique)
+    flag_base_bits   bit -> flag_base   (bit de l'index bitmap, voir flag_bitmaps.py)
+
+    flag_rows    user_id, flag, date, created_at, base_bit, flag_suffix, date_epoch
+    world_rows   world_key, user_id, location_key, room_key, created_at
+
+Les vues flags et worlds gardent les noms et colonnes d'avant : les
+lectures ne changent pas. Leurs triggers INSTEAD OF traduisent les
+écritures. Une vue n'accepte pas d'ON CONFLICT : une insertion dans
+worlds remplace donc la ligne d'un monde déjà connu. users reste une
+table : un nom n'y figure qu'une fois.
+
+Les triggers des agrégats et de l'index bitmap suivent flag_rows et
+world_rows (FLAG_ROW_COLUMNS traduit les clés en valeurs).
+"""
+from aggregates import flag_triggers, world_triggers
+from flag_bitmaps import bitmap_triggers
+
+KEY_TABLES = [
+    "CREATE TABLE IF NOT EXISTS user_keys (id INTEGER PRIMARY KEY, username TEXT UNIQUE NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS location_keys (id INTEGER PRIMARY KEY, location TEXT UNIQUE NOT NULL)",
+    """
+    CREATE TABLE IF NOT EXISTS flag_rows (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        flag TEXT UNIQUE,
+        date TEXT,
+        created_at TEXT,
+        base_bit INTEGER,
+        flag_suffix TEXT,
+        date_epoch INTEGER
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS world_rows (
+        world_key INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        location_key INTEGER,
+        room_key INTEGER,
+        created_at TEXT
+    )
+    """,
+]
+
+KEY_INDEXES = [
+    # Flags d'un utilisateur par date (/api/user/<username>, use_db.user_flags)
+    "CREATE INDEX IF NOT EXISTS idx_flag_rows_user_date ON flag_rows (user_id, date)",
+    # Bases d'un utilisateur (compare_flag_bases, index bitmap)
+    "CREATE INDEX IF NOT EXISTS idx_flag_rows_user_base ON flag_rows (user_id, base_bit)",
+    "CREATE INDEX IF NOT EXISTS idx_flag_rows_date_epoch ON flag_rows (date_epoch)",
+    # Dernière position d'un utilisateur (where_is, /api/user/<username>)
+    """
+    CREATE INDEX IF NOT EXISTS idx_world_rows_user_created
+    ON world_rows (user_id, created_at, world_key, location_key, room_key)
+    """,
+]
+
+KEY_VIEWS = [
+    """
+    CREATE VIEW IF NOT EXISTS flags AS
+    SELECT u.username AS username, f.flag AS flag, f.date AS date, f.created_at AS created_at,
+           b.flag_base AS flag_base, f.flag_suffix AS flag_suffix, f.date_epoch AS date_epoch
+    FROM flag_rows f
+    LEFT JOIN user_keys u ON u.id = f.user_id
+    LEFT JOIN flag_base_bits b ON b.bit = f.base_bit
+    """,
+    """
+    CREATE VIEW IF NOT EXISTS worlds AS
+    SELECT u.username AS username, k.world_ID AS world_ID, l.location AS location,
+           r.name AS room, w.created_at AS created_at
+    FROM world_rows w
+    JOIN world_keys k ON k.id = w.world_key
+    LEFT JOIN user_keys u ON u.id = w.user_id
+    LEFT JOIN location_keys l ON l.id = w.location_key
+    LEFT JOIN room_keys r ON r.id = w.room_key
+    """,
+]
+
+
+def _intern(table, column, value):
+    """Ajoute 'value' au dictionnaire 'table' s'il n'y est pas."""
+    return f"INSERT OR IGNORE INTO {table} ({column}) SELECT {value} WHERE {value} IS NOT NULL;"
+
+
+def _key(table, column, value, key="id"):
+    """Clé entière de 'value' dans le dictionnaire 'table'."""
+    return f"(SELECT {key} FROM {table} WHERE {column} = {value})"
+
+
+def _intern_flag(row):
+    return f"""
+        {_intern("user_keys", "username", f"{row}.username")}
+        {_intern("flag_base_bits", "flag_base", f"{row}.flag_base")}
+    """
+
+
+def _flag_values(row):
+    return f"""
+        {_key("user_keys", "username", f"{row}.username")}, {row}.flag, {row}.date, {row}.created_at,
+        {_key("flag_base_bits", "flag_base", f"{row}.flag_base", key="bit")}, {row}.flag_suffix, {row}.date_epoch
+    """
+
+
+def _intern_world(row):
+    return f"""
+        SELECT RAISE(ABORT, 'worlds: world_ID requis') WHERE {row}.world_ID IS NULL;
+        {_intern("user_keys", "username", f"{row}.username")}
+        {_intern("world_keys", "world_ID", f"{row}.world_ID")}
+        {_intern("location_keys", "location", f"{row}.location")}
+        {_intern("room_keys", "name", f"{row}.room")}
+    """
+
+
+def _world_key(row):
+    return _key("world_keys", "world_ID", f"{row}.world_ID")
+
+
+def _world_values(row):
+    return f"""
+        {_world_key(row)}, {_key("user_keys", "username", f"{row}.username")},
+        {_key("location_keys", "location", f"{row}.location")}, {_key("room_keys", "name", f"{row}.room")},
+        {row}.created_at
+    """
+
+
+VIEW_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_flags_view_insert INSTEAD OF INSERT ON flags
+    BEGIN
+        {_intern_flag("NEW")}
+        INSERT INTO flag_rows (user_id, flag, date, created_at, base_bit, flag_suffix, date_epoch)
+        VALUES ({_flag_values("NEW")});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_flags_view_update INSTEAD OF UPDATE ON flags
+    BEGIN
+        {_intern_flag("NEW")}
+        UPDATE flag_rows SET (user_id, flag, date, created_at, base_bit, flag_suffix, date_epoch)
+            = ({_flag_values("NEW")})
+        WHERE flag = OLD.flag;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_flags_view_delete INSTEAD OF DELETE ON flags
+    BEGIN DELETE FROM flag_rows WHERE flag = OLD.flag; END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_worlds_view_insert INSTEAD OF INSERT ON worlds
+    BEGIN
+        {_intern_world("NEW")}
+        INSERT INTO world_rows (world_key, user_id, location_key, room_key, created_at)
+        SELECT {_world_values("NEW")} WHERE true
+        ON CONFLICT (world_key) DO UPDATE SET
+            user_id = excluded.user_id, location_key = excluded.location_key,
+            room_key = excluded.room_key, created_at = excluded.created_at;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_worlds_view_update INSTEAD OF UPDATE ON worlds
+    BEGIN
+        {_intern_world("NEW")}
+        UPDATE world_rows SET (world_key, user_id, location_key, room_key, created_at)
+            = ({_world_values("NEW")})
+        WHERE world_key = {_world_key("OLD")};
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_worlds_view_delete INSTEAD OF DELETE ON worlds
+    BEGIN DELETE FROM world_rows WHERE world_key = {_world_key("OLD")}; END
+    """,
+]
+
+# Colonnes d'un flag de flag_rows pour les triggers des agrégats et de l'index bitmap
+FLAG_ROW_COLUMNS = {
+    "username": _key("user_keys", "id", "{row}.user_id", key="username"),
+    "flag_base": _key("flag_base_bits", "bit", "{row}.base_bit", key="flag_base"),
+    "flag_suffix": "{row}.flag_suffix",
+}
+ROW_WATCHED = "user_id, base_bit, flag_suffix"
+
+ROW_TRIGGERS = [
+    *flag_triggers("flag_rows", FLAG_ROW_COLUMNS, ROW_WATCHED),
+    *bitmap_triggers("flag_rows", FLAG_ROW_COLUMNS, ROW_WATCHED),
+    *world_triggers("world_rows"),
+]
+
+
+def convert_to_surrogate_keys(conn):
+    """
+    Migration 7 (dans sa transaction) : remplit les dictionnaires, copie
+    flags et worlds dans flag_rows et world_rows, puis remplace les tables
+    par les vues. Leurs index et triggers disparaissent avec elles ; ceux
+    des tables de clés les remplacent. Les agrégats restent valables : les
+    lignes sont copiées avant la création des triggers.
+    """
+    for ddl in KEY_TABLES:
+        conn.execute(ddl)
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO user_keys (username)
+        SELECT username FROM users WHERE username IS NOT NULL
+        UNION SELECT username FROM flags WHERE username IS NOT NULL
+        UNION SELECT username FROM worlds WHERE username IS NOT NULL
+        """
+    )
+    conn.execute("INSERT OR IGNORE INTO world_keys (world_ID) SELECT world_ID FROM worlds WHERE world_ID IS NOT NULL")
+    conn.execute(
+        "INSERT OR IGNORE INTO location_keys (location) SELECT DISTINCT location FROM worlds WHERE location IS NOT NULL"
+    )
+    conn.execute("INSERT OR IGNORE INTO room_keys (name) SELECT DISTINCT room FROM worlds WHERE room IS NOT NULL")
+    conn.execute(
+        "INSERT OR IGNORE INTO flag_base_bits (flag_base) SELECT DISTINCT flag_base FROM flags WHERE flag_base IS NOT NULL"
+    )
+
+    # Les flags d'un même utilisateur sont copiés côte à côte : moins de pages par lecture
+    conn.execute(
+        """
+        INSERT INTO flag_rows (user_id, flag, date, created_at, base_bit, flag_suffix, date_epoch)
+        SELECT u.id, f.flag, f.date, f.created_at, b.bit, f.flag_suffix, f.date_epoch
+        FROM flags f
+        LEFT JOIN user_keys u ON u.username = f.username
+        LEFT JOIN flag_base_bits b ON b.flag_base = f.flag_base
+        ORDER BY u.id, f.date
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO world_rows (world_key, user_id, location_key, room_key, created_at)
+        SELECT k.id, u.id, l.id, r.id, w.created_at
+        FROM worlds w
+        JOIN world_keys k ON k.world_ID = w.world_ID
+        LEFT JOIN user_keys u ON u.username = w.username
+        LEFT JOIN location_keys l ON l.location = w.location
+        LEFT JOIN room_keys r ON r.name = w.room
+        """
+    )
+
+    conn.execute("DROP TABLE flags")
+    conn.execute("DROP TABLE worlds")
+    for ddl in [*KEY_INDEXES, *KEY_VIEWS, *VIEW_TRIGGERS, *ROW_TRIGGERS]:
+        conn.execute(ddl)
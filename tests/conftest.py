@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures communes : une DB temporaire au schéma à jour, sans appel API.
+
+    python -m pytest -q        # depuis la racine du dépôt
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import migrate  # noqa: E402
+from update_db import connect_db, create_tables, parse_world_payload  # noqa: E402
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    """Connexion d'écriture sur une DB neuve ; les chemins relatifs (db/archive...) restent dans tmp_path."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("db")
+    conn = connect_db(os.path.join("db", "game_data.db"))
+    create_tables(conn)
+    migrate(conn)
+    yield conn
+    conn.close()
+
+
+def world_result(world_id, username, room="Hall", first_name="Prénom", flags=()):
+    """Résultat de scan_world pour un monde, construit comme à partir des réponses de l'API."""
+    data = {
+        "first_name": first_name,
+        "last_name": "Nom",
+        "email": f"{username}@example.org",
+        "profile": 1,
+        "filiere": "SFPN",
+        "blocked": 0,
+        "flags": [[flag, username, date] for flag, date in flags],
+    }
+    return parse_world_payload(world_id, username, room.lower(), room, data)
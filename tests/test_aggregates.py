@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Agrégats (aggregates.py) tenus à jour par les triggers à travers les vues flags et worlds (surrogate_keys.py)."""
+from aggregates import check_aggregates
+
+
+def _total(conn, name):
+    return conn.execute("SELECT value FROM db_totals WHERE name = ?", (name,)).fetchone()[0]
+
+
+def test_flags_view_insert_update_delete(conn):
+    conn.execute("INSERT INTO users (username, filiere) VALUES ('alice', 'SFPN'), ('bob', 'STL')")
+    conn.executemany(
+        "INSERT INTO flags (username, flag, date, flag_base, flag_suffix) VALUES (?, ?, '2025-03-01T10:00:00Z', ?, ?)",
+        [("alice", "A:1", "A", "1"), ("alice", "B:1", "B", "1"), ("bob", "A:2", "A", "2"), ("bob", "SOLO", "SOLO", None)],
+    )
+    assert check_aggregates(conn) == {}
+
+    conn.execute("UPDATE flags SET username = 'bob' WHERE flag = 'B:1'")
+    conn.execute("UPDATE flags SET flag_base = 'C', flag_suffix = '9' WHERE flag = 'A:2'")
+    assert check_aggregates(conn) == {}
+
+    conn.execute("DELETE FROM flags WHERE flag IN ('A:1', 'SOLO')")
+    assert check_aggregates(conn) == {}
+    assert conn.execute("SELECT COUNT(*) FROM flags").fetchone() == (2,)
+
+    conn.execute("DELETE FROM users WHERE username = 'alice'")
+    assert check_aggregates(conn) == {}
+
+
+def test_worlds_view_insert_update_delete(conn):
+    conn.execute("INSERT INTO users (username, filiere) VALUES ('alice', 'SFPN')")
+    conn.execute(
+        "INSERT INTO worlds (username, world_ID, location, room, created_at) VALUES ('alice', 'w1', 'l1', 'Hall', '2025-03-01')"
+    )
+    conn.execute(
+        "INSERT INTO worlds (username, world_ID, location, room, created_at) VALUES ('bob', 'w2', 'l2', 'Cave', '2025-03-01')"
+    )
+    assert check_aggregates(conn) == {}
+
+    # Une insertion d'un monde connu remplace sa ligne (upsert du trigger de la vue)
+    conn.execute(
+        "INSERT INTO worlds (username, world_ID, location, room, created_at) VALUES ('bob', 'w1', 'l3', 'Salle', '2025-03-02')"
+    )
+    conn.execute("UPDATE worlds SET location = 'l4', room = 'Grenier' WHERE world_ID = 'w2'")
+    assert check_aggregates(conn) == {}
+    assert conn.execute("SELECT username, room FROM worlds WHERE world_ID = 'w1'").fetchone() == ("bob", "Salle")
+
+    conn.execute("DELETE FROM worlds WHERE world_ID = 'w1'")
+    assert check_aggregates(conn) == {}
+    assert _total(conn, "worlds") == 1
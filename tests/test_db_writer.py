@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""Écrivain unique (db_writer.py) : chaque opération soumise reçoit un résultat ou une erreur."""
+import sqlite3
+
+import pytest
+
+import migrations
+from db_writer import DatabaseWriter
+
+
+def test_locked_database_fails_the_whole_batch(conn, monkeypatch):
+    monkeypatch.setattr(migrations, "BUSY_TIMEOUT_MS", 50)  # "database is locked" sans attendre 30 s
+    writer = DatabaseWriter(path="db/game_data.db", batch_seconds=0.05)
+    writer.start()
+    try:
+        conn.execute("BEGIN IMMEDIATE")  # un autre processus détient le verrou d'écriture
+        futures = [
+            writer.submit(lambda c, name: c.execute("INSERT INTO users (username) VALUES (?)", (name,)), name)
+            for name in ("alice", "bob")
+        ]
+        for future in futures:
+            with pytest.raises(sqlite3.OperationalError):
+                future.result(timeout=5)
+        conn.rollback()
+
+        # Verrou libéré : l'écrivain reprend normalement
+        writer.submit(lambda c: c.execute("INSERT INTO users (username) VALUES ('carol')")).result(timeout=5)
+    finally:
+        writer.stop()
+    assert conn.execute("SELECT username FROM users").fetchall() == [("carol",)]
+    assert writer.stats["errors"] == 2
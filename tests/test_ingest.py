@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Écritures du scan : lots inchangés (save_world_batch) et rejeu de l'archive (reingest_from_archive)."""
+from aggregates import check_aggregates
+from conftest import world_result
+from update_db import load_world_hashes, reingest_from_archive, save_world_batch, strip_unchanged
+
+
+def _count(conn, table):
+    return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_unchanged_batch_runs_no_statement(conn):
+    save_world_batch(conn, [world_result("w1", "alice", flags=[("FLAG1:a", "2025-03-01T10:00:00Z")])])
+    assert strip_unchanged(world_result("w1", "alice", flags=[("FLAG1:a", "2025-03-01T10:00:00Z")]), load_world_hashes(conn)) is None
+
+    executed = []
+    conn.set_trace_callback(executed.append)
+    changes = save_world_batch(conn, [])
+    conn.set_trace_callback(None)
+    assert executed == []
+    assert changes == {"new_users": 0, "moved": 0, "new_flags": 0, "statements": 0}
+
+
+def test_unchanged_batch_writes_only_its_checkpoint(conn):
+    save_world_batch(conn, [world_result("w1", "alice")])
+    before = conn.total_changes
+    changes = save_world_batch(conn, [], checkpoint=(1, ["w1"]))
+    assert changes["statements"] == 1
+    assert conn.total_changes - before == 1
+    assert _count(conn, "scan_checkpoints") == 1
+
+
+def test_reingest_keeps_rows_outside_the_archive(conn):
+    save_world_batch(
+        conn,
+        [
+            world_result("w1", "alice", first_name="Alice", flags=[("FLAG1:a", "2025-03-01T10:00:00Z")]),
+            world_result("w2", "bob", room="Cave"),
+        ],
+    )
+    # Lignes antérieures à l'archive : aucune observation ne les couvre
+    conn.execute("INSERT INTO users (username, first_name) VALUES ('legacy', 'Ancien')")
+    conn.execute("INSERT INTO flags (username, flag, date) VALUES ('legacy', 'LEG:1', '2020-01-01T00:00:00Z')")
+    conn.execute(
+        "INSERT INTO worlds (username, world_ID, location, room, created_at) "
+        "VALUES ('legacy', 'wleg', 'old', 'Old', '2020-01-01T00:00:00')"
+    )
+    # Valeur modifiée depuis l'observation, position plus récente que l'observation
+    conn.execute("UPDATE users SET first_name = 'Modifié' WHERE username = 'alice'")
+    conn.execute("UPDATE worlds SET location = 'later', created_at = '2999-01-01T00:00:00' WHERE world_ID = 'w2'")
+    conn.commit()
+    counts = {table: _count(conn, table) for table in ("users", "flags", "worlds")}
+
+    stats = reingest_from_archive(conn)
+
+    assert stats["observations"] == 2
+    assert {table: _count(conn, table) for table in ("users", "flags", "worlds")} == counts
+    assert conn.execute("SELECT first_name FROM users WHERE username = 'legacy'").fetchone() == ("Ancien",)
+    assert conn.execute("SELECT username FROM flags WHERE flag = 'LEG:1'").fetchone() == ("legacy",)
+    assert conn.execute("SELECT location FROM worlds WHERE world_ID = 'wleg'").fetchone() == ("old",)
+    assert conn.execute("SELECT first_name FROM users WHERE username = 'alice'").fetchone() == ("Alice",)
+    assert conn.execute("SELECT location FROM worlds WHERE world_ID = 'w2'").fetchone() == ("later",)
+    assert check_aggregates(conn) == {}
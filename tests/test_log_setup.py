@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+"""Journalisation partagée (log_setup.py) : aucun message supprimé n'est passé sous silence."""
+import log_setup
+
+
+def test_shutdown_reports_every_suppressed_message(capsys):
+    log_setup.setup_logging(force=True)  # écrit sur le stderr capturé
+    log = log_setup.get_logger("test")
+    for template in ("Erreur A %s", "Erreur B %s"):
+        for i in range(3):
+            log.warning(template, i)
+    log_setup.shutdown_logging()
+
+    err = capsys.readouterr().err
+    assert err.count("Erreur A") == 2 and err.count("Erreur B") == 2
+    assert "2 messages similaires supprimés: Erreur A %s" in err
+    assert "2 messages similaires supprimés: Erreur B %s" in err
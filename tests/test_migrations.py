@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""Migrations (migrations.py) : schéma complet et index des requêtes clés."""
+from migrations import MIGRATIONS, QUERY_PLAN_CHECKS, check_query_plans, current_version
+
+
+def test_all_migrations_applied(conn):
+    assert current_version(conn) == max(version for version, _, _ in MIGRATIONS)
+
+
+def test_hot_queries_use_their_index(conn):
+    # Un index supprimé ou une requête réécrite sans index fait échouer ce test
+    assert QUERY_PLAN_CHECKS
+    assert check_query_plans(conn) == []
+
+
+def test_dropped_index_is_detected(conn):
+    conn.execute("DROP INDEX idx_probe_cache_next")
+    assert [failure["query"] for failure in check_query_plans(conn)] == ["mondes du cache négatif"]
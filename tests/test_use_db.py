@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""Sorties de use_db identiques à celles d'avant la couche d'accès partagée (db_access.py)."""
+import pytest
+
+import use_db
+from db_access import ConnectionPool
+
+
+@pytest.fixture
+def pool(conn, monkeypatch):
+    conn.executemany(
+        "INSERT INTO flags (username, flag, date) VALUES ('alice', ?, ?)",
+        [
+            ("F:1", "2025-03-01T10:00:00+01:00"),
+            ("F:2", "2025-03-02T10:00:00Z"),
+            ("F:3", "2025-03-03T10:00:00"),
+            ("F:4", "pas une date"),
+            ("F:5", None),
+        ],
+    )
+    conn.commit()
+    pool = ConnectionPool("db/game_data.db", readonly=True)
+    monkeypatch.setattr(use_db, "pool", pool)
+    return pool
+
+
+def test_user_flags_dates_in_their_own_offset(pool):
+    # Même format que la version d'origine : fromisoformat de la date du jeu, sans conversion en UTC
+    assert sorted(use_db.user_flags("alice", date=True), key=lambda entry: entry[0]) == [
+        ("F:1", "01/03/2025 10:00"),
+        ("F:2", "02/03/2025 10:00"),
+        ("F:3", "03/03/2025 10:00"),
+        ("F:4", "pas une date"),
+        ("F:5", None),
+    ]
+
+
+def test_user_flags_without_dates(pool):
+    assert sorted(use_db.user_flags("alice")) == ["F:1", "F:2", "F:3", "F:4", "F:5"]
+    assert use_db.user_flags("personne") == []
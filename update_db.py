@@ -1,24 +1,74 @@
 # -*- coding: utf-8 -*-
 from kerberos import *
 import sqlite3
+import argparse
 import datetime
+import hashlib
+import itertools
+import json
 import os  # Import os pour créer le répertoire db si besoin
+import queue
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import time
 import tqdm
+from scan_profile import ScanProfiler, stage
+from log_setup import get_logger
+from db_access import DATABASE_FILE, DB_DIR, open_connection
+from migrations import flag_columns_sql, migrate
+from snapshots import SNAPSHOT_INTERVAL, publish_snapshot
+from flag_bitmaps import refresh_flag_bitmaps
+from user_documents import refresh_user_documents
+from partitions import ARCHIVE_DIR, attached_history, iter_archived_observations, run_maintenance
 
 # --- Configuration ---
-DB_DIR = "db"
-DATABASE_FILE = os.path.join(
-    DB_DIR, "game_data.db"
-)  # Chemin vers le fichier de DB unique
+# Chemin de la DB : DATABASE_FILE (db_access.py)
+SCAN_QUEUE_SIZE = 64  # résultats de scan en attente d'écriture (backpressure)
+WRITE_BATCH_SIZE = 50  # mondes par transaction
+WRITE_BATCH_SECONDS = 2.0  # délai max avant d'écrire un lot incomplet
+# Un passage interrompu depuis moins longtemps que ça est repris là où il s'est arrêté
+CHECKPOINT_FRESHNESS = float(os.getenv("SCAN_RESUME_WINDOW", str(15 * 60)))  # secondes
+# Cache négatif : délai avant de re-sonder un monde vide/en erreur, doublé à chaque échec
+NEGATIVE_CACHE_BASE = 5 * 60  # secondes
+NEGATIVE_CACHE_MAX = 12 * 3600  # secondes
+# File de reprise des mondes en erreur transitoire, traitée en fin de passage
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF = 2.0  # secondes entre les deux premiers essais d'une reprise, doublé ensuite
+RETRY_CONCURRENCY = 2  # appels simultanés réservés aux reprises
+ARCHIVE_COMPRESSION = 6  # niveau zlib des réponses brutes archivées
+# Historique des positions : transitions gardées telles quelles pendant ce délai,
+# puis résumées en occupation horaire (voir compact_positions)
+POSITION_RETENTION_DAYS = 30
 # --- Fin Configuration ---
 
+log = get_logger("update_db")
+
+# flag_base, flag_suffix et date_epoch calculés par SQLite à l'insertion
+FLAG_BASE_SQL, FLAG_SUFFIX_SQL, DATE_EPOCH_SQL = flag_columns_sql(":flag", ":date")
+
 
 def initialize_database():
     """Crée le fichier de base de données unique et les tables si elles n'existent pas."""
     # Crée le répertoire 'db' s'il n'existe pas
     os.makedirs(DB_DIR, exist_ok=True)
 
-    conn = sqlite3.connect(DATABASE_FILE)
+    conn = connect_db()
+    create_tables(conn)
+    migrate(conn)
+    conn.close()
+    print(
+        f"Base de données '{DATABASE_FILE}' initialisée avec les tables users, worlds, flags."
+    )
+
+
+def connect_db(path=DATABASE_FILE, timeout=30):
+    """Connexion d'écriture avec les réglages du projet (voir db_access.open_connection)."""
+    return open_connection(path, timeout=timeout)
+
+
+def create_tables(conn):
+    """Crée les tables manquantes sur une connexion ouverte (utilisé aussi par l'API)."""
     cursor = conn.cursor()
 
     # Table users
@@ -37,7 +87,8 @@ def initialize_database():
     """
     )
 
-    # Table worlds
+    # Table worlds (vue sur world_rows depuis la migration 7, voir surrogate_keys.py :
+    # CREATE TABLE IF NOT EXISTS ne fait alors rien)
     cursor.execute(
         """
     CREATE TABLE IF NOT EXISTS worlds (
@@ -53,7 +104,7 @@ def initialize_database():
     """
     )
 
-    # Table flags
+    # Table flags (vue sur flag_rows depuis la migration 7)
     cursor.execute(
         """
     CREATE TABLE IF NOT EXISTS flags (
@@ -68,15 +119,121 @@ def initialize_database():
     """
     )
 
-    conn.commit()
-    conn.close()
-    print(
-        f"Base de données '{DATABASE_FILE}' initialisée avec les tables users, worlds, flags."
+    # Passages de scan et mondes déjà traités (reprise après interruption)
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS scan_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        started_at REAL,
+        finished_at REAL
+    )
+    """
+    )
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS scan_checkpoints (
+        run_id INTEGER,
+        world_ID TEXT,
+        completed_at REAL,
+        PRIMARY KEY (run_id, world_ID)
+    )
+    """
+    )
+
+    # File de travail partagée entre processus de scan (voir scan_workers.py)
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS scan_jobs (
+        run_id INTEGER,
+        world_ID TEXT,
+        worker TEXT,
+        lease_until REAL DEFAULT 0,
+        attempts INTEGER DEFAULT 0,
+        PRIMARY KEY (run_id, world_ID)
+    )
+    """
+    )
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS scan_workers (
+        run_id INTEGER,
+        worker TEXT,
+        username TEXT,
+        scanned INTEGER DEFAULT 0,
+        empty INTEGER DEFAULT 0,
+        unchanged INTEGER DEFAULT 0,
+        errors INTEGER DEFAULT 0,
+        new_users INTEGER DEFAULT 0,
+        moved INTEGER DEFAULT 0,
+        new_flags INTEGER DEFAULT 0,
+        statements INTEGER DEFAULT 0,
+        heartbeat REAL,
+        PRIMARY KEY (run_id, worker)
+    )
+    """
+    )
+
+    # Empreintes du dernier contenu vu par monde : un monde inchangé ne coûte aucune écriture
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS world_hashes (
+        world_ID TEXT PRIMARY KEY,
+        payload_hash TEXT,
+        position_hash TEXT,
+        updated_at REAL
+    )
+    """
     )
 
+    # Archive des réponses brutes (data_collection, world.list), compressées
+    # et stockées une seule fois par contenu (clé = sha256 du JSON canonique)
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS raw_payloads (
+        hash TEXT PRIMARY KEY,
+        kind TEXT,
+        data BLOB,
+        raw_size INTEGER,
+        first_seen REAL,
+        last_seen REAL
+    )
+    """
+    )
+
+    # Chaque contenu écrit pour un monde, avec les réponses hors data_collection
+    # (username, position) : de quoi rejouer le parsing sans appel API
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS world_observations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        world_ID TEXT,
+        username TEXT,
+        location TEXT,
+        room TEXT,
+        payload_hash TEXT,
+        seen_at REAL
+    )
+    """
+    )
+
+    # Cache négatif : mondes sans protagoniste ou en erreur, re-sondés de plus en plus rarement
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS world_probe_cache (
+        world_ID TEXT PRIMARY KEY,
+        status TEXT,
+        failures INTEGER,
+        last_probe REAL,
+        next_probe REAL
+    )
+    """
+    )
+
+    conn.commit()
+
 
 def add_user(user_data):
-    conn = sqlite3.connect(DATABASE_FILE)  # Utilise la DB unique
+    conn = connect_db()  # Utilise la DB unique
     cursor = conn.cursor()
     username = user_data.get("username")
     if username:
@@ -100,28 +257,27 @@ def add_user(user_data):
                         created_at,
                     ),
                 )
+                refresh_user_documents(conn)
                 conn.commit()
-                print(f"Utilisateur '{username}' ajouté à la table 'users'.")
+                log.debug("Utilisateur '%s' ajouté à la table 'users'.", username)
             except sqlite3.Error as e:
-                print(
-                    f"Erreur SQLite lors de l'ajout de l'utilisateur '{username}': {e}"
-                )
+                log.warning("Erreur SQLite lors de l'ajout de l'utilisateur '%s': %s", username, e)
                 conn.rollback()
         # else:
         #     print(f"Utilisateur '{username}' existe déjà dans la table 'users'.")
     else:
-        print("Le champ 'username' est obligatoire pour ajouter un utilisateur.")
+        log.warning("Le champ 'username' est obligatoire pour ajouter un utilisateur.")
     conn.close()
 
 
 def add_world(world_data):
-    conn = sqlite3.connect(DATABASE_FILE)  # Utilise la DB unique
+    conn = connect_db()  # Utilise la DB unique
     cursor = conn.cursor()
     username = world_data.get("username")
     world_id = world_data.get("world_ID")
 
     if not (username and world_id):
-        print(
+        log.warning(
             "Les champs 'username' et 'world_ID' sont requis pour ajouter/modifier une entrée dans la table 'worlds'."
         )
         conn.close()
@@ -161,9 +317,12 @@ def add_world(world_data):
                     + " WHERE username = ? AND world_ID = ?"
                 )
                 cursor.execute(update_query, tuple(update_values))
+                refresh_user_documents(conn)
                 conn.commit()
-                print(
-                    f"Entrée pour '{username}' dans le monde '{world_id}' mise à jour dans la table 'worlds'."
+                log.debug(
+                    "Entrée pour '%s' dans le monde '%s' mise à jour dans la table 'worlds'.",
+                    username,
+                    world_id,
                 )
             # else:
             #     print(f"Entrée pour '{username}'/'{world_id}' déjà à jour dans 'worlds'.")
@@ -176,13 +335,14 @@ def add_world(world_data):
                 """,
                 (username, world_id, new_location, new_room, created_at),
             )
+            refresh_user_documents(conn)
             conn.commit()
-            print(
-                f"Entrée pour '{username}' dans le monde '{world_id}' ajoutée à la table 'worlds'."
+            log.debug(
+                "Entrée pour '%s' dans le monde '%s' ajoutée à la table 'worlds'.", username, world_id
             )
 
     except sqlite3.Error as e:
-        print(f"Erreur SQLite (worlds): {e}")
+        log.warning("Erreur SQLite (worlds): %s", e)
         conn.rollback()
 
     finally:
@@ -190,7 +350,7 @@ def add_world(world_data):
 
 
 def add_flag(flag_data):
-    conn = sqlite3.connect(DATABASE_FILE)  # Utilise la DB unique
+    conn = connect_db()  # Utilise la DB unique
     cursor = conn.cursor()
     username = flag_data.get("username")
     flag = flag_data.get("flag")
@@ -202,167 +362,1132 @@ def add_flag(flag_data):
             created_at = datetime.datetime.now().isoformat()
             try:
                 cursor.execute(
-                    """
-                INSERT INTO flags (username, flag, date, created_at)
-                VALUES (?, ?, ?, ?)
+                    f"""
+                INSERT INTO flags (username, flag, date, created_at, flag_base, flag_suffix, date_epoch)
+                VALUES (:username, :flag, :date, :created_at, {FLAG_BASE_SQL}, {FLAG_SUFFIX_SQL}, {DATE_EPOCH_SQL})
                 """,
-                    (
-                        username,
-                        flag,
-                        flag_data.get("date"),
-                        created_at,
-                    ),
+                    {
+                        "username": username,
+                        "flag": flag,
+                        "date": flag_data.get("date"),
+                        "created_at": created_at,
+                    },
                 )
+                refresh_flag_bitmaps(conn)
+                refresh_user_documents(conn)
                 conn.commit()
-                print(
-                    f"Flag '{flag}' pour l'utilisateur '{username}' ajouté à la table 'flags'."
-                )
+                log.debug("Flag '%s' pour l'utilisateur '%s' ajouté à la table 'flags'.", flag, username)
             except sqlite3.Error as e:
-                print(
-                    f"Erreur SQLite lors de l'ajout du flag '{flag}' pour '{username}': {e}"
-                )
+                log.warning("Erreur SQLite lors de l'ajout du flag '%s' pour '%s': %s", flag, username, e)
                 conn.rollback()
         # else:
         #     print(f"Flag '{flag}' pour '{username}' existe déjà dans la table 'flags'.")
     else:
-        print("Les champs 'username' et 'flag' sont obligatoires pour ajouter un flag.")
+        log.warning("Les champs 'username' et 'flag' sont obligatoires pour ajouter un flag.")
     conn.close()
 
 
-def scan_active_users(client: KerberosClient, protected=False):
-    world_list = client.list_worlds()
-    flags_db_lines = []
-    user_db_lines = []
-    world_db_lines = []
+def negative_cache_skip(conn, now=None):
+    """
+    Retourne {world_ID: next_probe} des mondes à ne pas re-sonder avant
+    'next_probe' (vides ou en erreur lors des derniers passages).
+    """
+    now = time.time() if now is None else now
+    return dict(
+        conn.execute(
+            "SELECT world_ID, next_probe FROM world_probe_cache WHERE next_probe > ?",
+            (now,),
+        ).fetchall()
+    )
 
-    # print(f"Scan de {len(world_list)} mondes...")
-    count = 0
-    for w in tqdm.tqdm(world_list):
-        count += 1
-        w_ID = w[0]
-        # print(f"Traitement monde {count}/{len(world_list)} : {w_ID}")
-        user = None  # Initialiser pour le bloc except
-        try:
-            user = client.user_from_world(w_ID)
-            if not user:
-                # print(f"  -> Aucun utilisateur trouvé pour {w_ID}, skip.")
-                continue
-            # print(f"  -> Utilisateur trouvé: {user}")
 
-            location = client.location(w_ID)
-            room = client.room_name(w_ID, location)
-            # print(f"  -> Location: {location}, Room: {room}")
+def record_probe_failures(conn, failures, commit=True):
+    """
+    Enregistre des mondes vides ou en erreur ({world_ID: "empty" | "error"}).
+    Le délai avant le prochain essai double à chaque échec consécutif.
+    """
+    now = time.time()
+    conn.executemany(
+        """
+        INSERT INTO world_probe_cache (world_ID, status, failures, last_probe, next_probe)
+        VALUES (?, ?, 1, ?, ?)
+        ON CONFLICT(world_ID) DO UPDATE SET
+            status = excluded.status,
+            failures = failures + 1,
+            last_probe = excluded.last_probe,
+            next_probe = excluded.last_probe + MIN(? * (1 << failures), ?)
+        """,
+        [
+            (world_id, status, now, now + NEGATIVE_CACHE_BASE, NEGATIVE_CACHE_BASE, NEGATIVE_CACHE_MAX)
+            for world_id, status in failures.items()
+        ],
+    )
+    if commit:
+        conn.commit()
 
-            data = client.data_collection(w_ID)
 
-            if not isinstance(data, dict):
-                # print(
-                #     f"  -> ATTENTION: data_collection pour {w_ID} n'a pas retourné un dictionnaire (type: {type(data)}). Skip détails user/flags."
-                # )
-                world_db_lines.append(
-                    {
-                        "username": user,
-                        "world_ID": w_ID,
-                        "location": location,
-                        "room": room,
-                    }
-                )
+def clear_probe_failures(conn, world_ids, commit=True):
+    """Retire du cache négatif les mondes qui ont de nouveau répondu."""
+    world_ids = list(world_ids)
+    if world_ids:
+        # Une seule requête quel que soit le nombre de mondes (pas de limite de paramètres)
+        conn.execute(
+            "DELETE FROM world_probe_cache WHERE world_ID IN (SELECT value FROM json_each(?))",
+            (json.dumps(world_ids),),
+        )
+    if commit:
+        conn.commit()
+
+
+def classify_error(exc):
+    """
+    "transient" pour une erreur qui peut disparaître en réessayant (réseau,
+    serveur surchargé, base verrouillée, ticket expiré), "permanent" sinon
+    (erreur renvoyée par l'API pour ce monde, réponse inexploitable).
+    """
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError)):
+        return "transient"
+    if isinstance(exc, requests.HTTPError):
+        status = exc.response.status_code if exc.response is not None else 500
+        return "transient" if status >= 500 or status == 429 else "permanent"
+    if isinstance(exc, (OpensslError, sqlite3.OperationalError)):
+        return "transient"
+    return "permanent"
+
+
+def client_like(client):
+    """Nouveau client Kerberos avec les identifiants et le limiteur de débit de 'client'."""
+    return KerberosClient(
+        username=client.username,
+        password=client.password,
+        api_url=client.api_url,
+        rate_limiter=client.rate_limiter,
+    )
+
+
+def retry_worlds(
+    world_ids, fetch, new_client, attempts=RETRY_ATTEMPTS, backoff=RETRY_BACKOFF, concurrency=RETRY_CONCURRENCY
+):
+    """
+    Réessaie fetch(client, world_id) pour chaque monde, avec 'concurrency'
+    appels en parallèle au plus et un délai qui double entre deux essais.
+    Un client n'est pas partagé entre threads (ticket de session, connexion
+    HTTP) : chaque thread crée le sien avec new_client() à son premier monde.
+    S'arrête au premier succès ou à la première erreur permanente.
+    Générateur de (world_id, résultat, exception ou None), dans l'ordre de fin.
+    """
+    local = threading.local()
+
+    def attempt(world_id):
+        error = None
+        for n in range(attempts):
+            if n:
+                time.sleep(backoff * 2 ** (n - 1))
+            try:
+                if getattr(local, "client", None) is None:
+                    local.client = new_client()
+                return world_id, fetch(local.client, world_id), None
+            except Exception as e:
+                error = e
+                if classify_error(e) == "permanent":
+                    break
+        return world_id, None, error
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        yield from pool.map(attempt, world_ids)
+
+
+def scan_world(client: KerberosClient, w_ID, protected=False, profile=None):
+    """
+    Interroge un monde et retourne ses lignes pour la DB, sous la forme
+    {"user": dict | None, "world": dict, "flags": [dict, ...]}.
+    Retourne None si le monde n'a pas de protagoniste.
+    Les exceptions du client sont propagées à l'appelant.
+    'profile' (ScanProfiler, optionnel) reçoit le temps de chaque appel.
+    """
+    with stage(profile, w_ID, "user_from_world"):
+        user = client.user_from_world(w_ID)
+    if not user:
+        return None
+
+    with stage(profile, w_ID, "location"):
+        location = client.location(w_ID)
+    with stage(profile, w_ID, "room_name"):
+        room = client.room_name(w_ID, location)
+    with stage(profile, w_ID, "data_collection"):
+        data = client.data_collection(w_ID)
+    return parse_world_payload(w_ID, user, location, room, data, protected)
+
+
+def parse_world_payload(w_ID, user, location, room, data, protected=False):
+    """
+    Transforme les réponses brutes de l'API pour un monde en lignes pour la DB.
+    Utilisée par scan_world et par reingest_from_archive : une modification
+    du parsing s'applique à l'archive sans nouveau scan.
+    La réponse brute est conservée dans result["source"] pour l'archive.
+    """
+    world_line = {"username": user, "world_ID": w_ID, "location": location, "room": room}
+    source = {"username": user, "location": location, "room": room, "data": data}
+    if not isinstance(data, dict):
+        return _with_hashes(
+            {"world_ID": w_ID, "user": None, "world": world_line, "flags": [], "source": source}
+        )
+
+    if protected:
+        data.pop("email", None)  # Plus sûr que l'assignation
+
+    # Ajoute toujours la ligne utilisateur, même si certains détails sont None
+    user_line = {
+        "username": user,  # Username principal vient de user_from_world
+        "first_name": data.get("first_name"),
+        "last_name": data.get("last_name"),
+        "email": data.get("email"),  # Email vient directement de 'data'
+        "profile": data.get("profile"),
+        "filiere": data.get("filiere"),
+        "blocked": data.get("blocked"),
+    }
+
+    # Traitement des flags (vérification de type pour robustesse)
+    flags_value = data.get("flags", [])
+    flags = flags_value if isinstance(flags_value, list) else []
+    flag_lines = []
+    for elt in flags:
+        if isinstance(elt, (list, tuple)) and len(elt) >= 3:
+            # elt = (flag, user associé au flag, date)
+            flag_lines.append({"username": elt[1], "flag": elt[0], "date": elt[2]})
+
+    return _with_hashes(
+        {
+            "world_ID": w_ID,
+            "user": user_line,
+            "world": world_line,
+            "flags": flag_lines,
+            "source": source,
+        }
+    )
+
+
+def _digest(obj):
+    """Empreinte courte et stable d'un objet JSON."""
+    encoded = json.dumps(obj, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+
+def _with_hashes(result):
+    """Ajoute à un résultat de scan_world l'empreinte du contenu et de la position."""
+    result["hashes"] = (
+        _digest([result["user"], result["flags"]]),
+        _digest(result["world"]),
+    )
+    return result
+
+
+def load_world_hashes(conn):
+    """{world_ID: (payload_hash, position_hash)} pour tous les mondes déjà vus."""
+    return {
+        row[0]: (row[1], row[2])
+        for row in conn.execute("SELECT world_ID, payload_hash, position_hash FROM world_hashes")
+    }
+
+
+def strip_unchanged(result, known_hashes):
+    """
+    Compare le résultat aux empreintes connues du monde. Retourne None si
+    rien n'a changé, sinon le résultat sans les parties inchangées
+    (user/flags si le contenu est identique, world si la position l'est).
+    """
+    known = known_hashes.get(result["world_ID"])
+    if known is None:
+        return result
+    payload_same = known[0] == result["hashes"][0]
+    position_same = known[1] == result["hashes"][1]
+    if payload_same and position_same:
+        return None
+    return {
+        **result,
+        "user": None if payload_same else result["user"],
+        "flags": [] if payload_same else result["flags"],
+        "world": None if position_same else result["world"],
+    }
+
+
+def _payload_key(data):
+    """JSON canonique d'une réponse brute et son empreinte sha256."""
+    encoded = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str).encode()
+    return hashlib.sha256(encoded).hexdigest(), encoded
+
+
+def archive_payload(conn, kind, data, commit=True):
+    """
+    Archive une réponse brute de l'API ('data_collection' ou 'world_list').
+    Un contenu déjà archivé n'est ni recompressé ni stocké une seconde fois,
+    seul son last_seen est mis à jour. Retourne l'empreinte du contenu.
+    """
+    payload_hash, _ = _store_payload(conn, kind, data)
+    if commit:
+        conn.commit()
+    return payload_hash
+
+
+def _store_payload(conn, kind, data):
+    """archive_payload sans commit : (empreinte, nombre de requêtes exécutées)."""
+    payload_hash, encoded = _payload_key(data)
+    now = time.time()
+    cursor = conn.execute(
+        "UPDATE raw_payloads SET last_seen = ? WHERE hash = ?", (now, payload_hash)
+    )
+    if cursor.rowcount > 0:
+        return payload_hash, 1
+    conn.execute(
+        """
+        INSERT INTO raw_payloads (hash, kind, data, raw_size, first_seen, last_seen)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        (payload_hash, kind, zlib.compress(encoded, ARCHIVE_COMPRESSION), len(encoded), now, now),
+    )
+    return payload_hash, 2
+
+
+def load_payload(blob):
+    """Décompresse une réponse archivée (colonne raw_payloads.data)."""
+    return json.loads(zlib.decompress(blob)) if blob is not None else None
+
+
+def _archive_sources(conn, results):
+    """
+    Archive les réponses brutes des résultats écrits (sans commit).
+    Retourne le nombre de requêtes exécutées.
+    """
+    seen_at = time.time()
+    rows, statements = [], 0
+    for result in results:
+        source = result.get("source")
+        if source is None:
+            continue
+        payload_hash, executed = _store_payload(conn, "data_collection", source["data"])
+        statements += executed
+        rows.append(
+            (result["world_ID"], source["username"], source["location"], source["room"], payload_hash, seen_at)
+        )
+    if not rows:
+        return statements
+    conn.executemany(
+        """
+        INSERT INTO world_observations (world_ID, username, location, room, payload_hash, seen_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        rows,
+    )
+    return statements + 1
+
+
+def record_position(cursor, world_id, room, entered_at):
+    """
+    Ajoute une transition à l'historique des positions (sans commit), sauf
+    si le monde est déjà dans cette salle : seuls les changements sont stockés.
+    entered_at: secondes epoch.
+    """
+    if room is None:
+        return
+    cursor.execute("INSERT OR IGNORE INTO world_keys (world_ID) VALUES (?)", (world_id,))
+    cursor.execute("INSERT OR IGNORE INTO room_keys (name) VALUES (?)", (room,))
+    cursor.execute(
+        """
+        INSERT OR IGNORE INTO positions (world_key, room_key, entered_at)
+        SELECT w.id, r.id, ? FROM world_keys w, room_keys r
+        WHERE w.world_ID = ? AND r.name = ?
+          AND r.id IS NOT (
+              SELECT p.room_key FROM positions p WHERE p.world_key = w.id
+              ORDER BY p.entered_at DESC LIMIT 1
+          )
+        """,
+        (int(entered_at), world_id, room),
+    )
+
+
+def _write_rows(cursor, users, worlds, flags, now, track_positions=True, refresh=False):
+    """
+    Écrit des lignes déjà dédoublonnées par clé (sans commit).
+    users: {username: ligne}, worlds: {world_ID: ligne}, flags: {(username, flag): ligne}.
+    Chaque déplacement est aussi ajouté à l'historique (track_positions).
+    refresh : les utilisateurs et flags déjà présents prennent les valeurs
+    re-parsées (reingest_from_archive) ; created_at garde sa valeur d'origine.
+    """
+    changes = {"new_users": 0, "moved": 0, "new_flags": 0, "statements": 0}
+    entered_at = datetime.datetime.fromisoformat(now).timestamp()
+
+    for user_line in users.values():
+        if refresh:
+            cursor.execute(
+                """
+                UPDATE users SET first_name = :first_name, last_name = :last_name, email = :email,
+                    profile = :profile, filiere = :filiere, blocked = :blocked
+                WHERE username = :username
+                """,
+                user_line,
+            )
+            changes["statements"] += 1
+            if cursor.rowcount > 0:
                 continue
+        cursor.execute(
+            """
+            INSERT OR IGNORE INTO users (username, first_name, last_name, email, profile, filiere, blocked, created_at)
+            VALUES (:username, :first_name, :last_name, :email, :profile, :filiere, :blocked, :created_at)
+            """,
+            {**user_line, "created_at": now},
+        )
+        changes["new_users"] += max(cursor.rowcount, 0)
+        changes["statements"] += 1
 
-            # print(f"  -> Données brutes récupérées (type: {type(data)})")
-
-            if protected:
-                data.pop("email", None)  # Plus sûr que l'assignation
-
-            # Initialise les détails utilisateur avec des valeurs par défaut sûres
-            first_name = None
-            last_name = None
-            profile = None
-            filiere = None
-            blocked = None
-            email = data.get(
-                "email"
-            )  # Email vient directement de 'data', pas de 'user_info'
-
-            # Vérifie si la valeur récupérée pour 'user' EST un dictionnaire
-            # if "user" in data:
-            #     # C'est sûr d'utiliser .get() maintenant sur user_info_value
-            #     print(
-            #         "  -> La clé 'user' contient un dictionnaire. Extraction des détails."
-            #     )
-            first_name = data.get("first_name")
-            last_name = data.get("last_name")
-            profile = data.get("profile")
-            filiere = data.get("filiere")
-            blocked = data.get("blocked")
-            # elif user_info_value is not None:  # Si 'user' existe mais n'est pas un dict
-            #     print(
-            #         f"  -> ATTENTION: La clé 'user' dans data pour {w_ID} n'est PAS un dictionnaire (type: {type(user_info_value)}). Détails utilisateur (nom, profil, etc.) non extraits."
-            #     )
-            # else:  # Si la clé 'user' n'existe pas du tout dans data
-            #     print(
-            #         f"  -> INFO: La clé 'user' n'existe pas dans data pour {w_ID}. Détails utilisateur (nom, profil, etc.) non extraits."
-            #     )
-            # ---> FIN AJUSTEMENT CORRECTION <---
-
-            # Ajoute toujours la ligne utilisateur, même si certains détails sont None
-            user_db_lines.append(
-                {
-                    "username": user,  # Username principal vient de user_from_world
-                    "first_name": first_name,
-                    "last_name": last_name,
-                    "email": email,  # Email récupéré plus haut
-                    "profile": profile,
-                    "filiere": filiere,
-                    "blocked": blocked,
-                }
+    for world_line in worlds.values():
+        cursor.execute(
+            "SELECT location, room, created_at FROM worlds WHERE username = ? AND world_ID = ?",
+            (world_line["username"], world_line["world_ID"]),
+        )
+        existing = cursor.fetchone()
+        changes["statements"] += 1
+        if existing is not None and refresh and (existing[2] or "") > now:
+            continue  # position plus récente que l'observation rejouée
+        if existing is None:
+            changes["statements"] += 1
+            cursor.execute(
+                """
+                INSERT INTO worlds (username, world_ID, location, room, created_at)
+                VALUES (:username, :world_ID, :location, :room, :created_at)
+                """,
+                {**world_line, "created_at": now},
             )
+            changes["moved"] += 1
+            if track_positions:
+                record_position(cursor, world_line["world_ID"], world_line["room"], entered_at)
+                changes["statements"] += 3
+        elif tuple(existing[:2]) != (world_line["location"], world_line["room"]):
+            # Même logique que /api/update-worlds : created_at suit le dernier déplacement
+            changes["statements"] += 1
+            cursor.execute(
+                """
+                UPDATE worlds SET location = ?, room = ?, created_at = ?
+                WHERE username = ? AND world_ID = ?
+                """,
+                (
+                    world_line["location"],
+                    world_line["room"],
+                    now,
+                    world_line["username"],
+                    world_line["world_ID"],
+                ),
+            )
+            changes["moved"] += 1
+            if track_positions:
+                record_position(cursor, world_line["world_ID"], world_line["room"], entered_at)
+                changes["statements"] += 3
+
+    if not flags:
+        return changes
+    # flags est une vue (voir surrogate_keys.py) : rowcount y vaut toujours 0,
+    # les flags déjà connus sont donc lus en une requête avant l'insertion
+    known = {
+        row[0]
+        for row in cursor.execute(
+            "SELECT flag FROM flag_rows WHERE flag IN (SELECT value FROM json_each(?))",
+            (json.dumps([flag_line["flag"] for flag_line in flags.values()]),),
+        )
+    }
+    changes["statements"] += 1
+    for flag_line in flags.values():
+        if flag_line["flag"] in known:
+            if refresh:
+                cursor.execute(
+                    f"""
+                    UPDATE flags SET username = :username, date = :date, flag_base = {FLAG_BASE_SQL},
+                        flag_suffix = {FLAG_SUFFIX_SQL}, date_epoch = {DATE_EPOCH_SQL}
+                    WHERE flag = :flag AND (username IS NOT :username OR date IS NOT :date)
+                    """,
+                    flag_line,
+                )
+                changes["statements"] += 1
+            continue
+        cursor.execute(
+            f"""
+            INSERT OR IGNORE INTO flags (username, flag, date, created_at, flag_base, flag_suffix, date_epoch)
+            VALUES (:username, :flag, :date, :created_at, {FLAG_BASE_SQL}, {FLAG_SUFFIX_SQL}, {DATE_EPOCH_SQL})
+            """,
+            {**flag_line, "created_at": now},
+        )
+        known.add(flag_line["flag"])
+        changes["new_flags"] += 1
+        changes["statements"] += 1
 
-            # Ajoute toujours la ligne monde si on est arrivé ici
-            world_db_lines.append(
-                {"username": user, "world_ID": w_ID, "location": location, "room": room}
+    return changes
+
+
+def save_world_batch(conn, results, checkpoint=None, failures=None, commit=True):
+    """
+    Enregistre une liste de résultats de scan_world en une seule transaction.
+    Les doublons sont éliminés par clé primaire (la dernière valeur l'emporte).
+    checkpoint: (run_id, world_ids) à marquer comme traités dans la même transaction.
+    failures: {world_ID: "empty" | "error"} à ajouter au cache négatif ; les
+    mondes présents dans 'results' en sont retirés.
+    Les empreintes des résultats sont mises à jour (voir strip_unchanged) et
+    leurs réponses brutes archivées (voir reingest_from_archive).
+    Un lot sans utilisateur, monde ni flag à écrire n'ouvre pas ce chemin
+    d'écriture : seuls le checkpoint et les échecs demandés sont enregistrés.
+    commit=False : la transaction reste à l'appelant (voir db_writer.py).
+    Retourne les compteurs {"new_users", "moved", "new_flags", "statements"} ;
+    "statements" compte chaque requête exécutée (un executemany compte pour une).
+    """
+    users, worlds, flags, hashes = {}, {}, {}, {}
+    for result in results:
+        if result["user"]:
+            users[result["user"]["username"]] = result["user"]
+        if result["world"]:
+            worlds[result["world"]["world_ID"]] = result["world"]
+        for flag_line in result["flags"]:
+            flags[(flag_line["username"], flag_line["flag"])] = flag_line
+        hashes[result["world_ID"]] = result["hashes"]
+
+    changes = {"new_users": 0, "moved": 0, "new_flags": 0, "statements": 0}
+    checkpoint_ids = list(checkpoint[1]) if checkpoint else []
+    has_rows = bool(users or worlds or flags)
+    if not (has_rows or checkpoint_ids or failures):
+        return changes
+
+    now = datetime.datetime.now().isoformat()
+    try:
+        cursor = conn.cursor()
+        if has_rows:
+            changes = _write_rows(cursor, users, worlds, flags, now)
+        if checkpoint_ids:
+            completed_at = time.time()
+            cursor.executemany(
+                "INSERT OR REPLACE INTO scan_checkpoints (run_id, world_ID, completed_at) VALUES (?, ?, ?)",
+                [(checkpoint[0], world_id, completed_at) for world_id in checkpoint_ids],
+            )
+            changes["statements"] += 1
+        if has_rows:
+            cursor.executemany(
+                "INSERT OR REPLACE INTO world_hashes (world_ID, payload_hash, position_hash, updated_at) VALUES (?, ?, ?, ?)",
+                [(world_id, h[0], h[1], time.time()) for world_id, h in hashes.items()],
             )
+            changes["statements"] += 1
+            changes["statements"] += _archive_sources(conn, results)
+            clear_probe_failures(conn, hashes.keys(), commit=False)
+            changes["statements"] += 1
+        if failures:
+            record_probe_failures(conn, failures, commit=False)
+            changes["statements"] += 1
+        if has_rows:
+            # Utilisateurs dont les flags ont changé (voir flag_bitmaps.py) et
+            # documents /api/user des utilisateurs touchés (voir user_documents.py)
+            changes["statements"] += refresh_flag_bitmaps(conn)
+            changes["statements"] += refresh_user_documents(conn)
+        if commit:
+            conn.commit()
+    except sqlite3.Error:
+        if commit:
+            conn.rollback()
+        raise
+    return changes
 
-            # Traitement des flags (ajout d'une vérification de type pour robustesse)
-            flags_value = data.get("flags", [])
-            if not isinstance(flags_value, list):
-                # print(
-                #     f"  -> ATTENTION: La clé 'flags' dans data pour {w_ID} n'est pas une liste (type: {type(flags_value)}). Flags ignorés."
-                # )
-                flags = []  # Assure que 'flags' est itérable
-            else:
-                flags = flags_value
-
-            # print(f"  -> Trouvé {len(flags)} flags.")
-            for elt in flags:
-                if isinstance(elt, (list, tuple)) and len(elt) >= 3:
-                    f = elt[0]
-                    u = elt[1]  # Utilise le user associé au flag
-                    d = elt[2]
-                    flags_db_lines.append({"username": u, "flag": f, "date": d})
-                # else:
-                # print(f"  -> Flag malformé ignoré dans le monde {w_ID}: {elt}")
+
+def save_world_result(conn, result):
+    """
+    Enregistre le résultat de scan_world pour un seul monde.
+    Retourne ce qui a changé : {"new_user": bool, "moved": bool, "new_flags": int}.
+    """
+    changes = save_world_batch(conn, [result] if result is not None else [])
+    return {
+        "new_user": changes["new_users"] > 0,
+        "moved": changes["moved"] > 0,
+        "new_flags": changes["new_flags"],
+    }
+
+
+def apply_positions(conn, positions, failures=None, recovered=None):
+    """
+    Écrit les positions relevées par /api/update-worlds (sans commit) :
+    positions: [[world_ID, username, location, room], ...].
+    Un monde déplacé est mis à jour, un monde inconnu ajouté, et chaque
+    changement de salle va dans l'historique. failures et recovered
+    mettent à jour le cache négatif ({world_ID: statut} et [world_ID]).
+    Retourne {"added", "updated"}.
+    """
+    now = datetime.datetime.now().isoformat()
+    entered_at = time.time()
+    counts = {"added": 0, "updated": 0}
+    cursor = conn.cursor()
+    for world_id, user, location, room in positions:
+        existing = cursor.execute(
+            "SELECT location, room FROM worlds WHERE username = ? AND world_ID = ?",
+            (user, world_id),
+        ).fetchone()
+        if existing is None:
+            cursor.execute(
+                """
+                INSERT INTO worlds (username, world_ID, location, room, created_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (user, world_id, location, room, now),
+            )
+            counts["added"] += 1
+        elif tuple(existing) != (location, room):
+            cursor.execute(
+                """
+                UPDATE worlds SET location = ?, room = ?, created_at = ?
+                WHERE username = ? AND world_ID = ?
+                """,
+                (location, room, now, user, world_id),
+            )
+            counts["updated"] += 1
+        else:
+            continue
+        record_position(cursor, world_id, room, entered_at)
+    refresh_user_documents(conn)
+    clear_probe_failures(conn, recovered or [], commit=False)
+    record_probe_failures(conn, failures or {}, commit=False)
+    return counts
+
+
+def compact_positions(conn, retention_days=POSITION_RETENTION_DAYS, now=None, commit=True):
+    """
+    Résume les transitions plus anciennes que 'retention_days' en secondes
+    d'occupation par (monde, heure, salle) dans position_hourly, puis les
+    supprime. La dernière transition ancienne de chaque monde est ramenée
+    à la date limite : la salle occupée à ce moment reste connue.
+    Retourne {"transitions": supprimées, "hours": lignes horaires touchées}.
+    """
+    cutoff = int((now or time.time()) - retention_days * 86400)
+    rows = conn.execute(
+        """
+        SELECT world_key, room_key, entered_at,
+               LEAD(entered_at) OVER (PARTITION BY world_key ORDER BY entered_at)
+        FROM positions WHERE entered_at < ?
+        """,
+        (cutoff,),
+    ).fetchall()
+    occupancy = {}  # (world_key, heure, room_key) -> secondes
+    for world_key, room_key, start, end in rows:
+        end = min(end or cutoff, cutoff)
+        while start < end:
+            hour = start // 3600
+            step = min(end, (hour + 1) * 3600) - start
+            key = (world_key, hour, room_key)
+            occupancy[key] = occupancy.get(key, 0) + step
+            start += step
+    try:
+        conn.executemany(
+            """
+            INSERT INTO position_hourly (world_key, hour, room_key, seconds) VALUES (?, ?, ?, ?)
+            ON CONFLICT (world_key, hour, room_key) DO UPDATE SET seconds = seconds + excluded.seconds
+            """,
+            [(*key, seconds) for key, seconds in occupancy.items()],
+        )
+        deleted = conn.execute(
+            """
+            DELETE FROM positions
+            WHERE entered_at < :cutoff AND entered_at < (
+                SELECT MAX(p.entered_at) FROM positions p
+                WHERE p.world_key = positions.world_key AND p.entered_at < :cutoff
+            )
+            """,
+            {"cutoff": cutoff},
+        ).rowcount
+        # La salle occupée à la date limite devient le point de départ de l'historique détaillé
+        conn.execute("UPDATE OR IGNORE positions SET entered_at = ? WHERE entered_at < ?", (cutoff, cutoff))
+        deleted += conn.execute("DELETE FROM positions WHERE entered_at < ?", (cutoff,)).rowcount
+        if commit:
+            conn.commit()
+    except sqlite3.Error:
+        if commit:
+            conn.rollback()
+        raise
+    return {"transitions": deleted, "hours": len(occupancy)}
+
+
+def _user_world_keys(conn, username):
+    return [
+        row[0]
+        for row in conn.execute(
+            """
+            SELECT w.world_key FROM world_rows w JOIN user_keys u ON u.id = w.user_id
+            WHERE u.username = ?
+            """,
+            (username,),
+        )
+    ]
+
+
+def position_at(conn, username, when, archive_dir=ARCHIVE_DIR):
+    """
+    Salle où se trouvait 'username' à l'instant 'when' (secondes epoch), ou None.
+    Au-delà de la rétention, la salle la plus occupée pendant l'heure de 'when'
+    (y compris dans les partitions mensuelles, voir partitions.py).
+    Retourne {"world_ID", "room", "since", "resolution": "transition" | "hourly"}.
+    """
+    keys = _user_world_keys(conn, username)
+    best = None
+    for world_key in keys:
+        row = conn.execute(
+            """
+            SELECT k.world_ID, r.name, p.entered_at FROM positions p
+            JOIN world_keys k ON k.id = p.world_key JOIN room_keys r ON r.id = p.room_key
+            WHERE p.world_key = ? AND p.entered_at <= ?
+            ORDER BY p.entered_at DESC LIMIT 1
+            """,
+            (world_key, int(when)),
+        ).fetchone()
+        if row and (best is None or row[2] > best[2]):
+            best = row
+    if best is not None:
+        return {"world_ID": best[0], "room": best[1], "since": best[2], "resolution": "transition"}
+
+    with attached_history(conn, when, when, archive_dir):
+        row = conn.execute(
+            """
+            SELECT k.world_ID, r.name, h.hour * 3600 FROM all_position_hourly h
+            JOIN world_keys k ON k.id = h.world_key JOIN room_keys r ON r.id = h.room_key
+            WHERE h.world_key IN (SELECT value FROM json_each(?)) AND h.hour = ?
+            ORDER BY h.seconds DESC LIMIT 1
+            """,
+            (json.dumps(keys), int(when) // 3600),
+        ).fetchone()
+    if row is None:
+        return None
+    return {"world_ID": row[0], "room": row[1], "since": row[2], "resolution": "hourly"}
+
+
+def position_trail(conn, username, start, end, archive_dir=ARCHIVE_DIR):
+    """
+    Parcours de 'username' entre 'start' et 'end' (secondes epoch), trié par date :
+    les heures résumées (occupation par salle) puis les transitions détaillées,
+    dont celle en cours au début de la fenêtre. Les heures archivées dans
+    les partitions mensuelles sont incluses (ValueError si la fenêtre en
+    couvre plus de MAX_ATTACHED, voir partitions.py).
+    Chaque étape : {"world_ID", "room", "at", "seconds" (horaire seulement), "resolution"}.
+    """
+    keys = json.dumps(_user_world_keys(conn, username))
+    with attached_history(conn, start, end, archive_dir):
+        trail = [
+            {"world_ID": row[0], "room": row[1], "at": row[2], "seconds": row[3], "resolution": "hourly"}
+            for row in conn.execute(
+                """
+                SELECT k.world_ID, r.name, h.hour * 3600, h.seconds FROM all_position_hourly h
+                JOIN world_keys k ON k.id = h.world_key JOIN room_keys r ON r.id = h.room_key
+                WHERE h.world_key IN (SELECT value FROM json_each(?))
+                  AND h.hour BETWEEN ? AND ?
+                ORDER BY h.hour, h.seconds DESC
+                """,
+                (keys, int(start) // 3600, int(end) // 3600),
+            )
+        ]
+    trail.extend(
+        {"world_ID": row[0], "room": row[1], "at": row[2], "resolution": "transition"}
+        for row in conn.execute(
+            """
+            SELECT k.world_ID, r.name, p.entered_at FROM positions p
+            JOIN world_keys k ON k.id = p.world_key JOIN room_keys r ON r.id = p.room_key
+            WHERE p.world_key IN (SELECT value FROM json_each(:keys))
+              AND p.entered_at <= :end
+              AND p.entered_at >= COALESCE(
+                  (SELECT MAX(p2.entered_at) FROM positions p2
+                   WHERE p2.world_key = p.world_key AND p2.entered_at <= :start),
+                  :start)
+            ORDER BY p.entered_at
+            """,
+            {"keys": keys, "start": int(start), "end": int(end)},
+        )
+    )
+    return trail
+
+
+def reingest_from_archive(conn, protected=False, batch_size=500):
+    """
+    Réapplique l'archive aux tables users, worlds et flags, sans appel API :
+    chaque observation est re-parsée par parse_world_payload dans l'ordre
+    où elle a été vue, avec sa date d'origine comme created_at des lignes
+    nouvelles. Les lignes existantes sont mises à jour, jamais supprimées :
+    celles qu'aucune observation ne couvre (antérieures à l'archive,
+    utilisateurs disparus de la liste) restent telles quelles.
+    Les observations des partitions mensuelles passent en premier.
+    À lancer après une modification du parsing.
+    Retourne {"observations", "missing_payloads", "new_users", "moved", "new_flags"}.
+    """
+    stats = {"observations": 0, "missing_payloads": 0, "new_users": 0, "moved": 0, "new_flags": 0}
+    hashes = {}
+    write = conn.cursor()
+    try:
+        rows = itertools.chain(
+            iter_archived_observations(),
+            conn.execute(
+                """
+                SELECT o.world_ID, o.username, o.location, o.room, o.seen_at, o.payload_hash, p.data
+                FROM world_observations o
+                LEFT JOIN raw_payloads p ON p.hash = o.payload_hash
+                ORDER BY o.seen_at, o.id
+                """
+            ),
+        )
+        for world_id, username, location, room, seen_at, payload_hash, blob in rows:
+            if blob is None and payload_hash is not None:
+                # Observation archivée dont la réponse est encore dans la DB principale
+                row = write.execute("SELECT data FROM raw_payloads WHERE hash = ?", (payload_hash,)).fetchone()
+                blob = row[0] if row else None
+            if blob is None and payload_hash is not None:
+                stats["missing_payloads"] += 1
+            result = parse_world_payload(
+                world_id, username, location, room, load_payload(blob), protected
+            )
+            changes = _write_rows(
+                write,
+                {username: result["user"]} if result["user"] else {},
+                {world_id: result["world"]},
+                {(f["username"], f["flag"]): f for f in result["flags"]},
+                datetime.datetime.fromtimestamp(seen_at).isoformat(),
+                track_positions=False,  # l'historique des positions est conservé tel quel
+                refresh=True,
+            )
+            for key in ("new_users", "moved", "new_flags"):
+                stats[key] += changes[key]
+            hashes[world_id] = result["hashes"]
+            stats["observations"] += 1
+            if stats["observations"] % batch_size == 0:
+                log.debug("%d observations rejouées", stats["observations"])
+        # Les empreintes suivent le nouveau parsing : le prochain scan ne réécrit que le vrai changement
+        write.executemany(
+            "INSERT OR REPLACE INTO world_hashes (world_ID, payload_hash, position_hash, updated_at) VALUES (?, ?, ?, ?)",
+            [(world_id, h[0], h[1], time.time()) for world_id, h in hashes.items()],
+        )
+        refresh_flag_bitmaps(conn)
+        refresh_user_documents(conn)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return stats
+
+
+def start_scan_run(conn, resume_window=CHECKPOINT_FRESHNESS):
+    """
+    Reprend le dernier passage s'il n'est pas terminé et a démarré il y a
+    moins de 'resume_window' secondes, sinon en ouvre un nouveau.
+    Retourne (run_id, mondes déjà traités).
+    """
+    row = conn.execute(
+        "SELECT id, started_at, finished_at FROM scan_runs ORDER BY id DESC LIMIT 1"
+    ).fetchone()
+    if (
+        resume_window > 0
+        and row is not None
+        and row[2] is None
+        and time.time() - row[1] < resume_window
+    ):
+        done = {
+            r[0]
+            for r in conn.execute(
+                "SELECT world_ID FROM scan_checkpoints WHERE run_id = ?", (row[0],)
+            )
+        }
+        return row[0], done
+
+    cursor = conn.execute("INSERT INTO scan_runs (started_at) VALUES (?)", (time.time(),))
+    # Les checkpoints des passages précédents ne servent plus
+    conn.execute("DELETE FROM scan_checkpoints WHERE run_id != ?", (cursor.lastrowid,))
+    conn.commit()
+    return cursor.lastrowid, set()
+
+
+def finish_scan_run(conn, run_id):
+    conn.execute("UPDATE scan_runs SET finished_at = ? WHERE id = ?", (time.time(), run_id))
+    conn.execute("DELETE FROM scan_checkpoints WHERE run_id = ?", (run_id,))
+    conn.commit()
+
+
+SCAN_DONE_STATES = ("ok", "unchanged", "empty")
+
+
+def _database_writer(results, stats, batch_size, batch_seconds, run_id, profile=None):
+    """
+    Consommateur du pipeline : vide la file 'results' dans SQLite par
+    micro-lots (taille ou délai atteint), en marquant les mondes traités
+    pour le passage 'run_id'. Les éléments sont des tuples (world_ID,
+    résultat, état) avec état "ok", "unchanged", "empty" (pas
+    d'utilisateur) ou le nom de l'exception si le scan a échoué.
+    La copie de lecture de l'API est republiée toutes les SNAPSHOT_INTERVAL
+    secondes pendant le passage si un monde a changé depuis la précédente
+    (voir snapshots.py) ; checkpoints et cache négatif ne comptent pas.
+    S'arrête sur None.
+    """
+    conn = connect_db()
+    last_snapshot = time.monotonic()
+    unpublished = False  # mondes écrits absents de la copie de lecture
+    batch = []
+    deadline = time.monotonic() + batch_seconds
+    done = False
+    try:
+        while not done:
+            try:
+                item = results.get(timeout=max(deadline - time.monotonic(), 0.01))
+                if item is None:
+                    done = True
+                else:
+                    batch.append(item)
+            except queue.Empty:
+                pass
+
+            if batch and (done or len(batch) >= batch_size or time.monotonic() >= deadline):
+                write_start = time.perf_counter()
+                try:
+                    changes = save_world_batch(
+                        conn,
+                        [result for _, result, status in batch if status == "ok"],
+                        checkpoint=(
+                            run_id,
+                            [w_ID for w_ID, _, status in batch if status in SCAN_DONE_STATES],
+                        ),
+                        failures={
+                            w_ID: ("empty" if status == "empty" else "error")
+                            for w_ID, _, status in batch
+                            if status not in ("ok", "unchanged")
+                        },
+                    )
+                    for key, value in changes.items():
+                        stats[key] += value
+                    stats["batches"] += 1
+                    unpublished = unpublished or any(status == "ok" for _, _, status in batch)
+                except sqlite3.Error as e:
+                    log.warning("Erreur SQLite lors de l'écriture d'un lot de %d mondes: %s", len(batch), e)
+                    stats["write_errors"] += len(batch)
+                if profile is not None:
+                    # Le coût d'un lot est réparti entre ses mondes
+                    share = (time.perf_counter() - write_start) / len(batch)
+                    for w_ID, _, _ in batch:
+                        profile.add_time(w_ID, "db_write", share)
+                batch = []
+                if unpublished and time.monotonic() - last_snapshot >= SNAPSHOT_INTERVAL:
+                    try:
+                        publish_snapshot(conn)
+                    except (sqlite3.Error, OSError) as e:
+                        log.warning("Copie de lecture non publiée: %s", e)
+                    last_snapshot = time.monotonic()
+                    unpublished = False
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + batch_seconds
+    finally:
+        conn.close()
+
+
+def scan_to_database(
+    client: KerberosClient,
+    protected=False,
+    batch_size=WRITE_BATCH_SIZE,
+    batch_seconds=WRITE_BATCH_SECONDS,
+    queue_size=SCAN_QUEUE_SIZE,
+    resume_window=CHECKPOINT_FRESHNESS,
+    profile=None,
+):
+    """
+    Scanne tous les mondes et écrit les résultats au fil de l'eau.
+    Le scan (producteur) et l'écriture (consommateur) communiquent par une
+    file bornée : si l'écriture prend du retard, le scan attend, et la
+    mémoire reste constante quel que soit le nombre de mondes.
+    Chaque lot écrit marque ses mondes comme traités : un passage
+    interrompu est repris au lancement suivant (voir start_scan_run).
+    Avec 'profile' (ScanProfiler), chaque étape est chronométrée et un
+    résumé texte remplace la barre de progression.
+    Retourne les statistiques du passage.
+    """
+    conn = connect_db()
+    run_id, already_done = start_scan_run(conn, resume_window)
+    if already_done:
+        print(f"Reprise du passage {run_id}: {len(already_done)} mondes déjà traités.")
+
+    # Les mondes du cache négatif ne sont pas re-sondés avant leur échéance
+    cached = negative_cache_skip(conn)
+    world_list = client.list_worlds()
+    archive_payload(conn, "world_list", world_list)
+    skipped = sum(1 for w in world_list if w[0] in cached and w[0] not in already_done)
+    world_list = [w for w in world_list if w[0] not in already_done and w[0] not in cached]
+    known_hashes = load_world_hashes(conn)
+    results = queue.Queue(maxsize=queue_size)
+    stats = {
+        "worlds": len(world_list) + len(already_done) + skipped,
+        "resumed": len(already_done),
+        "cached_negative": skipped,
+        "scanned": 0,
+        "empty": 0,
+        "errors": 0,
+        "errors_transient": 0,
+        "errors_permanent": 0,
+        "retried": 0,
+        "recovered": 0,
+        "unchanged": 0,
+        "new_users": 0,
+        "moved": 0,
+        "new_flags": 0,
+        "statements": 0,
+        "batches": 0,
+        "write_errors": 0,
+    }
+    writer = threading.Thread(
+        target=_database_writer,
+        args=(results, stats, batch_size, batch_seconds, run_id, profile),
+        daemon=True,
+    )
+    writer.start()
+
+    def record(w_ID, result, error):
+        if error is not None:
+            stats["errors"] += 1
+            stats[f"errors_{classify_error(error)}"] += 1
+            if profile is not None:
+                profile.add_error(error)
+            status = error.__class__.__name__
+        elif result is None:
+            stats["empty"] += 1
+            status = "empty"
+        else:
+            stats["scanned"] += 1
+            # Seules les parties qui ont changé depuis le dernier passage sont écrites
+            result = strip_unchanged(result, known_hashes)
+            status = "ok" if result is not None else "unchanged"
+            if result is None:
+                stats["unchanged"] += 1
+        # bloque si la file est pleine (backpressure)
+        results.put((w_ID, result, status))
+        if profile is not None:
+            profile.sample_memory()
+
+    retry = []
+    if profile is not None:
+        profile.start()
+    try:
+        for w in world_list if profile is not None else tqdm.tqdm(world_list):
+            w_ID = w[0]
+            error = None
+            try:
+                result = scan_world(client, w_ID, protected, profile)
+            except ValueError as e:
+                log.warning("Erreur (ValueError) processing world %s: %s", w_ID, e)
+                result, error = None, e
+            except Exception as e:
+                log.warning(
+                    "Erreur inattendue processing world %s: %s: %s", w_ID, e.__class__.__name__, e
+                )
+                result, error = None, e
+            if error is not None and classify_error(error) == "transient":
+                retry.append(w_ID)  # repris en fin de passage
+                continue
+            record(w_ID, result, error)
+
+        # File de reprise : les erreurs transitoires ont une seconde chance
+        if retry:
+            log.info("Reprise de %d mondes en erreur transitoire...", len(retry))
+            stats["retried"] = len(retry)
+            for w_ID, result, error in retry_worlds(
+                retry,
+                lambda retry_client, w_ID: scan_world(retry_client, w_ID, protected, profile),
+                lambda: client_like(client),
+            ):
+                if error is None:
+                    stats["recovered"] += 1
+                else:
+                    log.warning("Échec définitif pour %s: %s: %s", w_ID, error.__class__.__name__, error)
+                record(w_ID, result, error)
+    finally:
+        results.put(None)
+        writer.join()
+        if profile is not None:
+            profile.stop()
+
+    # Atteint seulement si la boucle est allée au bout : sinon le passage reste ouvert
+    finish_scan_run(conn, run_id)
+    conn.close()
+    stats["completeness"] = completeness(stats["scanned"] + stats["empty"], len(world_list))
+    return stats
+
+
+def completeness(refreshed, total):
+    """Pourcentage de mondes rafraîchis avec succès sur le passage."""
+    return round(100.0 * refreshed / total, 1) if total else 100.0
+
+
+def scan_active_users(client: KerberosClient, protected=False, profile=None):
+    # Les mondes du cache négatif ne sont pas re-sondés avant leur échéance
+    conn = connect_db()
+    cached = negative_cache_skip(conn)
+    world_list = [w for w in client.list_worlds() if w[0] not in cached]
+    flags_db_lines = []
+    user_db_lines = []
+    world_db_lines = []
+    failures = {}
+    recovered = []
+    retry = []
+
+    def record(w_ID, result):
+        if result is None:
+            failures[w_ID] = "empty"
+            return
+        recovered.append(w_ID)
+        if result["user"]:
+            user_db_lines.append(result["user"])
+        world_db_lines.append(result["world"])
+        flags_db_lines.extend(result["flags"])
+
+    def record_error(w_ID, e):
+        failures[w_ID] = "error"
+        if profile is not None:
+            profile.add_error(e)
+
+    if profile is not None:
+        profile.start()
+    for w in world_list if profile is not None else tqdm.tqdm(world_list):
+        w_ID = w[0]
+        try:
+            record(w_ID, scan_world(client, w_ID, protected, profile))
 
         except ValueError as e:
-            print(f"Erreur (ValueError) processing world {w_ID}: {e}")
+            log.warning("Erreur (ValueError) processing world %s: %s", w_ID, e)
+            record_error(w_ID, e)
             continue
         except Exception as e:
-            user_context = f" (utilisateur: {user})" if user else ""
-            print(
-                f"Erreur inattendue processing world {w_ID}{user_context}: {e.__class__.__name__}: {e}"
+            log.warning(
+                "Erreur inattendue processing world %s: %s: %s", w_ID, e.__class__.__name__, e
             )
-            # Décommenter pour voir la trace complète si l'erreur persiste ou change
-            # import traceback
-            # traceback.print_exc()
+            if classify_error(e) == "transient":
+                retry.append(w_ID)  # repris en fin de passage
+            else:
+                record_error(w_ID, e)
             continue
+        finally:
+            if profile is not None:
+                profile.sample_memory()
+
+    # File de reprise : les erreurs transitoires ont une seconde chance
+    for w_ID, result, error in retry_worlds(
+        retry,
+        lambda retry_client, w_ID: scan_world(retry_client, w_ID, protected, profile),
+        lambda: client_like(client),
+    ):
+        if error is None:
+            record(w_ID, result)
+        else:
+            log.warning("Échec définitif pour %s: %s: %s", w_ID, error.__class__.__name__, error)
+            record_error(w_ID, error)
+    if profile is not None:
+        profile.stop()
+    print(
+        f"Complétude du passage: "
+        f"{completeness(len(world_list) - sum(1 for s in failures.values() if s == 'error'), len(world_list))}%"
+    )
+
+    clear_probe_failures(conn, recovered, commit=False)
+    record_probe_failures(conn, failures)
+    conn.close()
 
-    # ... (Fin de la fonction inchangée) ...
-    # print("Nettoyage des doublons...")
     user_db_lines = [dict(fs) for fs in {frozenset(d.items()) for d in user_db_lines}]
     world_db_lines = [dict(fs) for fs in {frozenset(d.items()) for d in world_db_lines}]
     flags_db_lines = [dict(fs) for fs in {frozenset(d.items()) for d in flags_db_lines}]
 
-    # print("Scan terminé.")
     return (
         user_db_lines,
         world_db_lines,
@@ -371,6 +1496,42 @@ def scan_active_users(client: KerberosClient, protected=False):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scan complet et mise à jour de la DB")
+    parser.add_argument(
+        "--profile",
+        metavar="FICHIER.json",
+        help="profile le scan par étape et écrit le rapport JSON dans ce fichier",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="répartit le scan sur N processus (voir scan_workers.py)",
+    )
+    parser.add_argument("--credentials", help="fichier JSON de comptes pour les workers")
+    parser.add_argument(
+        "--reingest",
+        action="store_true",
+        help="réapplique l'archive des réponses brutes à users, worlds et flags, sans appel API",
+    )
+    parser.add_argument("--protected", action="store_true", help="ne pas stocker les emails")
+    args = parser.parse_args()
+
+    if args.reingest:
+        initialize_database()
+        conn = connect_db()
+        print("Réapplication de l'archive aux tables...")
+        print(reingest_from_archive(conn, args.protected))
+        print(f"Copie de lecture publiée: génération {publish_snapshot(conn)}.")
+        conn.close()
+        raise SystemExit(0)
+
+    if args.workers > 1:
+        from scan_workers import run_sharded_scan
+
+        print(run_sharded_scan(args.workers, args.credentials, args.protected))
+        raise SystemExit(0)
+
     # 1. Initialiser la base de données unique (crée le fichier et les tables si besoin)
     initialize_database()
     # === Section de Migration (À exécuter UNE SEULE FOIS) ===
@@ -383,21 +1544,42 @@ if __name__ == "__main__":
     print("Initialisation du client Kerberos...")
     try:
         K_CLIENT = KerberosClient()
-        print("Scan des utilisateurs actifs...")
-        users, worlds, flags = scan_active_users(K_CLIENT)
-
-        print(f"\nAjout/Mise à jour de {len(users)} utilisateurs...")
-        for user in users:
-            add_user(user)
-
-        print(f"\nAjout/Mise à jour de {len(worlds)} entrées de mondes...")
-        for world in worlds:
-            add_world(world)
-
-        print(f"\nAjout de {len(flags)} nouveaux flags...")
-        for flag in flags:
-            add_flag(flag)
+        print("Scan des utilisateurs actifs (écriture au fil de l'eau)...")
+        profiler = ScanProfiler() if args.profile else None
+        stats = scan_to_database(K_CLIENT, protected=args.protected, profile=profiler)
+        if profiler is not None:
+            print(profiler.summary())
+            profiler.save(args.profile)
+            print(f"Profil détaillé écrit dans {args.profile}")
 
+        print(
+            f"\n{stats['scanned']}/{stats['worlds']} mondes enregistrés "
+            f"({stats['resumed']} repris d'un passage interrompu, "
+            f"{stats['cached_negative']} ignorés par le cache négatif) "
+            f"({stats['batches']} lots), {stats['empty']} sans utilisateur, "
+            f"{stats['errors']} erreurs de scan, {stats['write_errors']} erreurs d'écriture."
+        )
+        print(
+            f"Complétude du passage: {stats['completeness']}% "
+            f"({stats['recovered']}/{stats['retried']} mondes récupérés en reprise, "
+            f"erreurs transitoires: {stats['errors_transient']}, "
+            f"permanentes: {stats['errors_permanent']})"
+        )
+        print(
+            f"Nouveaux utilisateurs: {stats['new_users']}, "
+            f"positions mises à jour: {stats['moved']}, "
+            f"nouveaux flags: {stats['new_flags']}"
+        )
+        print(
+            f"Mondes inchangés (aucune écriture): {stats['unchanged']}, "
+            f"requêtes d'écriture: {stats['statements']}"
+        )
+        # Les transitions au-delà de la rétention sont résumées en occupation horaire
+        conn = connect_db()
+        print(f"Historique des positions résumé: {compact_positions(conn)}")
+        print(f"Maintenance (archives mensuelles, ANALYZE, vacuum): {run_maintenance(conn)}")
+        print(f"Copie de lecture publiée: génération {publish_snapshot(conn)}.")
+        conn.close()
         print("\nOpérations terminées.")
 
     except Exception as e:
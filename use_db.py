@@ -2,158 +2,161 @@
 from kerberos import *  # Assumes jprint is available here
 import sqlite3
 import datetime
-import os  # Import os
-
-# --- Configuration ---
-DB_DIR = "db"
-DATABASE_FILE = os.path.join(
-    DB_DIR, "game_data.db"
-)  # Chemin vers le fichier de DB unique
-# --- Fin Configuration ---
+from db_access import (
+    compare_flag_bases_with_all,
+    get_pool,
+    get_user,
+    last_position,
+    last_positions,
+    list_users as _list_users,
+    user_flags as _user_flags,
+)
+from flag_bitmaps import RIVALS_K, load_flag_bitmaps
+from update_db import position_at, position_trail
+
+# Connexions en lecture gardées ouvertes d'un appel à l'autre (voir db_access.py)
+pool = get_pool(readonly=True)
 
 
 def user_flags(username, date=False):
     """Récupère les flags d'un utilisateur depuis la DB unique."""
-    conn = None  # Initialiser pour le bloc finally
     try:
-        conn = sqlite3.connect(DATABASE_FILE)  # <-- CHANGEMENT ICI
-        cursor = conn.cursor()
-        if date:
-            # Utilise la colonne 'created_at' de la table flags pour la date d'ajout du flag
-            # Ou 'date' si tu veux la date associée au flag lui-même (du jeu)
-            cursor.execute(
-                # "SELECT flag, created_at FROM flags WHERE username=?", # Date d'ajout à la DB
-                "SELECT flag, date FROM flags WHERE username=?",  # Date du flag issue du jeu
-                (username,),
-            )
-            flags_with_dates = []
-            for row in cursor.fetchall():
-                flag = row[0]
-                original_date_str = row[1]  # C'est la date fournie par le jeu
-
-                # Tentative de formatage si la date du jeu est exploitable, sinon on garde la string
-                try:
-                    # Adapte ce format si la date du jeu n'est pas en ISO
-                    created_at_dt = datetime.datetime.fromisoformat(
-                        original_date_str.replace("Z", "+00:00")
-                    )
-                    formatted_date = created_at_dt.strftime("%d/%m/%Y %H:%M")
-                except (ValueError, TypeError):
-                    # Si la date n'est pas au format ISO ou est None
-                    formatted_date = original_date_str  # Retourne la date brute
-
-                flags_with_dates.append((flag, formatted_date))
-            return flags_with_dates
-        else:
-            cursor.execute("SELECT flag FROM flags WHERE username=?", (username,))
-            flags = [row[0] for row in cursor.fetchall()]
-            return flags
+        with pool.connection() as conn:
+            flags = _user_flags(conn, username)
     except sqlite3.Error as e:
         print(f"Erreur SQLite dans user_flags pour {username}: {e}")
         return []  # Retourne une liste vide en cas d'erreur
-    finally:
-        if conn:
-            conn.close()
+    if not date:
+        return [entry.flag for entry in flags]
+    # La date du jeu est affichée dans son propre décalage horaire (date_epoch est en UTC)
+    return [(entry.flag, _format_flag_date(entry.date)) for entry in flags]
+
+
+def _format_flag_date(date):
+    """Date ISO du jeu en "jj/mm/aaaa hh:mm" ; une date illisible est retournée brute."""
+    try:
+        return datetime.datetime.fromisoformat(date.replace("Z", "+00:00")).strftime("%d/%m/%Y %H:%M")
+    except (ValueError, TypeError, AttributeError):
+        return date
 
 
 def list_users():
     """Liste tous les utilisateurs depuis la DB unique."""
-    conn = None
     try:
-        conn = sqlite3.connect(DATABASE_FILE)  # <-- CHANGEMENT ICI
-        cursor = conn.cursor()
-        cursor.execute("SELECT username FROM users")
-        users = [row[0] for row in cursor.fetchall()]
-        return users
+        with pool.connection() as conn:
+            return [user.username for user in _list_users(conn)]
     except sqlite3.Error as e:
         print(f"Erreur SQLite dans list_users: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
 
 
 def users_flags():
-    """Compte les flags pour chaque utilisateur."""
-    users = list_users()
-    res = {}
-    print(f"Comptage des flags pour {len(users)} utilisateurs...")
-    for user in users:
-        # Note: user_flags retourne déjà une liste, len() est direct
-        res[user] = len(user_flags(user))
-    return res
+    """Compte les flags pour chaque utilisateur (agrégat user_flag_counts)."""
+    try:
+        with pool.connection() as conn:
+            return {user.username: user.flag_count for user in _list_users(conn)}
+    except sqlite3.Error as e:
+        print(f"Erreur SQLite dans users_flags: {e}")
+        return {}
 
 
 def where_is(username):
     """Trouve la dernière position connue d'un utilisateur depuis la DB unique."""
-    conn = None
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-        # On assume que la colonne 'created_at' dans 'worlds' reflète la dernière mise à jour
-        cursor.execute(
-            """
-            SELECT username, world_ID, location, room
-            FROM worlds
-            WHERE username=?
-            ORDER BY created_at DESC
-            LIMIT 1
-            """,
-            (username,),
-        )
-        pos = cursor.fetchone()
-        if pos:
-            return {"user": pos[0], "world": pos[1], "location": pos[2], "room": pos[3]}
-        else:
-            return None  # Retourne None si l'utilisateur n'est pas trouvé dans worlds
+        with pool.connection() as conn:
+            pos = last_position(conn, username)
     except sqlite3.Error as e:
         print(f"Erreur SQLite dans where_is pour {username}: {e}")
         return None
-    finally:
-        if conn:
-            conn.close()
+    if pos is None:
+        return None  # Retourne None si l'utilisateur n'est pas trouvé dans worlds
+    return {"user": pos.username, "world": pos.world_ID, "location": pos.location, "room": pos.room}
 
 
-def flags_diff(name1, name2):
-    """Compare les flags entre deux utilisateurs."""
-    # Récupère les listes de flags (sans la date)
-    flags1_raw = user_flags(name1)
-    flags2_raw = user_flags(name2)
+def where_are(usernames=None):
+    """
+    Dernière position connue de plusieurs utilisateurs (tous par défaut),
+    en une requête : {username: {"user", "world", "location", "room"}}.
+    """
+    try:
+        with pool.connection() as conn:
+            positions = last_positions(conn, usernames)
+    except sqlite3.Error as e:
+        print(f"Erreur SQLite dans where_are: {e}")
+        return {}
+    return {
+        user: {"user": pos.username, "world": pos.world_ID, "location": pos.location, "room": pos.room}
+        for user, pos in positions.items()
+    }
+
 
-    # NOTE: La logique split(':') est conservée au cas où tes flags ont ce format.
-    # Si tes flags sont juste des strings simples, cette partie n'aura pas d'effet.
-    # Adapte ou supprime le .split(':')[0] si nécessaire.
-    flags1 = {elt.split(":")[0] for elt in flags1_raw}
-    flags2 = {elt.split(":")[0] for elt in flags2_raw}
+def where_was(username, when):
+    """
+    Position d'un utilisateur à un instant passé (datetime ou secondes epoch),
+    d'après l'historique des positions (voir update_db.position_at).
+    """
+    if isinstance(when, datetime.datetime):
+        when = when.timestamp()
+    try:
+        with pool.connection() as conn:
+            return position_at(conn, username, when)
+    except sqlite3.Error as e:
+        print(f"Erreur SQLite dans where_was pour {username}: {e}")
+        return None
 
-    ahead = list(flags1 - flags2)  # Flags que name1 a et name2 n'a pas
-    behind = list(flags2 - flags1)  # Flags que name2 a et name1 n'a pas
 
+def trail(username, start, end):
+    """Parcours d'un utilisateur entre deux instants (datetime ou secondes epoch)."""
+    start, end = (t.timestamp() if isinstance(t, datetime.datetime) else t for t in (start, end))
+    try:
+        with pool.connection() as conn:
+            return position_trail(conn, username, start, end)
+    except sqlite3.Error as e:
+        print(f"Erreur SQLite dans trail pour {username}: {e}")
+        return []
+
+
+def flags_diff(name1, name2):
+    """Compare les flags entre deux utilisateurs (index bitmap, voir flag_bitmaps.py)."""
+    # flag_base est la partie avant ':' (le flag entier s'il n'y en a pas)
+    try:
+        with pool.connection() as conn:
+            index = load_flag_bitmaps(conn, [name1, name2])
+    except sqlite3.Error as e:
+        print(f"Erreur SQLite dans flags_diff pour {name1}/{name2}: {e}")
+        return {"ahead": [], "behind": []}
+
+    diff = index.compare(name1, name2, with_suffix_only=False)
     return {
-        "ahead": sorted(ahead),  # Trie pour une sortie cohérente
-        "behind": sorted(behind),
+        "ahead": index.bases(diff["ahead"]),  # name1 a, name2 non
+        "behind": index.bases(diff["behind"]),  # name2 a, name1 non
     }
 
 
+def rivals(username, k=RIVALS_K):
+    """Les k utilisateurs à la progression la plus proche (voir FlagBitmapIndex.rivals)."""
+    try:
+        with pool.connection() as conn:
+            return load_flag_bitmaps(conn).rivals(username, k, with_suffix_only=False)
+    except sqlite3.Error as e:
+        print(f"Erreur SQLite dans rivals pour {username}: {e}")
+        return []
+
+
 def compare_user(user_to_compare):
-    """Compare un utilisateur avec tous les autres."""
-    users = list_users()
-    if user_to_compare not in users:
-        print(f"Utilisateur '{user_to_compare}' non trouvé dans la base de données.")
+    """Compare un utilisateur avec tous les autres (une seule requête, voir db_access)."""
+    try:
+        with pool.connection() as conn:
+            if get_user(conn, user_to_compare) is None:
+                print(f"Utilisateur '{user_to_compare}' non trouvé dans la base de données.")
+                return None
+            diffs = compare_flag_bases_with_all(conn, user_to_compare, with_suffix_only=False)
+    except sqlite3.Error as e:
+        print(f"Erreur SQLite dans compare_user pour {user_to_compare}: {e}")
         return None
 
-    res = {}
-    print(
-        f"Comparaison de '{user_to_compare}' avec {len(users)-1} autres utilisateurs..."
-    )
-    for user in users:
-        if user == user_to_compare:
-            continue
-        diff = flags_diff(user_to_compare, user)
-        # On peut choisir de ne stocker que s'il y a des différences
-        if diff["ahead"] or diff["behind"]:
-            res[user] = diff
-    return res
+    # Seuls les utilisateurs avec des différences sont retournés
+    return {user: {"ahead": ahead, "behind": behind} for user, (ahead, behind) in diffs.items()}
 
 
 if __name__ == "__main__":
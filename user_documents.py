@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Documents /api/user/<username> précalculés.
+
+La page d'un utilisateur lisait users, flags et worlds (et triait les
+flags) à chaque requête. user_documents garde pour chaque utilisateur le
+JSON prêt à servir, construit par SQLite :
+
+    {"details": {...}, "flags": [{"date", "flag"}], "last_position": {...} | null}
+
+Un utilisateur présent seulement dans flags ou worlds a des détails à
+null (sauf username). Un utilisateur qui n'existe plus garde sa ligne,
+avec un document NULL : l'API répond 404.
+
+Mise à jour incrémentale, comme l'index bitmap (flag_bitmaps.py) : des
+triggers sur users, flag_rows et world_rows notent l'utilisateur dans
+user_documents_dirty ; refresh_user_documents réécrit les seuls
+documents notés (appelée à l'ingestion, dans la transaction
+d'écriture). Tous les documents réécrits ensemble reçoivent la même
+version, supérieure à toutes les précédentes : l'API en fait l'ETag.
+Les tables et triggers sont créés par la migration 8 (migrations.py).
+
+    python user_documents.py user1       # affiche le document de user1
+    python user_documents.py --rebuild   # réécrit tous les documents
+"""
+import argparse
+
+from surrogate_keys import FLAG_ROW_COLUMNS
+
+DOCUMENT_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS user_documents (
+        username TEXT PRIMARY KEY,
+        document TEXT,
+        version INTEGER NOT NULL
+    )
+    """,
+    "CREATE TABLE IF NOT EXISTS user_documents_dirty (username TEXT PRIMARY KEY)",
+]
+
+# Nom de l'utilisateur d'une ligne de flag_rows ou world_rows ({row} : NEW ou OLD)
+_ROW_USERNAME = FLAG_ROW_COLUMNS["username"]
+
+
+def _mark(username):
+    """
+    Corps de trigger : document de 'username' (expression SQL) à réécrire.
+    ON CONFLICT plutôt que OR IGNORE : sous l'upsert du trigger de la vue
+    worlds (surrogate_keys.py), SQLite imposerait sa propre résolution de
+    conflit à un OR IGNORE, et l'utilisateur déjà noté ferait échouer l'écriture.
+    """
+    return f"""
+        INSERT INTO user_documents_dirty (username)
+            SELECT {username} WHERE {username} IS NOT NULL
+            ON CONFLICT (username) DO NOTHING;
+    """
+
+
+def _row_triggers(table, watched):
+    old, new = (_ROW_USERNAME.format(row=row) for row in ("OLD", "NEW"))
+    return [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_documents_{table}_insert AFTER INSERT ON {table}
+        BEGIN {_mark(new)} END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_documents_{table}_delete AFTER DELETE ON {table}
+        BEGIN {_mark(old)} END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_documents_{table}_update AFTER UPDATE OF {watched} ON {table}
+        BEGIN {_mark(old)} {_mark(new)} END
+        """,
+    ]
+
+
+DOCUMENT_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_documents_users_insert AFTER INSERT ON users
+    BEGIN {_mark('NEW.username')} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_documents_users_delete AFTER DELETE ON users
+    BEGIN {_mark('OLD.username')} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_documents_users_update AFTER UPDATE ON users
+    BEGIN {_mark('OLD.username')} {_mark('NEW.username')} END
+    """,
+    *_row_triggers("flag_rows", "user_id, flag, date"),
+    *_row_triggers("world_rows", "world_key, user_id, location_key, room_key, created_at"),
+]
+
+
+def _document_sql(username):
+    """
+    Expression SQL du document de 'username' (expression SQL), NULL si
+    l'utilisateur n'est ni dans users, ni dans flags, ni dans worlds.
+    Clés triées comme jsonify ; mêmes requêtes que db_access.get_user,
+    user_flags_json et last_position.
+    """
+    return f"""
+        CASE WHEN EXISTS (SELECT 1 FROM users WHERE username = {username})
+               OR EXISTS (SELECT 1 FROM flags WHERE username = {username})
+               OR EXISTS (SELECT 1 FROM worlds WHERE username = {username})
+        THEN json_object(
+            'details', (
+                SELECT json_object(
+                    'blocked', u.blocked, 'created_at', u.created_at, 'email', u.email,
+                    'filiere', u.filiere, 'first_name', u.first_name, 'last_name', u.last_name,
+                    'profile', u.profile, 'username', {username}
+                )
+                FROM (SELECT {username} AS username) n
+                LEFT JOIN users u ON u.username = n.username
+            ),
+            'flags', (
+                SELECT json_group_array(json_object('date', date, 'flag', flag))
+                FROM (SELECT flag, date FROM flags WHERE username = {username} ORDER BY date DESC)
+            ),
+            'last_position', json((
+                SELECT json_object('created_at', created_at, 'location', location, 'room', room, 'world_ID', world_ID)
+                FROM worlds WHERE username = {username}
+                ORDER BY created_at DESC, world_ID DESC LIMIT 1
+            ))
+        )
+        END
+    """
+
+
+def build_user_document(conn, username):
+    """Document de 'username' calculé à la volée (texte JSON), ou None s'il n'existe pas."""
+    return conn.execute(f"SELECT {_document_sql(':username')}", {"username": username}).fetchone()[0]
+
+
+def refresh_user_documents(conn):
+    """
+    Réécrit les documents des utilisateurs notés par les triggers (sans
+    commit, dans la transaction de l'appelant). Retourne le nombre de
+    requêtes exécutées (une seule si personne n'est noté).
+    """
+    if conn.execute("SELECT 1 FROM user_documents_dirty LIMIT 1").fetchone() is None:
+        return 1
+    version = conn.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM user_documents").fetchone()[0]
+    conn.execute(
+        f"""
+        INSERT INTO user_documents (username, document, version)
+        SELECT d.username, {_document_sql('d.username')}, :version
+        FROM user_documents_dirty d WHERE true
+        ON CONFLICT (username) DO UPDATE SET document = excluded.document, version = excluded.version
+        """,
+        {"version": version},
+    )
+    conn.execute("DELETE FROM user_documents_dirty")
+    return 4
+
+
+def rebuild_user_documents(conn):
+    """Réécrit le document de chaque utilisateur connu (sans commit)."""
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO user_documents_dirty (username)
+        SELECT username FROM users WHERE username IS NOT NULL
+        UNION SELECT username FROM user_keys
+        UNION SELECT username FROM user_documents
+        """
+    )
+    refresh_user_documents(conn)
+
+
+def load_user_document(conn, username):
+    """
+    (document, version) servi par l'API : une recherche par clé primaire.
+    document vaut None si l'utilisateur n'existe pas. Un document encore
+    noté pour réécriture (ou absent) est calculé à la volée, version None.
+    """
+    row = conn.execute(
+        """
+        SELECT document, version FROM user_documents
+        WHERE username = :username
+          AND NOT EXISTS (SELECT 1 FROM user_documents_dirty WHERE username = :username)
+        """,
+        {"username": username},
+    ).fetchone()
+    if row is None:
+        return build_user_document(conn, username), None
+    return tuple(row)
+
+
+if __name__ == "__main__":
+    from update_db import connect_db, initialize_database
+
+    parser = argparse.ArgumentParser(description="Documents /api/user précalculés")
+    parser.add_argument("user", nargs="?", help="utilisateur dont le document est affiché")
+    parser.add_argument("--rebuild", action="store_true", help="réécrit tous les documents")
+    args = parser.parse_args()
+
+    initialize_database()
+    conn = connect_db()
+    if args.rebuild:
+        rebuild_user_documents(conn)
+        conn.commit()
+        print(f"Documents réécrits: {conn.execute('SELECT COUNT(*) FROM user_documents').fetchone()[0]}.")
+    if args.user:
+        document, version = load_user_document(conn, args.user)
+        print(f"version {version}: {document}" if document is not None else f"Utilisateur '{args.user}' non trouvé.")
+    conn.close()